@@ -0,0 +1,56 @@
+"""Compares two benchmark result files written by `run`.
+
+    python -m backend.benchmarks.compare baseline.json bench.json
+"""
+import argparse
+import json
+from pathlib import Path
+from typing import Dict
+
+
+def _flatten(data, prefix: str = "") -> Dict[str, float]:
+    """Returns the numeric leaves of a results file keyed by their dotted path."""
+    values = {}
+    if isinstance(data, dict):
+        for key, value in data.items():
+            values.update(_flatten(value, f"{prefix}.{key}" if prefix else str(key)))
+    elif isinstance(data, (int, float)) and not isinstance(data, bool):
+        values[prefix] = float(data)
+    return values
+
+
+def compare(baseline: Dict, current: Dict) -> str:
+    old = _flatten({key: value for key, value in baseline.items() if key != "meta"})
+    new = _flatten({key: value for key, value in current.items() if key != "meta"})
+    width = max((len(key) for key in old.keys() | new.keys()), default=10)
+    lines = [f"{'metric':<{width}}  {'baseline':>12}  {'current':>12}  {'change':>8}"]
+    for key in sorted(old.keys() | new.keys()):
+        before, after = old.get(key), new.get(key)
+        if before is None or after is None:
+            change = "n/a"
+        elif before == 0:
+            change = "0.0%" if after == 0 else "n/a"
+        else:
+            change = f"{100 * (after - before) / before:+.1f}%"
+        lines.append(
+            f"{key:<{width}}  {'-' if before is None else f'{before:.3f}':>12}  "
+            f"{'-' if after is None else f'{after:.3f}':>12}  {change:>8}"
+        )
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compares two benchmark result files.")
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    args = parser.parse_args(argv)
+    baseline = json.loads(Path(args.baseline).read_text())
+    current = json.loads(Path(args.current).read_text())
+    for label, report in (("baseline", baseline), ("current", current)):
+        meta = report.get("meta", {})
+        print(f"{label}: commit {meta.get('git_commit', '?')[:12]}, python {meta.get('python', '?')}, {meta.get('cpu_count', '?')} CPUs")
+    print(compare(baseline, current))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+import csv
+import html
+import random
+from pathlib import Path
+from typing import Dict, List
+
+# Synthetic corpus for the benchmarks: pseudo-words drawn from a fixed vocabulary, so documents
+# and queries share terms and retrieval has something meaningful to match, and the same seed
+# always produces the same files.
+
+_SYLLABLES = [
+    "ka", "lo", "mi", "ra", "te", "su", "no", "vi", "pe", "do", "an", "el", "or", "is", "un",
+    "ba", "ce", "fi", "go", "hu", "ja", "ke", "li", "mo", "ne", "pa", "qi", "ro", "sa", "tu",
+]
+DOCUMENT_TYPES = ("txt", "csv", "html", "png")
+
+
+def build_vocabulary(rng: random.Random, size: int = 2000) -> List[str]:
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(_SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+def _sentence(rng: random.Random, vocabulary: List[str]) -> str:
+    words = [rng.choice(vocabulary) for _ in range(rng.randint(6, 18))]
+    return " ".join(words).capitalize() + "."
+
+
+def _paragraph(rng: random.Random, vocabulary: List[str]) -> str:
+    return " ".join(_sentence(rng, vocabulary) for _ in range(rng.randint(3, 8)))
+
+
+def generate_text(rng: random.Random, vocabulary: List[str], paragraphs: int) -> str:
+    return "\n\n".join(_paragraph(rng, vocabulary) for _ in range(paragraphs))
+
+
+def _write_txt(path: Path, rng: random.Random, vocabulary: List[str], paragraphs: int):
+    path.write_text(generate_text(rng, vocabulary, paragraphs), encoding="utf-8")
+
+
+def _write_csv(path: Path, rng: random.Random, vocabulary: List[str], paragraphs: int):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["id", "name", "description"])
+        for row in range(paragraphs * 5):
+            writer.writerow([row, rng.choice(vocabulary).title(), _sentence(rng, vocabulary)])
+
+
+def _write_html(path: Path, rng: random.Random, vocabulary: List[str], paragraphs: int):
+    body = "\n".join(
+        f"<h2>{html.escape(_sentence(rng, vocabulary))}</h2>\n<p>{html.escape(_paragraph(rng, vocabulary))}</p>"
+        for _ in range(paragraphs)
+    )
+    path.write_text(f"<html><head><title>{path.stem}</title></head><body>\n{body}\n</body></html>", encoding="utf-8")
+
+
+def _write_png(path: Path, rng: random.Random, vocabulary: List[str], paragraphs: int):
+    """Renders a page of text, as a stand-in for a scanned document."""
+    from PIL import Image, ImageDraw
+
+    image = Image.new("L", (1240, 1754), 255)  # A4 at 150 DPI
+    draw = ImageDraw.Draw(image)
+    y = 60
+    for _ in range(min(paragraphs, 6)):
+        words = _paragraph(rng, vocabulary).split()
+        line = []
+        for word in words:
+            line.append(word)
+            if len(line) == 12:
+                draw.text((60, y), " ".join(line), fill=0)
+                line, y = [], y + 24
+        if line:
+            draw.text((60, y), " ".join(line), fill=0)
+            y += 24
+        y += 24
+    image.save(path, dpi=(150, 150))
+
+
+_WRITERS = {"txt": _write_txt, "csv": _write_csv, "html": _write_html, "png": _write_png}
+
+
+def write_corpus(directory: Path, counts: Dict[str, int], seed: int = 0, paragraphs: int = 20) -> Dict[str, List[Path]]:
+    """Writes `counts[type]` synthetic documents of each type and returns their paths by type."""
+    rng = random.Random(seed)
+    vocabulary = build_vocabulary(rng)
+    directory.mkdir(parents=True, exist_ok=True)
+    files = {}
+    for doc_type, count in counts.items():
+        files[doc_type] = []
+        for number in range(count):
+            path = directory / f"{doc_type}_{number:05d}.{doc_type}"
+            _WRITERS[doc_type](path, rng, vocabulary, paragraphs)
+            files[doc_type].append(path)
+    return files
+
+
+def make_queries(count: int, seed: int = 0) -> List[str]:
+    """Returns short queries over the same vocabulary as the corpus of the same seed."""
+    vocabulary = build_vocabulary(random.Random(seed))
+    rng = random.Random(seed + 1)
+    return [" ".join(rng.choice(vocabulary) for _ in range(rng.randint(3, 8))) + "?" for _ in range(count)]
+
+
+def make_chunk_texts(count: int, seed: int = 0) -> List[str]:
+    """Returns chunk-sized texts for growing an index without going through parsing."""
+    vocabulary = build_vocabulary(random.Random(seed))
+    rng = random.Random(seed + 2)
+    return [_paragraph(rng, vocabulary) for _ in range(count)]
@@ -0,0 +1,351 @@
+"""Offline benchmarks of the ingest and query hot paths.
+
+Run from beautirag-app/src:
+
+    python -m backend.benchmarks.run --output bench.json
+    python -m backend.benchmarks.compare baseline.json bench.json
+
+Everything runs in a temporary DATA_DIR with a hashing embedding model and a fake LLM
+(see `stubs`), so no model download, API key or network access is needed. Parsing still
+uses the real loaders, so Unstructured (and Tesseract for images) must be installed.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+
+from . import corpus
+
+
+def _percentiles(samples_ms: List[float]) -> Dict[str, float]:
+    if not samples_ms:
+        return {}
+    p50, p95, p99 = np.percentile(samples_ms, [50, 95, 99])
+    return {"p50_ms": round(float(p50), 3), "p95_ms": round(float(p95), 3), "p99_ms": round(float(p99), 3)}
+
+
+def _peak_rss_mb() -> Dict[str, float]:
+    # ru_maxrss is in kilobytes on Linux (bytes on macOS)
+    divisor = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return {
+        "self": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / divisor, 1),
+        "children": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / divisor, 1),
+    }
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=Path(__file__).resolve().parent,
+        ).stdout.strip()
+    except Exception:
+        return ""
+
+
+# --- Ingest ---
+def bench_ingest(files_by_type: Dict[str, List[Path]]) -> Dict:
+    """Runs each document type through the real ingestion job pipeline (parse pool, split, embed, save)."""
+    import hashlib
+    from ..services import ingestion_jobs, ingestion_manifest
+
+    results = {}
+    for doc_type, paths in files_by_type.items():
+        if not paths:
+            continue
+        content_hashes = {}
+        for path in paths:
+            content_hashes[path.name] = hashlib.sha256(path.read_bytes()).hexdigest()
+            ingestion_manifest.claim(path.name, content_hashes[path.name])
+        start = time.perf_counter()
+        job = ingestion_jobs.submit_job(paths, content_hashes)
+        while not job.is_finished:
+            time.sleep(0.02)
+        elapsed = time.perf_counter() - start
+        state = job.to_dict()
+        indexed = len(paths) - len(state["failed_files"])
+        results[doc_type] = {
+            "documents": len(paths),
+            "failed": len(state["failed_files"]),
+            "chunks": state["chunks"],
+            "seconds": round(elapsed, 3),
+            "docs_per_second": round(indexed / elapsed, 2),
+            "chunks_per_second": round(state["chunks"] / elapsed, 1),
+        }
+        print(f"ingest {doc_type}: {results[doc_type]}")
+    return results
+
+
+# --- Index size sweep ---
+def bench_index_sizes(sizes: List[int], queries: List[str], seed: int) -> Dict:
+    """Grows the index to each size and measures save/compaction time and retrieval latency."""
+    from langchain_core.documents import Document
+    from ..services import rag_pipeline, vector_store_manager
+
+    results = {}
+    texts = corpus.make_chunk_texts(1000, seed)
+    added = 0
+    for size in sorted(sizes):
+        current = vector_store_manager.get_index_stats()["chunks"]
+        missing = size - current
+        if missing < 0:
+            print(f"index already holds {current} chunks, skipping size {size}")
+            continue
+        add_start = time.perf_counter()
+        while missing > 0:
+            batch = []
+            for _ in range(min(missing, 1000)):
+                batch.append(Document(
+                    page_content=f"{texts[added % len(texts)]} {added}",
+                    metadata={"source": "synthetic", "chunk_id": f"synthetic-{seed}-{added}"},
+                ))
+                added += 1
+            missing -= vector_store_manager.add_chunks_to_store(batch, save=False)
+        add_seconds = time.perf_counter() - add_start
+
+        save_start = time.perf_counter()
+        vector_store_manager.save_vector_store()
+        save_seconds = time.perf_counter() - save_start
+        compact_start = time.perf_counter()
+        vector_store_manager.compact_index()
+        compact_seconds = time.perf_counter() - compact_start
+
+        latencies = []
+        for query in queries:
+            query_start = time.perf_counter()
+            rag_pipeline._retrieve(query)
+            latencies.append((time.perf_counter() - query_start) * 1000)
+
+        vectors = vector_store_manager.embed_queries(queries)
+        batch_start = time.perf_counter()
+        vector_store_manager.similarity_search_batch(vectors, rag_pipeline.RETRIEVAL_K)
+        batch_seconds = time.perf_counter() - batch_start
+
+        results[str(size)] = {
+            "add_seconds": round(add_seconds, 3),
+            "save_seconds": round(save_seconds, 3),
+            "compact_seconds": round(compact_seconds, 3),
+            "retrieval": _percentiles(latencies),
+            "batch_search_queries_per_second": round(len(queries) / batch_seconds, 1) if batch_seconds else None,
+        }
+        print(f"index size {size}: {results[str(size)]}")
+    return results
+
+
+# --- Embedding backends ---
+def _embedding_model(spec: str):
+    """Builds the model of a backend spec "<backend>[_int8][@<workers>]", e.g. "onnx_int8@4".
+
+    "hashing" is the stub model, to check the benchmark without downloading a model.
+    """
+    from functools import partial
+    from ..services import embedding_backends
+    from . import stubs
+
+    name, _, workers = spec.partition("@")
+    workers = int(workers or 0)
+    threads = max(1, (os.cpu_count() or 1) // workers) if workers > 1 else 0
+    if name == "hashing":
+        factory = stubs.HashingEmbeddings
+    else:
+        int8 = name.endswith("_int8")
+        factory = partial(embedding_backends.create_backend, name[:-len("_int8")] if int8 else name, int8, threads)
+    if workers > 1:
+        return embedding_backends.MultiProcessEmbeddings(factory, workers, min_texts=1)
+    return factory()
+
+
+def _normalized(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms > 0, norms, 1)
+
+
+def _agreement(vectors: np.ndarray, reference: np.ndarray, k: int = 10, sample: int = 200) -> Dict:
+    """Cosine similarity of each vector to the reference one, and overlap of their k nearest neighbours."""
+    vectors, reference = _normalized(vectors), _normalized(reference)
+    cosines = np.sum(vectors * reference, axis=1)
+    queries = np.random.default_rng(0).choice(len(vectors), min(sample, len(vectors)), replace=False)
+    found = np.argsort(-(vectors[queries] @ vectors.T), axis=1)[:, :k]
+    expected = np.argsort(-(reference[queries] @ reference.T), axis=1)[:, :k]
+    overlap = np.mean([len(set(row_found) & set(row_expected)) / k for row_found, row_expected in zip(found, expected)])
+    return {
+        "mean_cosine": round(float(cosines.mean()), 6),
+        "min_cosine": round(float(cosines.min()), 6),
+        f"neighbour_overlap_at_{k}": round(float(overlap), 4),
+    }
+
+
+def bench_embedding_backends(specs: List[str], texts: List[str]) -> Dict:
+    """Measures each backend's embedding throughput, and how closely its vectors agree with the first one's."""
+    from ..services.embedding_backends import MultiProcessEmbeddings
+
+    results = {}
+    reference = None
+    for spec in specs:
+        model = _embedding_model(spec)
+        try:
+            # Loads inference kernels, and starts the workers of a pool
+            model.embed_documents(texts[:16])
+            start = time.perf_counter()
+            vectors = np.asarray(model.embed_documents(texts), dtype=np.float32)
+            seconds = time.perf_counter() - start
+        finally:
+            if isinstance(model, MultiProcessEmbeddings):
+                model.shutdown()
+        result = {"texts": len(texts), "seconds": round(seconds, 3), "texts_per_second": round(len(texts) / seconds, 1)}
+        if reference is None:
+            reference = vectors
+        elif vectors.shape == reference.shape:
+            result["agreement_with"] = specs[0]
+            result.update(_agreement(vectors, reference))
+        results[spec] = result
+        print(f"embedding {spec}: {result}")
+    return results
+
+
+# --- Query throughput ---
+async def _run_queries(queries: List[str], concurrency: int) -> Dict:
+    from ..services import rag_pipeline
+
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+
+    async def one(query: str):
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            result = await rag_pipeline.aquery_rag(query, use_cache=False)
+            latencies.append((time.perf_counter() - start) * 1000)
+            if result["response"].startswith(("Error", "Configuration Error", "An unexpected error")):
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(query) for query in queries))
+    elapsed = time.perf_counter() - start
+    return {
+        "queries": len(queries),
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "queries_per_second": round(len(queries) / elapsed, 2),
+        "latency": _percentiles(latencies),
+    }
+
+
+async def _bench_query_throughput(queries: List[str], concurrency_levels: List[int]) -> Dict:
+    results = {}
+    for concurrency in concurrency_levels:
+        count = max(4 * concurrency, 20)
+        sample = [queries[i % len(queries)] for i in range(count)]
+        results[str(concurrency)] = await _run_queries(sample, concurrency)
+        print(f"query concurrency {concurrency}: {results[str(concurrency)]}")
+    return results
+
+
+def bench_query_throughput(queries: List[str], concurrency_levels: List[int]) -> Dict:
+    """Measures end-to-end `aquery_rag` throughput against the fake LLM at each concurrency level.
+
+    All levels share one event loop, like the API server, since the provider limits are loop-bound.
+    """
+    return asyncio.run(_bench_query_throughput(queries, concurrency_levels))
+
+
+def _parse_int_list(value: str) -> List[int]:
+    return [int(item) for item in value.split(",") if item]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline ingest and query benchmarks.")
+    parser.add_argument("--output", default="bench.json", help="Where to write the JSON results.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--docs", type=int, default=20, help="Documents per type for the ingest benchmark.")
+    parser.add_argument("--paragraphs", type=int, default=20, help="Paragraphs per synthetic document.")
+    parser.add_argument("--types", default="txt,csv,html,png", help="Document types to ingest.")
+    parser.add_argument("--sizes", type=_parse_int_list, default=[1_000, 10_000, 50_000],
+                        help="Index sizes (chunks) for the save and retrieval benchmarks.")
+    parser.add_argument("--queries", type=int, default=200, help="Queries per retrieval measurement.")
+    parser.add_argument("--concurrency", type=_parse_int_list, default=[1, 4, 16, 64])
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="Fake LLM time to first token, in seconds.")
+    parser.add_argument("--llm-tokens-per-second", type=float, default=200.0)
+    parser.add_argument("--embedding-backends", default="",
+                        help="Embedding backends to compare, e.g. sentence_transformers,onnx,onnx_int8,onnx_int8@4 "
+                             "(<backend>[_int8][@<workers>]; the first is the reference for vector agreement).")
+    parser.add_argument("--embedding-texts", type=int, default=2000, help="Chunk texts embedded per backend.")
+    parser.add_argument("--keep", action="store_true", help="Keep the temporary data directory.")
+    args = parser.parse_args(argv)
+
+    work_dir = Path(tempfile.mkdtemp(prefix="beautirag-bench-"))
+    # Must be set before the backend modules read their configuration
+    os.environ["DATA_DIR"] = str(work_dir / "data")
+    os.environ.setdefault("STARTUP_MODE", "lazy")
+
+    from ..core import config
+    from ..services import ingestion_jobs
+    from . import stubs
+
+    config.ensure_data_dirs()
+    stubs.install(llm_latency_seconds=args.llm_latency, llm_tokens_per_second=args.llm_tokens_per_second)
+
+    types = [doc_type for doc_type in args.types.split(",") if doc_type]
+    if "png" in types and shutil.which("tesseract") is None:
+        print("tesseract not found, skipping image ingestion")
+        types.remove("png")
+
+    report = {
+        "meta": {
+            "timestamp": time.time(),
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "args": vars(args),
+            "config": {
+                "INDEX_TYPE": config.INDEX_TYPE,
+                "INGEST_PARSE_WORKERS": config.INGEST_PARSE_WORKERS,
+                "INGEST_EMBED_BATCH_SIZE": config.INGEST_EMBED_BATCH_SIZE,
+                "EMBEDDING_BATCH_SIZE": config.EMBEDDING_BATCH_SIZE,
+                "LLM_MAX_CONCURRENCY": config.LLM_MAX_CONCURRENCY,
+                "RETRIEVAL_K": config.RETRIEVAL_K,
+            },
+        },
+        "peak_rss_mb": {},
+    }
+    try:
+        files = corpus.write_corpus(work_dir / "corpus", {doc_type: args.docs for doc_type in types}, args.seed, args.paragraphs)
+        report["ingest"] = bench_ingest(files)
+        report["peak_rss_mb"]["after_ingest"] = _peak_rss_mb()
+
+        queries = corpus.make_queries(args.queries, args.seed)
+        report["index_sizes"] = bench_index_sizes(args.sizes, queries, args.seed)
+        report["peak_rss_mb"]["after_index_sizes"] = _peak_rss_mb()
+
+        report["query_throughput"] = bench_query_throughput(queries, args.concurrency)
+        report["peak_rss_mb"]["after_queries"] = _peak_rss_mb()
+
+        embedding_specs = [spec for spec in args.embedding_backends.split(",") if spec]
+        if embedding_specs:
+            report["embedding_backends"] = bench_embedding_backends(
+                embedding_specs, corpus.make_chunk_texts(args.embedding_texts, args.seed)
+            )
+    finally:
+        ingestion_jobs.shutdown(wait=True)
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    Path(args.output).write_text(json.dumps(report, indent=2))
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
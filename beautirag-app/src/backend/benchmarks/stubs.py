@@ -0,0 +1,87 @@
+import asyncio
+import re
+import time
+import zlib
+from typing import Any, AsyncIterator, Iterator, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+_TOKEN_PATTERN = re.compile(r"\w+")
+
+
+class HashingEmbeddings(Embeddings):
+    """Deterministic bag-of-words embeddings built by feature hashing.
+
+    Texts sharing words get similar vectors, so retrieval over the synthetic corpus behaves
+    like it would with a real model, without downloading or running one.
+    """
+
+    def __init__(self, dim: int = 384):
+        self.dim = dim
+
+    def _embed(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for token in _TOKEN_PATTERN.findall(text.lower()):
+            digest = zlib.crc32(token.encode("utf-8"))
+            vector[digest % self.dim] += 1.0 if digest & 0x80000000 else -1.0
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(text).tolist() for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text).tolist()
+
+
+class FakeChatModel(BaseChatModel):
+    """Local stand-in for the provider chat models: waits `latency_seconds` (time to first
+    token), then produces `answer_tokens` tokens at `tokens_per_second`."""
+
+    latency_seconds: float = 0.2
+    tokens_per_second: float = 200.0
+    answer_tokens: int = 40
+
+    @property
+    def _llm_type(self) -> str:
+        return "benchmark-fake"
+
+    def _tokens(self) -> List[str]:
+        return [f"token{number} " for number in range(self.answer_tokens)]
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> ChatResult:
+        time.sleep(self.latency_seconds + self.answer_tokens / self.tokens_per_second)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="".join(self._tokens())))])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> ChatResult:
+        await asyncio.sleep(self.latency_seconds + self.answer_tokens / self.tokens_per_second)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="".join(self._tokens())))])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        time.sleep(self.latency_seconds)
+        for token in self._tokens():
+            time.sleep(1 / self.tokens_per_second)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        await asyncio.sleep(self.latency_seconds)
+        for token in self._tokens():
+            await asyncio.sleep(1 / self.tokens_per_second)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+
+def install(embedding_dim: int = 384, llm_latency_seconds: float = 0.2, llm_tokens_per_second: float = 200.0):
+    """Swaps the embedding model and every provider LLM of the backend for the local stubs."""
+    from ..services import rag_pipeline, vector_store_manager
+
+    vector_store_manager.set_embedding_model(HashingEmbeddings(embedding_dim))
+
+    def create_fake_llm(model_name: str, api_key: Optional[str] = None, **kwargs):
+        return FakeChatModel(latency_seconds=llm_latency_seconds, tokens_per_second=llm_tokens_per_second)
+
+    rag_pipeline._create_llm = create_fake_llm
+    rag_pipeline.clear_caches()
@@ -11,25 +11,132 @@ APP_DIR = SRC_DIR.parent
 WORKSPACE_DIR = APP_DIR.parent
 
 # --- Data Storage Paths ---
-DATA_DIR = BACKEND_DIR / "data"
+# Can be pointed elsewhere, e.g. to keep benchmark runs away from the real index
+DATA_DIR = Path(os.getenv("DATA_DIR", BACKEND_DIR / "data"))
 UPLOADED_FILES_DIR = DATA_DIR / "uploaded_files"
 PROCESSED_FILES_DIR = DATA_DIR / "processed_files"
 FAISS_INDEX_DIR = DATA_DIR / "faiss_index"
+# Content hashes of ingested files, their extracted text and chunk ids
+INGESTION_MANIFEST_FILE = DATA_DIR / "ingestion_manifest.sqlite3"
 
-# Create directories if they don't exist
-DATA_DIR.mkdir(parents=True, exist_ok=True)
-UPLOADED_FILES_DIR.mkdir(parents=True, exist_ok=True)
-PROCESSED_FILES_DIR.mkdir(parents=True, exist_ok=True)
-FAISS_INDEX_DIR.mkdir(parents=True, exist_ok=True)
+def ensure_data_dirs():
+    """Creates the data directories if they don't exist. Called at application startup, not on import."""
+    for directory in (DATA_DIR, UPLOADED_FILES_DIR, PROCESSED_FILES_DIR, FAISS_INDEX_DIR):
+        directory.mkdir(parents=True, exist_ok=True)
+
+# --- Startup ---
+# "lazy": models and the index load on first use, "eager": they load before the app accepts requests,
+# "background": the app starts immediately and warms them up in a background thread
+STARTUP_MODE = os.getenv("STARTUP_MODE", "background").lower()
+# Whether warmup also loads the Whisper model, which is only needed for audio uploads
+WARMUP_WHISPER = os.getenv("WARMUP_WHISPER", "false").lower() == "true"
 
 
 # --- Whisper Configuration ---
 # Model size (e.g., "tiny", "base") Larger models may require more resources
 # NOT RECOMMANDED ("small", "medium", "large-v1", "large-v2", "large-v3")
 WHISPER_MODEL_SIZE = os.getenv("WHISPER_MODEL_SIZE", "base")
+# Long recordings are cut into segments of about this length, at the quietest point within
+# AUDIO_SPLIT_SEARCH_SECONDS of each cut, and the segments are transcribed in parallel by the parse workers
+AUDIO_SEGMENT_SECONDS = float(os.getenv("AUDIO_SEGMENT_SECONDS", 300))
+AUDIO_SPLIT_SEARCH_SECONDS = float(os.getenv("AUDIO_SPLIT_SEARCH_SECONDS", 20))
+AUDIO_SEGMENTS_DIR = DATA_DIR / "audio_segments"
+
+# --- OCR Configuration ---
+# Pages of multi-page inputs (TIFF, scanned PDFs) OCRed concurrently by each parse worker
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", 4))
+OCR_LANGUAGE = os.getenv("OCR_LANGUAGE", "eng")
+# Low resolution scans are upscaled to this DPI, and huge photos downscaled to this longest side in pixels
+OCR_TARGET_DPI = int(os.getenv("OCR_TARGET_DPI", 300))
+OCR_MAX_DIMENSION = int(os.getenv("OCR_MAX_DIMENSION", 4000))
+# Converts pages to black and white (Otsu threshold) before OCR
+OCR_BINARIZE = os.getenv("OCR_BINARIZE", "true").lower() == "true"
+# OCR results cached by page image hash
+OCR_CACHE_DIR = DATA_DIR / "ocr_cache"
 
 # --- Embedding Model Configuration ---
 EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL_NAME", "all-MiniLM-L6-v2")
+# "sentence_transformers" (PyTorch) or "onnx" (ONNX Runtime, through sentence-transformers and optimum)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "sentence_transformers").lower()
+# ONNX only: run an int8 dynamically quantised copy of the model, exported to EMBEDDING_ONNX_DIR on first use
+EMBEDDING_ONNX_INT8 = os.getenv("EMBEDDING_ONNX_INT8", "false").lower() == "true"
+EMBEDDING_ONNX_DIR = DATA_DIR / "onnx_models"
+# Texts per model forward pass, and inference threads per model (0 = library default)
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", 32))
+EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS", 0))
+# Worker processes, each with a copy of the model, between which batches of at least
+# EMBEDDING_POOL_MIN_TEXTS chunks are split (0 or 1 = embed in the server process only)
+EMBEDDING_WORKERS = int(os.getenv("EMBEDDING_WORKERS", 0))
+EMBEDDING_POOL_MIN_TEXTS = int(os.getenv("EMBEDDING_POOL_MIN_TEXTS", 64))
+# On-disk cache of chunk embeddings, keyed by model name and chunk text hash
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+EMBEDDING_CACHE_DIR = DATA_DIR / "embedding_cache"
+# Maximum number of cached vectors before least recently used ones are evicted
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", 500_000))
+
+# --- Index Persistence ---
+# Number of write-ahead log records (segments and deletions) after which the index is compacted
+INDEX_COMPACTION_THRESHOLD = int(os.getenv("INDEX_COMPACTION_THRESHOLD", 32))
+# Deleted chunks stay in the index as tombstones, masked out of searches, until a compaction
+# rebuilds it; one is started once this fraction of the indexed vectors are tombstones
+INDEX_TOMBSTONE_RATIO = float(os.getenv("INDEX_TOMBSTONE_RATIO", 0.2))
+# Share one index between several server processes on this node (e.g. `uvicorn --workers N`):
+# writes are serialised by a file lock, the index is memory-mapped read-only by every process
+# and reloaded when another process publishes a new version
+INDEX_SHARED = os.getenv("INDEX_SHARED", "false").lower() == "true"
+# How often a process checks for a newly published index version in shared mode
+INDEX_REFRESH_INTERVAL_SECONDS = float(os.getenv("INDEX_REFRESH_INTERVAL_SECONDS", 1.0))
+
+# --- Collections ---
+# Documents are grouped in named collections, each searched on its own. Uploads and queries that
+# name no collection use DEFAULT_COLLECTION, stored in FAISS_INDEX_DIR and INGESTION_MANIFEST_FILE;
+# the other collections live under COLLECTIONS_DIR
+DEFAULT_COLLECTION = os.getenv("DEFAULT_COLLECTION", "default")
+COLLECTIONS_DIR = DATA_DIR / "collections"
+# Number of index shards of a new collection. Queries search the shards in parallel, on up to
+# COLLECTION_SEARCH_WORKERS threads, and merge their results
+COLLECTION_SHARDS = int(os.getenv("COLLECTION_SHARDS", 1))
+COLLECTION_SEARCH_WORKERS = int(os.getenv("COLLECTION_SEARCH_WORKERS", 8))
+# Collections kept loaded in memory, the least recently used ones beyond this are unloaded
+MAX_LOADED_COLLECTIONS = int(os.getenv("MAX_LOADED_COLLECTIONS", 8))
+
+# --- Vector Index Type ---
+# "flat" (exact search), "ivf_flat", "ivf_pq", "hnsw" or "sq8" (8-bit scalar quantised vectors, a
+# quarter of the memory of flat). New indexes start flat and are retrained into this type in the
+# background once they hold INDEX_PROMOTION_THRESHOLD chunks
+INDEX_TYPE = os.getenv("INDEX_TYPE", "flat").lower()
+INDEX_PROMOTION_THRESHOLD = int(os.getenv("INDEX_PROMOTION_THRESHOLD", 50_000))
+# IVF: number of lists (0 = about 4 * sqrt(chunk count)) and lists scanned per query
+IVF_NLIST = int(os.getenv("IVF_NLIST", 0))
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", 16))
+# PQ: number of sub-quantizers (0 = largest divisor of the dimension up to dim / 8) and bits per code
+PQ_M = int(os.getenv("PQ_M", 0))
+PQ_NBITS = int(os.getenv("PQ_NBITS", 8))
+# HNSW: graph degree, build-time and query-time candidate list sizes
+HNSW_M = int(os.getenv("HNSW_M", 32))
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", 200))
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", 64))
+# Quantised indexes (ivf_pq, sq8) return this many times k candidates, re-ranked with the exact
+# vectors kept memory-mapped on disk next to the index (0 = no re-ranking and no exact copy)
+INDEX_RERANK_FACTOR = int(os.getenv("INDEX_RERANK_FACTOR", 4))
+# Number of sampled queries used to measure recall against exact flat search
+INDEX_RECALL_SAMPLE_SIZE = int(os.getenv("INDEX_RECALL_SAMPLE_SIZE", 200))
+
+# --- Ingestion Configuration ---
+# Number of worker processes used to parse uploaded files (Unstructured, OCR, Whisper)
+INGEST_PARSE_WORKERS = int(os.getenv("INGEST_PARSE_WORKERS", max(1, min(4, (os.cpu_count() or 2) - 1))))
+# Number of finished ingestion jobs kept in memory for status lookups
+INGEST_JOB_HISTORY = int(os.getenv("INGEST_JOB_HISTORY", 200))
+# Extracted text is split in windows of about this many characters, cut at paragraph breaks,
+# and chunks are embedded in batches of INGEST_EMBED_BATCH_SIZE, so memory stays bounded per file
+INGEST_SPLIT_WINDOW_CHARS = int(os.getenv("INGEST_SPLIT_WINDOW_CHARS", 256 * 1024))
+INGEST_EMBED_BATCH_SIZE = int(os.getenv("INGEST_EMBED_BATCH_SIZE", 256))
+# Pending index additions are persisted every this many chunks while a large file is indexed
+INGEST_FLUSH_CHUNKS = int(os.getenv("INGEST_FLUSH_CHUNKS", 10_000))
+# PDF text extraction: "pypdf" (page by page, low memory) or "unstructured" (layout aware, loads the whole file)
+PDF_LOADER = os.getenv("PDF_LOADER", "pypdf").lower()
+# Documents split and embedded at once when an index is rebuilt from their extracted text
+INDEX_REBUILD_WORKERS = int(os.getenv("INDEX_REBUILD_WORKERS", 4))
 
 # --- LLM Configuration ---
 SELECTED_LLM = os.getenv("SELECTED_LLM", "default_local_llm")
@@ -38,10 +145,54 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
 DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY")
 
-print(f"Workspace Dir: {WORKSPACE_DIR}")
-print(f"App Dir: {APP_DIR}")
-print(f"Backend Dir: {BACKEND_DIR}")
-print(f"Data Dir: {DATA_DIR}")
-print(f"Uploaded Files Dir: {UPLOADED_FILES_DIR}")
-print(f"Processed Files Dir: {PROCESSED_FILES_DIR}")
-print(f"FAISS Index Dir: {FAISS_INDEX_DIR}") 
\ No newline at end of file
+# --- Semantic Query Cache ---
+# Answers are reused for queries whose embedding cosine similarity to an earlier query for the same
+# model reaches the threshold. The cache is cleared whenever the document index changes
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "true").lower() == "true"
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", 0.95))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", 1000))
+SEMANTIC_CACHE_TTL_SECONDS = float(os.getenv("SEMANTIC_CACHE_TTL_SECONDS", 86400))
+
+# --- LLM Client and Chain Cache ---
+# LLM clients and RAG chains are reused across queries, keyed by model, API key hash and LLM kwargs
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", 32))
+LLM_CACHE_TTL_SECONDS = float(os.getenv("LLM_CACHE_TTL_SECONDS", 3600))
+# Connection pool shared by the HTTP clients of the OpenAI-compatible providers
+LLM_HTTP_MAX_CONNECTIONS = int(os.getenv("LLM_HTTP_MAX_CONNECTIONS", 100))
+LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS", 20))
+# Per-request timeout and retries (with exponential backoff) of LLM API calls
+LLM_REQUEST_TIMEOUT_SECONDS = float(os.getenv("LLM_REQUEST_TIMEOUT_SECONDS", 60))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 3))
+# Concurrent LLM calls per provider, and how long a query waits for a free slot before failing
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 32))
+LLM_QUEUE_TIMEOUT_SECONDS = float(os.getenv("LLM_QUEUE_TIMEOUT_SECONDS", 30))
+
+# --- Query Configuration ---
+# Number of chunks retrieved per query, and threads running query embedding and FAISS search
+RETRIEVAL_K = int(os.getenv("RETRIEVAL_K", 5))
+QUERY_RETRIEVAL_WORKERS = int(os.getenv("QUERY_RETRIEVAL_WORKERS", 8))
+# Largest `k` a query request may ask for
+RETRIEVAL_MAX_K = int(os.getenv("RETRIEVAL_MAX_K", 50))
+# /query/batch: maximum queries per request and default number of concurrent LLM calls per request
+BATCH_QUERY_MAX_SIZE = int(os.getenv("BATCH_QUERY_MAX_SIZE", 1000))
+BATCH_QUERY_CONCURRENCY = int(os.getenv("BATCH_QUERY_CONCURRENCY", 16))
+
+# --- Context Packing ---
+# Retrieved chunks are packed into the prompt context: overlapping chunks of the same source are merged,
+# passages whose word trigrams are mostly already in the context (this fraction) are dropped, and the
+# rest fill a token budget by relevance. Overlaps shorter than CONTEXT_MIN_OVERLAP_CHARS are not merged
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 2000))
+CONTEXT_DEDUP_THRESHOLD = float(os.getenv("CONTEXT_DEDUP_THRESHOLD", 0.8))
+CONTEXT_MIN_OVERLAP_CHARS = int(os.getenv("CONTEXT_MIN_OVERLAP_CHARS", 20))
+# Per-model budgets as comma-separated "<model name prefix>=<tokens>", e.g. "gpt-4o-mini=1500,claude-=4000".
+# The longest matching prefix wins, other models get CONTEXT_TOKEN_BUDGET
+CONTEXT_TOKEN_BUDGETS = {
+    prefix.strip(): int(tokens)
+    for prefix, _, tokens in (item.partition("=") for item in os.getenv("CONTEXT_TOKEN_BUDGETS", "").split(",") if item.strip())
+}
+
+# --- Observability ---
+# Incoming requests are tagged with the trace id found in this header (or a new one), which is
+# returned in the same header along with a Server-Timing header of the request's stage durations.
+# Set to an empty value to disable
+TRACE_ID_HEADER = os.getenv("TRACE_ID_HEADER", "X-Request-ID")
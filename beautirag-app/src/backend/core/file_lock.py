@@ -0,0 +1,31 @@
+import os
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+def file_locking_supported() -> bool:
+    return fcntl is not None
+
+
+@contextmanager
+def file_lock(path: Path, shared: bool = False):
+    """Holds an advisory lock on `path` (created if needed) across processes: exclusive by
+    default, shared for readers.
+
+    Every call opens its own file descriptor, so threads of the same process exclude each other too.
+    """
+    if fcntl is None:
+        raise RuntimeError("Inter-process file locks are not supported on this platform.")
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd = os.open(str(path), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        yield
+    finally:
+        # Closing the descriptor releases the lock
+        os.close(fd)
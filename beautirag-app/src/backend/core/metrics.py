@@ -0,0 +1,162 @@
+import logging
+import re
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from prometheus_client import Counter, Gauge, Histogram
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# From single FAISS searches to long parses and transcriptions
+_DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+# --- Metrics ---
+STAGE_SECONDS = Histogram(
+    "beautirag_stage_duration_seconds",
+    "Duration of ingestion and query pipeline stages.",
+    ["stage"],
+    buckets=_DURATION_BUCKETS,
+)
+HTTP_REQUEST_SECONDS = Histogram(
+    "beautirag_http_request_duration_seconds",
+    "Duration of HTTP requests, including streamed response bodies.",
+    ["method", "route", "status"],
+    buckets=_DURATION_BUCKETS,
+)
+CHUNKS = Counter("beautirag_chunks_total", "Chunks added to or removed from the vector index.", ["operation"])
+FILES = Counter("beautirag_ingested_files_total", "Uploaded files by ingestion outcome.", ["status"])
+CACHE_LOOKUPS = Counter("beautirag_cache_lookups_total", "Cache lookups by cache and result.", ["cache", "result"])
+FAILURES = Counter("beautirag_failures_total", "Failures by pipeline stage.", ["stage"])
+CONTEXT_TOKENS = Histogram(
+    "beautirag_context_tokens",
+    "Estimated tokens of the retrieved chunks and of the prompt context packed from them.",
+    ["stage"],
+    buckets=(250, 500, 1000, 2000, 4000, 8000, 16000, 32000),
+)
+INDEX_CHUNKS = Gauge("beautirag_index_chunks", "Chunks in the loaded vector index.")
+
+# --- Stage Timing ---
+# Stage timings of the current HTTP request, reported in its Server-Timing header
+_request_timings: ContextVar[Optional[List[Tuple[str, float]]]] = ContextVar("request_timings", default=None)
+_trace_id: ContextVar[Optional[str]] = ContextVar("trace_id", default=None)
+# Set in parse worker processes while a task runs: their own registry is never scraped, so
+# the timings are returned to the server with the task result (see `collect_timings`)
+_collected_timings: Optional[List[Tuple[str, float]]] = None
+
+
+def observe(stage: str, seconds: float):
+    STAGE_SECONDS.labels(stage).observe(seconds)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.append((stage, seconds))
+    if _collected_timings is not None:
+        _collected_timings.append((stage, seconds))
+
+
+def observe_all(timings: Iterable[Tuple[str, float]]):
+    for stage, seconds in timings:
+        observe(stage, seconds)
+
+
+@contextmanager
+def timed(stage: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - start)
+
+
+def timed_iter(stage: str, iterable: Iterable) -> Iterator:
+    """Yields from `iterable`, recording the total time spent producing its items as one observation."""
+    iterator = iter(iterable)
+    total = 0.0
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            break
+        finally:
+            total += time.perf_counter() - start
+        yield item
+    observe(stage, total)
+
+
+@contextmanager
+def collect_timings():
+    """Collects the stage timings recorded by this process (any thread) until the block exits."""
+    global _collected_timings
+    timings = _collected_timings = []
+    try:
+        yield timings
+    finally:
+        _collected_timings = None
+
+
+def current_trace_id() -> Optional[str]:
+    return _trace_id.get()
+
+
+# --- Request Middleware ---
+_TRACE_ID_PATTERN = re.compile(r"[A-Za-z0-9._:-]{1,128}")
+
+
+def _server_timing(timings: List[Tuple[str, float]]) -> bytes:
+    return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings).encode("latin-1")
+
+
+class RequestMetricsMiddleware:
+    """ASGI middleware timing every HTTP request by route template.
+
+    With a `trace_header`, each request also gets a trace id (the caller's, if valid) that is
+    returned in that header together with a Server-Timing header of the stages timed before the
+    response started, and requests that ran pipeline stages are logged with their stage timings.
+    """
+
+    def __init__(self, app, trace_header: str = ""):
+        self.app = app
+        self.trace_header = trace_header.lower().encode("latin-1")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        trace_id = None
+        if self.trace_header:
+            incoming = dict(scope["headers"]).get(self.trace_header, b"").decode("latin-1")
+            trace_id = incoming if _TRACE_ID_PATTERN.fullmatch(incoming) else uuid.uuid4().hex
+        timings = []
+        timings_token = _request_timings.set(timings)
+        trace_token = _trace_id.set(trace_id)
+        status = 500
+
+        async def send_with_headers(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if trace_id is not None:
+                    headers = [*message.get("headers", []), (self.trace_header, trace_id.encode("latin-1"))]
+                    if timings:
+                        headers.append((b"server-timing", _server_timing(timings)))
+                    message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_headers)
+        finally:
+            elapsed = time.perf_counter() - start
+            # The router stores the matched route in the scope; unmatched paths share one label
+            route = getattr(scope.get("route"), "path", "unmatched")
+            HTTP_REQUEST_SECONDS.labels(scope["method"], route, str(status)).observe(elapsed)
+            if trace_id is not None and timings:
+                stages = ", ".join(f"{stage}={seconds * 1000:.1f}ms" for stage, seconds in timings)
+                logger.info(f"[trace {trace_id}] {scope['method']} {scope['path']} {status} in {elapsed * 1000:.1f} ms ({stages})")
+            _trace_id.reset(trace_token)
+            _request_timings.reset(timings_token)
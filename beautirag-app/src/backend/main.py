@@ -1,20 +1,45 @@
+import time
+
+_import_start = time.perf_counter()
+
+import hashlib
+import json
 import logging
-import shutil
+import uuid
 from typing import List, Optional
-from fastapi import FastAPI, File, UploadFile, HTTPException, Body
+from fastapi import FastAPI, File, Form, UploadFile, HTTPException, Body, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse, Response
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 import uvicorn
 import os
 from pathlib import Path
 
 from pydantic import BaseModel
 
-from .core.config import UPLOADED_FILES_DIR
-from .services import document_processor, vector_store_manager, rag_pipeline
+from .core.config import (
+    DATA_DIR,
+    UPLOADED_FILES_DIR,
+    PROCESSED_FILES_DIR,
+    FAISS_INDEX_DIR,
+    DEFAULT_COLLECTION,
+    STARTUP_MODE,
+    BATCH_QUERY_MAX_SIZE,
+    RETRIEVAL_MAX_K,
+    TRACE_ID_HEADER,
+    ensure_data_dirs,
+)
+from .core import metrics
+from .services import embedding_backends, index_rebuild, ingestion_jobs, ingestion_manifest, rag_pipeline, vector_store_manager, warmup
+from .services.index_collections import collection_exists, collection_incoming_dir, validate_collection_name
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+warmup.record_timing("imports", time.perf_counter() - _import_start)
+logger.info(f"Backend modules imported in {time.perf_counter() - _import_start:.2f}s.")
+
 
 app = FastAPI(
     title="BeautiRAG API",
@@ -34,74 +59,317 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[TRACE_ID_HEADER, "Server-Timing"] if TRACE_ID_HEADER else [],
 )
+# Added last so it wraps CORS too and times whole requests
+app.add_middleware(metrics.RequestMetricsMiddleware, trace_header=TRACE_ID_HEADER)
 
 @app.get("/", tags=["Health Check"])
 async def read_root():
     return {"message": "BeautiRAG API is running!"}
 
-@app.post("/upload/", tags=["Documents"])
-async def upload_documents(files: List[UploadFile] = File(...)):
+@app.get("/ready", tags=["Health Check"])
+async def readiness():
     """
-    Uploads one or more documents, processes them, and adds them to the vector store.
+    Returns 200 once the models and index required by the startup mode are loaded, 503 before.
     """
-    processed_files_count = 0
-    failed_files = []
-    all_processed_docs = []
+    status = warmup.status()
+    return JSONResponse(status_code=200 if status["ready"] else 503, content=status)
 
-    for file in files:
-        try:
-            UPLOADED_FILES_DIR.mkdir(parents=True, exist_ok=True)
+@app.get("/metrics", tags=["Health Check"])
+async def get_metrics():
+    """
+    Prometheus metrics: per-stage and per-route latency histograms, chunk, file, cache and failure counters, and the index size.
+    """
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
 
-            file_location = UPLOADED_FILES_DIR / file.filename
-            logger.info(f"Attempting to save uploaded file to: {file_location}")
+@app.post("/warmup", tags=["Health Check"])
+async def warm_up(components: Optional[List[str]] = Body(None, embed=True)):
+    """
+    Loads the embedding model and vector index (and Whisper if enabled) now instead of on first use.
+    Pass `components` to warm up only some of them.
+    """
+    try:
+        return await run_in_threadpool(warmup.warm_up, components)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-            with open(file_location, "wb+") as file_object:
-                shutil.copyfileobj(file.file, file_object)
-            logger.info(f"Successfully saved uploaded file: {file.filename}")
+@app.on_event("startup")
+def start_up():
+    start = time.perf_counter()
+    ensure_data_dirs()
+    logger.info(f"Data Dir: {DATA_DIR}")
+    logger.info(f"Uploaded Files Dir: {UPLOADED_FILES_DIR}")
+    logger.info(f"Processed Files Dir: {PROCESSED_FILES_DIR}")
+    logger.info(f"FAISS Index Dir: {FAISS_INDEX_DIR}")
 
-            logger.info(f"Processing document: {file.filename}")
-            processed_docs = document_processor.load_and_process_document(file_location)
+    if STARTUP_MODE not in warmup.STARTUP_MODES:
+        logger.warning(f"Unknown STARTUP_MODE '{STARTUP_MODE}', models will load on first use.")
+    elif STARTUP_MODE == "eager":
+        warmup.warm_up()
+    elif STARTUP_MODE == "background":
+        warmup.start_background_warmup()
+    warmup.record_timing("startup", time.perf_counter() - start)
+    logger.info(f"Startup ({STARTUP_MODE} mode) completed in {time.perf_counter() - start:.2f}s.")
 
-            if processed_docs:
-                all_processed_docs.extend(processed_docs)
-                processed_files_count += 1
-                logger.info(f"Successfully processed {file.filename}, found {len(processed_docs)} sections.")
-            else:
-                logger.warning(f"No content extracted from {file.filename}.")
-                failed_files.append(file.filename)
+UPLOAD_READ_CHUNK_SIZE = 1024 * 1024
 
-        except Exception as e:
-            logger.error(f"Failed to process file {file.filename}: {e}", exc_info=True)
-            failed_files.append(file.filename)
-            if file_location.exists():
-                file_location.unlink()
+@app.on_event("shutdown")
+def shutdown_ingestion():
+    ingestion_jobs.shutdown(wait=False)
+    embedding_backends.shutdown(wait=False)
+
+@app.on_event("shutdown")
+async def close_llm_clients():
+    await rag_pipeline.aclose_http_clients()
+
+async def _save_upload(file: UploadFile) -> tuple:
+    """Streams an upload to disk, hashing it on the way. Returns the temporary path and the SHA-256."""
+    temp_location = UPLOADED_FILES_DIR / f".{uuid.uuid4().hex}.part"
+    content_hash = hashlib.sha256()
+    try:
+        with metrics.timed("upload_write"), open(temp_location, "wb+") as file_object:
+            while chunk := await file.read(UPLOAD_READ_CHUNK_SIZE):
+                content_hash.update(chunk)
+                file_object.write(chunk)
+    except Exception:
+        temp_location.unlink(missing_ok=True)
+        raise
+    return temp_location, content_hash.hexdigest()
+
+def _collection_or_400(collection: Optional[str]) -> str:
+    try:
+        return validate_collection_name(collection or DEFAULT_COLLECTION)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
+def _existing_collection_or_404(collection: Optional[str]) -> str:
+    collection = _collection_or_400(collection)
+    if not collection_exists(collection):
+        raise HTTPException(status_code=404, detail=f"Collection '{collection}' not found.")
+    return collection
 
-    # Add all successfully processed documents to the vector store at once
-    if all_processed_docs:
+def _check_context_options(k: Optional[int], context_tokens: Optional[int]):
+    if k is not None and not 1 <= k <= RETRIEVAL_MAX_K:
+        raise HTTPException(status_code=400, detail=f"k must be between 1 and {RETRIEVAL_MAX_K}.")
+    if context_tokens is not None and context_tokens < 1:
+        raise HTTPException(status_code=400, detail="context_tokens must be at least 1.")
+
+async def _queue_uploads(uploads: List[tuple], collection: str) -> dict:
+    """Saves (file name, upload) pairs to the upload directory of a collection and queues them for ingestion.
+
+    Files whose exact content is already indexed under their name in the collection are skipped, and
+    files whose name is being ingested by another job are rejected.
+    """
+    saved_files = []
+    content_hashes = {}
+    skipped_files = []
+    busy_files = []
+    failed_files = []
+    incoming_dir = collection_incoming_dir(collection)
+
+    for filename, file in uploads:
         try:
-            logger.info(f"Adding {len(all_processed_docs)} document sections from {processed_files_count} file(s) to vector store.")
-            vector_store_manager.add_documents_to_store(all_processed_docs)
-            logger.info("Successfully updated vector store.")
+            logger.info(f"Attempting to save uploaded file: {filename}")
+            temp_location, content_hash = await _save_upload(file)
         except Exception as e:
-            logger.error(f"Failed to add documents to vector store: {e}", exc_info=True)
-            return HTTPException(status_code=500, detail=f"Files processed, but failed to update vector store: {e}")
+            logger.error(f"Failed to save file {filename}: {e}", exc_info=True)
+            failed_files.append(filename)
+            continue
+
+        # The same name twice in one request is rejected like a name owned by a running job
+        if filename in content_hashes:
+            claim = ingestion_manifest.IN_FLIGHT
+        else:
+            claim = await run_in_threadpool(ingestion_manifest.claim, filename, content_hash, collection)
+        if claim != ingestion_manifest.CLAIMED:
+            temp_location.unlink(missing_ok=True)
+            if claim == ingestion_manifest.ALREADY_INDEXED:
+                logger.info(f"Skipping {filename}: identical content is already indexed under this name.")
+                skipped_files.append(filename)
+            else:
+                logger.info(f"Rejecting {filename}: a version of this file is still being processed.")
+                busy_files.append(filename)
+            continue
+
+        # Staged under its own name until indexed, so a failed new version leaves the current file in place
+        file_location = incoming_dir / uuid.uuid4().hex / filename
+        file_location.parent.mkdir(parents=True)
+        temp_location.replace(file_location)
+        logger.info(f"Successfully saved uploaded file: {file_location}")
+        saved_files.append(file_location)
+        content_hashes[filename] = content_hash
 
-    if not processed_files_count and failed_files:
-         raise HTTPException(status_code=500, detail=f"Failed to process all uploaded files: {', '.join(failed_files)}")
+    if not saved_files and failed_files:
+        raise HTTPException(status_code=500, detail=f"Failed to save all uploaded files: {', '.join(failed_files)}")
 
+    job = None
+    if saved_files:
+        try:
+            job = await run_in_threadpool(ingestion_jobs.submit_job, saved_files, content_hashes, collection)
+        except Exception as e:
+            logger.error(f"Failed to queue {len(saved_files)} file(s) for ingestion: {e}", exc_info=True)
+            for file_location in saved_files:
+                file_location.unlink(missing_ok=True)
+                try:
+                    file_location.parent.rmdir()
+                except OSError:
+                    pass
+                ingestion_manifest.release(file_location.name, collection)
+            raise HTTPException(status_code=500, detail=f"Failed to queue the uploaded files: {e}")
     return {
-        "message": f"Processed {processed_files_count} file(s) successfully.",
-        "processed_files": processed_files_count,
+        "collection": collection,
+        "message": f"Queued {len(saved_files)} file(s) for processing, skipped {len(skipped_files)} already indexed, "
+                   f"rejected {len(busy_files)} still being processed.",
+        "job_id": job.id if job else None,
+        "status_url": f"/jobs/{job.id}" if job else None,
+        "queued_files": [path.name for path in saved_files],
+        "skipped_files": skipped_files,
+        "busy_files": busy_files,
         "failed_files": failed_files,
     }
 
+@app.post("/upload/", tags=["Documents"], status_code=202)
+async def upload_documents(files: List[UploadFile] = File(...), collection: str = Form(DEFAULT_COLLECTION)):
+    """
+    Saves one or more documents and queues them for background processing into a collection
+    (created on first upload). Files whose exact content is already indexed under their name in the
+    collection are skipped, and files whose name is still being processed by an earlier upload are
+    rejected (`busy_files`). Returns the id of the ingestion job, which can be polled on /jobs/{job_id}.
+    """
+    collection = _collection_or_400(collection)
+    return await _queue_uploads([(Path(file.filename).name, file) for file in files], collection)
+
+
+@app.get("/documents", tags=["Documents"])
+async def list_documents(collection: str = DEFAULT_COLLECTION):
+    """
+    Lists the indexed documents of a collection with their content hash and chunk count.
+    """
+    collection = _existing_collection_or_404(collection)
+    return {"collection": collection, "documents": await run_in_threadpool(ingestion_manifest.list_sources, collection)}
+
+@app.put("/documents/{filename}", tags=["Documents"], status_code=202)
+async def replace_document(filename: str, file: UploadFile = File(...), collection: str = Form(DEFAULT_COLLECTION)):
+    """
+    Uploads a new version of a document. Only the chunks that changed are re-embedded, and the
+    chunks of the previous version that are gone are deleted. Returns the ingestion job like /upload/,
+    or 409 while an earlier version of the document is still being processed.
+    """
+    collection = _collection_or_400(collection)
+    result = await _queue_uploads([(Path(filename).name, file)], collection)
+    if result["busy_files"]:
+        raise HTTPException(status_code=409, detail=f"Document '{filename}' is still being processed, retry once its job finished.")
+    return result
+
+@app.delete("/documents/{filename}", tags=["Documents"])
+async def delete_document(filename: str, collection: str = DEFAULT_COLLECTION):
+    """
+    Deletes a document: its chunks stop matching queries at once and are physically dropped from
+    the index by a later background compaction.
+    """
+    collection = _existing_collection_or_404(collection)
+    result = await run_in_threadpool(ingestion_jobs.delete_source, Path(filename).name, collection)
+    if result is None:
+        raise HTTPException(status_code=404, detail=f"Document '{filename}' not found in collection '{collection}'.")
+    return result
+
+
+@app.get("/jobs/", tags=["Documents"])
+async def list_ingestion_jobs():
+    """
+    Lists the progress of recent ingestion jobs.
+    """
+    return {"jobs": [job.progress() for job in ingestion_jobs.list_jobs()]}
+
+@app.get("/jobs/{job_id}", tags=["Documents"])
+async def get_ingestion_job(job_id: str):
+    """
+    Returns the full status of an ingestion job, including per-file states and errors.
+    """
+    job = ingestion_jobs.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job '{job_id}' not found.")
+    return job.to_dict()
+
+@app.get("/jobs/{job_id}/progress", tags=["Documents"])
+async def get_ingestion_job_progress(job_id: str):
+    """
+    Returns a compact progress summary of an ingestion job.
+    """
+    job = ingestion_jobs.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job '{job_id}' not found.")
+    return job.progress()
+
+
+@app.get("/collections", tags=["Index"])
+async def list_collections():
+    """
+    Lists the document collections, and the number of chunks of those loaded in memory.
+    """
+    return {"collections": await run_in_threadpool(vector_store_manager.list_collections)}
+
+@app.get("/index/stats", tags=["Index"])
+async def get_index_stats(collection: str = DEFAULT_COLLECTION):
+    """
+    Returns the vector index type, size, persistence state and last recall report of every shard of a collection.
+    """
+    collection = _existing_collection_or_404(collection)
+    return await run_in_threadpool(vector_store_manager.get_index_stats, collection)
+
+@app.post("/index/recall", tags=["Index"])
+async def measure_index_recall(k: int = 5, collection: str = DEFAULT_COLLECTION):
+    """
+    Measures recall@k of each shard of a collection against exact flat search on a sample of stored vectors.
+    """
+    collection = _existing_collection_or_404(collection)
+    return await run_in_threadpool(vector_store_manager.measure_index_recall, k, collection)
+
+@app.post("/index/rebuild", tags=["Index"], status_code=202)
+async def rebuild_index(collection: str = DEFAULT_COLLECTION):
+    """
+    Rebuilds the index of a collection in the background from the text extracted from its documents,
+    with the current embedding model, chunking and index type, then swaps it in. The collection keeps
+    serving queries and ingesting uploads meanwhile. Returns the rebuild job, which can be polled on
+    /index/rebuild/{job_id}.
+    """
+    collection = _existing_collection_or_404(collection)
+    try:
+        job = await run_in_threadpool(index_rebuild.start_rebuild, collection)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return job.to_dict()
+
+@app.get("/index/rebuild/{job_id}", tags=["Index"])
+async def get_rebuild_job(job_id: str):
+    """
+    Returns the status of an index rebuild job.
+    """
+    job = index_rebuild.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Rebuild job '{job_id}' not found.")
+    return job.to_dict()
+
+@app.get("/cache/stats", tags=["RAG"])
+async def get_cache_stats():
+    """
+    Returns the semantic answer cache size and hit/miss counters.
+    """
+    return rag_pipeline.get_semantic_cache_stats()
+
 
 class QueryRequest(BaseModel):
     query: str
     model_name: Optional[str] = "gpt-4o"
     api_key: Optional[str] = None
+    use_cache: bool = True
+    collection: Optional[str] = None
+    # Chunks retrieved (default RETRIEVAL_K) and context token budget (default: the model's)
+    k: Optional[int] = None
+    context_tokens: Optional[int] = None
 
 @app.post("/query/", tags=["RAG"])
 async def query_documents(request: QueryRequest):
@@ -109,18 +377,120 @@ async def query_documents(request: QueryRequest):
     Receives a query and returns the response from the RAG pipeline.
     """
     logger.info(f"Received query: '{request.query}' for model '{request.model_name}'")
+    collection = _existing_collection_or_404(request.collection)
+    _check_context_options(request.k, request.context_tokens)
     try:
-        response = rag_pipeline.query_rag(
+        result = await rag_pipeline.aquery_rag(
             query=request.query,
             model_name=request.model_name,
-            api_key=request.api_key
+            api_key=request.api_key,
+            use_cache=request.use_cache,
+            collection=collection,
+            k=request.k,
+            context_tokens=request.context_tokens,
         )
-        logger.info(f"Generated response: '{response[:100]}...'")
-        return {"response": response}
+        logger.info(f"Generated response (cache hit: {result['cache_hit']}): '{result['response'][:100]}...'")
+        return result
     except Exception as e:
         logger.error(f"Error during RAG query: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"An error occurred during the query: {e}")
 
 
+class BatchQueryRequest(BaseModel):
+    queries: List[str]
+    model_name: Optional[str] = "gpt-4o"
+    api_key: Optional[str] = None
+    use_cache: bool = True
+    max_concurrency: Optional[int] = None
+    collection: Optional[str] = None
+    k: Optional[int] = None
+    context_tokens: Optional[int] = None
+
+@app.post("/query/batch", tags=["RAG"])
+async def batch_query_documents(request: BatchQueryRequest, http_request: Request):
+    """
+    Answers many queries with one batched retrieval and concurrent LLM calls.
+    Results are streamed as newline-delimited JSON in completion order; each carries the `index` of its query.
+    A query that fails gets an `error` instead of a `response`.
+    """
+    if not request.queries:
+        raise HTTPException(status_code=400, detail="No queries provided.")
+    if len(request.queries) > BATCH_QUERY_MAX_SIZE:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_QUERY_MAX_SIZE} queries per batch.")
+    if request.max_concurrency is not None and request.max_concurrency < 1:
+        raise HTTPException(status_code=400, detail="max_concurrency must be at least 1.")
+    collection = _existing_collection_or_404(request.collection)
+    _check_context_options(request.k, request.context_tokens)
+    logger.info(f"Received batch of {len(request.queries)} queries for model '{request.model_name}'")
+
+    async def result_stream():
+        results = rag_pipeline.abatch_query_rag(
+            queries=request.queries,
+            model_name=request.model_name,
+            api_key=request.api_key,
+            use_cache=request.use_cache,
+            max_concurrency=request.max_concurrency,
+            collection=collection,
+            k=request.k,
+            context_tokens=request.context_tokens,
+        )
+        pending = set(range(len(request.queries)))
+        try:
+            async for result in results:
+                if await http_request.is_disconnected():
+                    logger.info("Client disconnected, cancelling batch query.")
+                    break
+                pending.discard(result["index"])
+                yield json.dumps(result) + "\n"
+        except Exception as e:
+            # The response has already started, so the queries left unanswered get an error line each
+            logger.error(f"Error during batch RAG query: {e}", exc_info=True)
+            for index in sorted(pending):
+                yield json.dumps({"index": index, "query": request.queries[index], "error": f"An error occurred during the query: {e}"}) + "\n"
+        finally:
+            await results.aclose()
+
+    return StreamingResponse(result_stream(), media_type="application/x-ndjson")
+
+
+def _format_sse(event: dict) -> str:
+    return f"event: {event['event']}\ndata: {json.dumps(event['data'])}\n\n"
+
+@app.post("/query/stream", tags=["RAG"])
+async def stream_query_documents(request: QueryRequest, http_request: Request):
+    """
+    Streams the RAG response as server-sent events: retrieved sources first, then LLM tokens.
+    """
+    logger.info(f"Received streaming query: '{request.query}' for model '{request.model_name}'")
+    collection = _existing_collection_or_404(request.collection)
+    _check_context_options(request.k, request.context_tokens)
+
+    async def event_stream():
+        events = rag_pipeline.stream_rag(
+            query=request.query,
+            model_name=request.model_name,
+            api_key=request.api_key,
+            use_cache=request.use_cache,
+            collection=collection,
+            k=request.k,
+            context_tokens=request.context_tokens,
+        )
+        try:
+            async for event in events:
+                if await http_request.is_disconnected():
+                    logger.info("Client disconnected, cancelling streaming query.")
+                    break
+                yield _format_sse(event)
+        finally:
+            # Closing the generator cancels the in-flight LLM request
+            await events.aclose()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 if __name__ == "__main__":
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True) 
\ No newline at end of file
@@ -0,0 +1,416 @@
+import logging
+import math
+import time
+from typing import Dict, Iterable, Optional, Set
+
+import faiss
+import numpy as np
+
+from ..core.config import (
+    IVF_NLIST,
+    IVF_NPROBE,
+    PQ_M,
+    PQ_NBITS,
+    HNSW_M,
+    HNSW_EF_CONSTRUCTION,
+    HNSW_EF_SEARCH,
+    INDEX_RERANK_FACTOR,
+)
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+INDEX_FLAT = "flat"
+INDEX_IVF_FLAT = "ivf_flat"
+INDEX_IVF_PQ = "ivf_pq"
+INDEX_HNSW = "hnsw"
+INDEX_SQ8 = "sq8"
+INDEX_TYPES = (INDEX_FLAT, INDEX_IVF_FLAT, INDEX_IVF_PQ, INDEX_HNSW, INDEX_SQ8)
+# Types storing lossy codes instead of the vectors, searched with a re-ranking of their candidates
+QUANTISED_TYPES = (INDEX_IVF_PQ, INDEX_SQ8)
+
+# Fewer training points per IVF list than this gives poorly trained centroids (faiss warns below 39)
+MIN_POINTS_PER_LIST = 39
+# Maximum number of vectors used to train IVF centroids and PQ codebooks
+MAX_TRAINING_POINTS = 256 * 1024
+
+
+def _primary(index):
+    """The faiss index holding the structure of a wrapped index: the base of a `LayeredIndex` (or
+    its delta before any base), the quantised index of a `RerankedIndex`."""
+    if isinstance(index, LayeredIndex):
+        index = index.base if index.base is not None else index.delta
+    if isinstance(index, RerankedIndex):
+        index = index.index
+    return index
+
+
+def index_type_of(index: faiss.Index) -> str:
+    """Returns the configured name of a FAISS index's type."""
+    index = faiss.downcast_index(_primary(index))
+    if isinstance(index, faiss.IndexHNSW):
+        return INDEX_HNSW
+    if isinstance(index, faiss.IndexIVFPQ):
+        return INDEX_IVF_PQ
+    if isinstance(index, faiss.IndexIVF):
+        return INDEX_IVF_FLAT
+    if isinstance(index, faiss.IndexScalarQuantizer):
+        return INDEX_SQ8
+    return INDEX_FLAT
+
+
+def has_exact_vectors(index) -> bool:
+    """Whether the stored vectors can be reconstructed exactly (quantised indexes only keep codes,
+    unless re-ranked with a copy of the exact vectors)."""
+    if isinstance(index, LayeredIndex):
+        return all(has_exact_vectors(part) for part in (index.base, index.delta) if part is not None)
+    return isinstance(index, RerankedIndex) or index_type_of(index) not in QUANTISED_TYPES
+
+
+def _auto_nlist(count: int) -> int:
+    if IVF_NLIST:
+        nlist = IVF_NLIST
+    else:
+        nlist = int(4 * math.sqrt(count))
+    return max(1, min(nlist, count // MIN_POINTS_PER_LIST))
+
+
+def _auto_pq_m(dim: int) -> int:
+    """Number of PQ sub-quantizers: the configured value, or the largest divisor of dim up to dim / 8."""
+    if PQ_M:
+        return PQ_M
+    return max(m for m in range(1, max(1, dim // 8) + 1) if dim % m == 0)
+
+
+def needs_retraining(index: faiss.Index) -> bool:
+    """True for IVF indexes whose number of lists fell well below what the corpus size calls for."""
+    ivf = faiss.try_extract_index_ivf(_primary(index))
+    if ivf is None or IVF_NLIST:
+        return False
+    return ivf.nlist * 2 < _auto_nlist(index.ntotal)
+
+
+def apply_search_params(index: faiss.Index):
+    """Applies the configured nprobe / efSearch to an index."""
+    index = _primary(index)
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.nprobe = min(IVF_NPROBE, ivf.nlist)
+    downcast = faiss.downcast_index(index)
+    if isinstance(downcast, faiss.IndexHNSW):
+        downcast.hnsw.efSearch = HNSW_EF_SEARCH
+
+
+def reconstruct(index: faiss.Index, start: int = 0, count: Optional[int] = None) -> np.ndarray:
+    """Returns stored vectors (exact unless `has_exact_vectors` is False)."""
+    count = index.ntotal - start if count is None else count
+    if isinstance(index, (LayeredIndex, RerankedIndex)):
+        return index.reconstruct_n(start, count)
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        # IVF lists need a direct map to look vectors up by position; it is dropped right after
+        # because it would prevent `remove_ids`
+        ivf.make_direct_map(True)
+        try:
+            return index.reconstruct_n(start, count)
+        finally:
+            ivf.make_direct_map(False)
+    return index.reconstruct_n(start, count)
+
+
+def reranks(index_type: str) -> bool:
+    """Whether indexes of this type are searched with a re-ranking over their exact vectors."""
+    return INDEX_RERANK_FACTOR > 0 and index_type in QUANTISED_TYPES
+
+
+def is_reranked(index) -> bool:
+    if isinstance(index, LayeredIndex):
+        index = index.base if index.base is not None else index.delta
+    return isinstance(index, RerankedIndex)
+
+
+def with_reranking(index: faiss.Index, exact_vectors: np.ndarray):
+    """Wraps a quantised index in a `RerankedIndex` over its exact vectors, unless re-ranking is disabled."""
+    if not reranks(index_type_of(index)):
+        return index
+    return RerankedIndex(index, exact_vectors, INDEX_RERANK_FACTOR)
+
+
+def empty_like(index: faiss.Index) -> faiss.Index:
+    """Returns an empty index with the type and training of `index`, to refill without retraining.
+
+    Not for memory-mapped indexes, which faiss cannot copy.
+    """
+    index = _primary(index)
+    if index_type_of(index) == INDEX_FLAT:
+        return faiss.IndexFlat(index.d, index.metric_type)
+    empty = faiss.clone_index(index)
+    empty.reset()
+    apply_search_params(empty)
+    return empty
+
+
+def build_index(index_type: str, vectors: np.ndarray) -> faiss.Index:
+    """Builds, trains and fills an index of the given type from float32 vectors."""
+    count, dim = vectors.shape
+    if index_type == INDEX_FLAT:
+        description = "Flat"
+    elif index_type == INDEX_IVF_FLAT:
+        description = f"IVF{_auto_nlist(count)},Flat"
+    elif index_type == INDEX_IVF_PQ:
+        description = f"IVF{_auto_nlist(count)},PQ{_auto_pq_m(dim)}x{PQ_NBITS}"
+    elif index_type == INDEX_HNSW:
+        description = f"HNSW{HNSW_M},Flat"
+    elif index_type == INDEX_SQ8:
+        description = "SQ8"
+    else:
+        raise ValueError(f"Unsupported index type: {index_type}. Expected one of {', '.join(INDEX_TYPES)}.")
+
+    logger.info(f"Building '{description}' index over {count} vectors.")
+    start = time.perf_counter()
+    index = faiss.index_factory(dim, description, faiss.METRIC_L2)
+    downcast = faiss.downcast_index(index)
+    if isinstance(downcast, faiss.IndexHNSW):
+        downcast.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    if not index.is_trained:
+        if count > MAX_TRAINING_POINTS:
+            sample = np.random.default_rng(0).choice(count, MAX_TRAINING_POINTS, replace=False)
+            index.train(vectors[np.sort(sample)])
+        else:
+            index.train(vectors)
+    index.add(vectors)
+    apply_search_params(index)
+    logger.info(f"Built '{description}' index in {time.perf_counter() - start:.1f}s.")
+    return index
+
+
+def measure_recall(index: faiss.Index, exact_vectors: np.ndarray, sample_size: int, k: int = 5) -> Dict:
+    """Compares an index against exact flat search on a sample of stored vectors used as queries.
+
+    Returns recall@k and the mean per-query latency of both searches.
+    """
+    count = exact_vectors.shape[0]
+    sample_size = min(sample_size, count)
+    k = min(k, count)
+    if not sample_size or not k:
+        return {}
+    queries = exact_vectors[np.random.default_rng(0).choice(count, sample_size, replace=False)]
+
+    flat = faiss.IndexFlatL2(exact_vectors.shape[1])
+    flat.add(exact_vectors)
+    start = time.perf_counter()
+    _, expected = flat.search(queries, k)
+    flat_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    _, found = index.search(queries, k)
+    index_seconds = time.perf_counter() - start
+
+    hits = sum(len(set(row_expected) & set(row_found)) for row_expected, row_found in zip(expected, found))
+    report = {
+        "index_type": index_type_of(index),
+        "k": k,
+        "sample_size": sample_size,
+        "recall": round(hits / (sample_size * k), 4),
+        "flat_latency_ms": round(1000 * flat_seconds / sample_size, 3),
+        "index_latency_ms": round(1000 * index_seconds / sample_size, 3),
+        "measured_at": time.time(),
+    }
+    logger.info(f"Index recall report: {report}")
+    return report
+
+
+def _selector_params(index: faiss.Index, selector) -> faiss.SearchParameters:
+    """Search parameters excluding ids through `selector`, keeping the index's nprobe / efSearch."""
+    index = _primary(index)
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        return faiss.SearchParametersIVF(sel=selector, nprobe=ivf.nprobe)
+    downcast = faiss.downcast_index(index)
+    if isinstance(downcast, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=downcast.hnsw.efSearch)
+    return faiss.SearchParameters(sel=selector)
+
+
+class LayeredIndex:
+    """A read-only base index plus a private delta of the vectors added after it, searched as one,
+    with deleted positions (tombstones) masked out of searches.
+
+    Used by the shared index mode, where the base is memory-mapped from disk and shared by every
+    worker process through the page cache. The base cannot be modified (faiss aborts on writes to
+    mapped storage), so vectors are appended to the delta and deletions are masked out of searches
+    until a compaction writes a new base. Positions continue from the base into the delta.
+
+    Without a base it only masks deletions out of the in-memory index of the other mode, which
+    avoids rebuilding the index on every deletion.
+
+    Implements the part of the faiss index interface used by the LangChain FAISS store.
+    """
+
+    def __init__(self, base: Optional[faiss.Index], delta: faiss.Index):
+        self.base = base
+        self.delta = delta
+        self.d = delta.d
+        self.metric_type = delta.metric_type
+        self.is_trained = True
+        self.deleted: Set[int] = set()
+        # (base selectors, delta selectors) excluding the deleted positions. The inner selector is
+        # kept alongside IDSelectorNot, which does not own it
+        self._selectors = None
+
+    @property
+    def base_count(self) -> int:
+        return self.base.ntotal if self.base is not None else 0
+
+    @property
+    def ntotal(self) -> int:
+        return self.base_count + self.delta.ntotal
+
+    def add(self, vectors: np.ndarray):
+        self.delta.add(vectors)
+
+    def mark_deleted(self, positions: Iterable[int]):
+        self.deleted.update(positions)
+        self._selectors = None
+
+    def _get_selectors(self):
+        if self._selectors is None:
+            base_count = self.base_count
+            selectors = []
+            for positions in (
+                [p for p in self.deleted if p < base_count],
+                [p - base_count for p in self.deleted if p >= base_count],
+            ):
+                if positions:
+                    inner = faiss.IDSelectorBatch(np.array(positions, dtype=np.int64))
+                    selectors.append((inner, faiss.IDSelectorNot(inner)))
+                else:
+                    selectors.append(None)
+            self._selectors = tuple(selectors)
+        return self._selectors
+
+    @staticmethod
+    def _search_part(index: faiss.Index, x: np.ndarray, k: int, selector):
+        if selector is None:
+            return index.search(x, k)
+        return index.search(x, k, params=_selector_params(index, selector[1]))
+
+    def search(self, x: np.ndarray, k: int):
+        x = np.ascontiguousarray(x, dtype=np.float32)
+        base_selector, delta_selector = self._get_selectors()
+        results = []
+        if self.base is not None and self.base.ntotal:
+            results.append(self._search_part(self.base, x, k, base_selector))
+        if self.delta.ntotal:
+            distances, labels = self._search_part(self.delta, x, k, delta_selector)
+            results.append((distances, np.where(labels >= 0, labels + self.base_count, -1)))
+        if not results:
+            return np.full((x.shape[0], k), np.inf, dtype=np.float32), np.full((x.shape[0], k), -1, dtype=np.int64)
+        if len(results) == 1:
+            return results[0]
+        distances = np.hstack([result[0] for result in results])
+        labels = np.hstack([result[1] for result in results])
+        # Missing results come back as -1 with the worst possible distance, so they sort last
+        keys = -distances if self.metric_type == faiss.METRIC_INNER_PRODUCT else distances
+        order = np.argsort(keys, axis=1, kind="stable")[:, :k]
+        return np.take_along_axis(distances, order, axis=1), np.take_along_axis(labels, order, axis=1)
+
+    def reconstruct(self, position: int) -> np.ndarray:
+        return self.reconstruct_n(position, 1)[0]
+
+    def reconstruct_n(self, start: int, count: int) -> np.ndarray:
+        base_count = self.base_count
+        parts = []
+        if start < base_count:
+            parts.append(reconstruct(self.base, start, min(count, base_count - start)))
+        delta_start = max(0, start - base_count)
+        delta_count = start + count - max(start, base_count)
+        if delta_count > 0:
+            parts.append(reconstruct(self.delta, delta_start, delta_count))
+        return np.concatenate(parts) if parts else np.empty((0, self.d), dtype=np.float32)
+
+
+class RerankedIndex:
+    """A quantised index (SQ8, IVF-PQ) whose candidates are re-ranked with the exact vectors.
+
+    The index keeps compact lossy codes in memory. A search fetches `factor` times k candidates
+    from it, then orders them by their distance to the query over the exact vectors, read from a
+    memory-mapped array so that only the pages of candidates are loaded. Vectors added after the
+    array was written are kept in memory until the next compaction writes them to a new one.
+
+    Implements the part of the faiss index interface used by the LangChain FAISS store.
+    """
+
+    def __init__(self, index: faiss.Index, exact_vectors: np.ndarray, factor: int):
+        self.index = index
+        self.exact_vectors = exact_vectors
+        self.factor = factor
+        self.d = index.d
+        self.metric_type = index.metric_type
+        self.is_trained = True
+        self._added = []
+        # Concatenation of `_added`, rebuilt when vectors were added since
+        self._added_matrix = np.empty((0, self.d), dtype=np.float32)
+
+    @property
+    def ntotal(self) -> int:
+        return self.index.ntotal
+
+    def add(self, vectors: np.ndarray):
+        # Exact vectors come first, so a search never finds a candidate it cannot re-rank
+        self._added.append(np.array(vectors, dtype=np.float32))
+        self.index.add(vectors)
+
+    def _added_vectors(self) -> np.ndarray:
+        added = self._added_matrix
+        count = sum(len(part) for part in self._added)
+        if len(added) < count:
+            added = self._added_matrix = np.concatenate(self._added)
+        return added
+
+    def vectors_at(self, positions: np.ndarray) -> np.ndarray:
+        """Exact vectors at index positions, in an array of shape positions.shape + (d,)."""
+        flat = positions.ravel()
+        vectors = np.empty((len(flat), self.d), dtype=np.float32)
+        stored = flat < len(self.exact_vectors)
+        vectors[stored] = self.exact_vectors[flat[stored]]
+        if not stored.all():
+            vectors[~stored] = self._added_vectors()[flat[~stored] - len(self.exact_vectors)]
+        return vectors.reshape(*positions.shape, self.d)
+
+    def search(self, x: np.ndarray, k: int, params=None):
+        x = np.ascontiguousarray(x, dtype=np.float32)
+        candidates = min(max(k, k * self.factor), max(k, self.ntotal))
+        if params is None:
+            _, labels = self.index.search(x, candidates)
+        else:
+            _, labels = self.index.search(x, candidates, params=params)
+        found = labels >= 0
+        vectors = self.vectors_at(np.where(found, labels, 0))
+        if self.metric_type == faiss.METRIC_INNER_PRODUCT:
+            distances = np.einsum("qcd,qd->qc", vectors, x)
+            keys = np.where(found, -distances, np.inf)
+            missing = -np.finfo(np.float32).max
+        else:
+            differences = vectors - x[:, None, :]
+            distances = np.einsum("qcd,qcd->qc", differences, differences)
+            keys = np.where(found, distances, np.inf)
+            missing = np.finfo(np.float32).max
+        order = np.argsort(keys, axis=1, kind="stable")[:, :k]
+        labels = np.take_along_axis(np.where(found, labels, -1), order, axis=1)
+        distances = np.where(labels >= 0, np.take_along_axis(distances, order, axis=1), missing)
+        if labels.shape[1] < k:
+            padding = ((0, 0), (0, k - labels.shape[1]))
+            labels = np.pad(labels, padding, constant_values=-1)
+            distances = np.pad(distances, padding, constant_values=missing)
+        return distances.astype(np.float32), labels
+
+    def reconstruct(self, position: int) -> np.ndarray:
+        return self.reconstruct_n(position, 1)[0]
+
+    def reconstruct_n(self, start: int, count: int) -> np.ndarray:
+        return self.vectors_at(np.arange(start, start + count))
+
+    def exact_parts(self):
+        """The exact vectors of every position, as arrays to write one after the other."""
+        return [self.exact_vectors, *self._added]
@@ -0,0 +1,115 @@
+import logging
+import shutil
+import uuid
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+
+from .document_processor import load_whisper_model
+from ..core.config import AUDIO_SEGMENT_SECONDS, AUDIO_SPLIT_SEARCH_SECONDS, AUDIO_SEGMENTS_DIR
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Long audio is transcribed as independent segments by the ingestion parse workers, each
+# holding its own Whisper model: `plan_segments` decodes a file and cuts it at silences,
+# then every `transcribe_segment` call can run on a different worker.
+
+AUDIO_EXTENSIONS = (".mp3", ".wav")
+# Energy is measured over frames of this length, and silences are searched over this window
+FRAME_SECONDS = 0.05
+SILENCE_WINDOW_SECONDS = 0.5
+
+
+def is_audio(file_path: Path) -> bool:
+    return file_path.suffix.lower() in AUDIO_EXTENSIONS
+
+
+def _find_split_points(audio: np.ndarray, sample_rate: int, segment_seconds: float, search_seconds: float) -> List[int]:
+    """Returns sample positions cutting the audio about every `segment_seconds`, each moved to the
+    quietest half second within `search_seconds` of the nominal cut."""
+    frame = max(1, int(FRAME_SECONDS * sample_rate))
+    frame_count = len(audio) // frame
+    if frame_count == 0:
+        return []
+    energy = np.sqrt(np.mean(audio[:frame_count * frame].reshape(frame_count, frame) ** 2, axis=1))
+    window = max(1, int(SILENCE_WINDOW_SECONDS / FRAME_SECONDS))
+    smoothed = np.convolve(energy, np.ones(window) / window, mode="same")
+
+    frames_per_segment = int(segment_seconds / FRAME_SECONDS)
+    search = int(search_seconds / FRAME_SECONDS)
+    split_points = []
+    last = 0
+    target = frames_per_segment
+    # The last segment may be up to half a segment longer instead of leaving a short tail
+    while target + frames_per_segment // 2 < frame_count:
+        low = max(last + 1, target - search)
+        high = min(frame_count - 1, target + search)
+        cut = low + int(np.argmin(smoothed[low:high + 1]))
+        split_points.append(cut * frame)
+        last = cut
+        target = cut + frames_per_segment
+    return split_points
+
+
+def plan_segments(file_path: Path) -> List[Dict]:
+    """Decodes an audio file and writes it as silence-bounded segments to transcribe.
+
+    Returns the segments as {"index", "path", "start", "end"} dicts, times in seconds.
+    Runs in a parse worker, the decoded audio never reaches the server process.
+    """
+    # Imported here so that importing this module does not load Whisper (and torch)
+    from whisper.audio import load_audio, SAMPLE_RATE
+
+    logger.info(f"Decoding audio file: {file_path}")
+    audio = load_audio(str(file_path))
+    split_points = _find_split_points(audio, SAMPLE_RATE, AUDIO_SEGMENT_SECONDS, AUDIO_SPLIT_SEARCH_SECONDS)
+    bounds = [0, *split_points, len(audio)]
+
+    directory = AUDIO_SEGMENTS_DIR / f"{file_path.stem}-{uuid.uuid4().hex[:8]}"
+    directory.mkdir(parents=True, exist_ok=True)
+    segments = []
+    for index, (start, end) in enumerate(zip(bounds, bounds[1:])):
+        path = directory / f"{index:05d}.npy"
+        np.save(path, audio[start:end])
+        segments.append({
+            "index": index,
+            "path": str(path),
+            "start": start / SAMPLE_RATE,
+            "end": end / SAMPLE_RATE,
+        })
+    logger.info(f"Split {file_path.name} ({len(audio) / SAMPLE_RATE:.0f}s) into {len(segments)} segment(s).")
+    return segments
+
+
+def transcribe_segment(segment: Dict) -> Dict:
+    """Transcribes one planned segment with this worker's Whisper model.
+
+    Returns {"index", "start", "end", "segments"} where "segments" are Whisper's timed
+    sub-segments ({"start", "end", "text"}) with times relative to the whole recording.
+    """
+    whisper_model = load_whisper_model()
+    if whisper_model is None:
+        raise RuntimeError("Whisper model not loaded.")
+    path = Path(segment["path"])
+    try:
+        result = whisper_model.transcribe(np.load(path), fp16=False)  # fp16=False for CPU
+    finally:
+        path.unlink(missing_ok=True)
+    offset = segment["start"]
+    return {
+        "index": segment["index"],
+        "start": segment["start"],
+        "end": segment["end"],
+        "segments": [
+            {"start": offset + part["start"], "end": offset + part["end"], "text": part["text"]}
+            for part in result.get("segments", [])
+        ],
+    }
+
+
+def remove_segments(segments: List[Dict]):
+    """Deletes the temporary directory of planned segments."""
+    if segments:
+        shutil.rmtree(Path(segments[0]["path"]).parent, ignore_errors=True)
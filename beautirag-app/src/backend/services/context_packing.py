@@ -0,0 +1,184 @@
+import logging
+import re
+from typing import List, Optional, Set
+
+from langchain_core.documents import Document
+
+from .vector_store_manager import CHUNK_OVERLAP
+from ..core import metrics
+from ..core.config import (
+    CONTEXT_TOKEN_BUDGET,
+    CONTEXT_TOKEN_BUDGETS,
+    CONTEXT_DEDUP_THRESHOLD,
+    CONTEXT_MIN_OVERLAP_CHARS,
+)
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Average characters per token of the supported models' tokenizers on English text. Budgets are
+# estimates: counting exactly would need each provider's tokenizer on the query path
+CHARS_PER_TOKEN = 4
+
+# Chunks of a source at most this many characters apart (the whitespace the splitter strips) are adjacent
+_MAX_GAP_CHARS = 10
+
+_WORD = re.compile(r"\w+")
+
+
+def estimate_tokens(text: str) -> int:
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+
+def token_budget_for(model_name: str) -> int:
+    """Context token budget of a model: its longest matching CONTEXT_TOKEN_BUDGETS prefix, else the default."""
+    prefixes = [prefix for prefix in CONTEXT_TOKEN_BUDGETS if model_name.startswith(prefix)]
+    if not prefixes:
+        return CONTEXT_TOKEN_BUDGET
+    return CONTEXT_TOKEN_BUDGETS[max(prefixes, key=len)]
+
+
+# --- Merging ---
+def _overlap(first: str, second: str) -> int:
+    """Length of the longest end of `first` that `second` starts with, or 0 when shorter than
+    CONTEXT_MIN_OVERLAP_CHARS. The splitter repeats at most CHUNK_OVERLAP characters."""
+    head = second[:CONTEXT_MIN_OVERLAP_CHARS]
+    if len(head) < CONTEXT_MIN_OVERLAP_CHARS:
+        return 0
+    tail = first[-CHUNK_OVERLAP:]
+    start = tail.find(head)
+    while start >= 0:
+        if second.startswith(tail[start:]):
+            return len(tail) - start
+        start = tail.find(head, start + 1)
+    return 0
+
+
+def _join_text(first: str, second: str) -> Optional[str]:
+    """The text covering both, when one contains the other or they overlap, else None."""
+    if second in first:
+        return first
+    if first in second:
+        return second
+    overlap = _overlap(first, second)
+    if overlap:
+        return first + second[overlap:]
+    overlap = _overlap(second, first)
+    if overlap:
+        return second + first[overlap:]
+    return None
+
+
+class _Passage:
+    """Contiguous text of one source, merged from one or more retrieved chunks."""
+
+    def __init__(self, document: Document, rank: int):
+        self.text = document.page_content
+        self.rank = rank
+        self.metadata = {
+            name: value for name, value in document.metadata.items() if name not in ("chunk_id", "start_index")
+        }
+        self.chunk_ids = [document.metadata["chunk_id"]] if "chunk_id" in document.metadata else []
+        # Offset of the text in its source, unknown for chunks indexed before offsets were recorded
+        self.start: Optional[int] = document.metadata.get("start_index")
+        # Chunks of different pages never overlap, even when their text repeats
+        self.key = (self.metadata.get("processed_path") or self.metadata.get("source"), self.metadata.get("page"))
+
+    @property
+    def end(self) -> int:
+        return self.start + len(self.text)
+
+    def join(self, other: "_Passage") -> Optional[str]:
+        """The text covering both passages, when they overlap or are adjacent, else None."""
+        if self.start is None or other.start is None:
+            return _join_text(self.text, other.text)
+        first, second = (self, other) if self.start <= other.start else (other, self)
+        gap = second.start - first.end
+        if gap > _MAX_GAP_CHARS:
+            return None
+        if second.end <= first.end:
+            return first.text
+        # Keeps text offsets aligned with the source, the stripped whitespace being a line break
+        return first.text + "\n" * gap + second.text[max(0, -gap):]
+
+    def absorb(self, other: "_Passage", text: str):
+        """Takes the chunks of a less relevant passage, whose text was joined with this one's."""
+        if self.start is not None and other.start is not None:
+            self.start = min(self.start, other.start)
+        else:
+            self.start = None
+        self.text = text
+        self.chunk_ids += other.chunk_ids
+        # Transcript passages cover the audio of all their chunks
+        if "start_time" in self.metadata and "start_time" in other.metadata:
+            self.metadata["start_time"] = min(self.metadata["start_time"], other.metadata["start_time"])
+            self.metadata["end_time"] = max(self.metadata["end_time"], other.metadata["end_time"])
+
+    def to_document(self) -> Document:
+        return Document(page_content=self.text, metadata={**self.metadata, "chunk_ids": self.chunk_ids})
+
+
+def merge_chunks(documents: List[Document]) -> List[_Passage]:
+    """Merges retrieved chunks (most relevant first) that overlap or are adjacent within a source.
+
+    A passage ranks as its most relevant chunk. Passages are returned most relevant first.
+    """
+    passages: List[_Passage] = []
+    for rank, document in enumerate(documents):
+        passage = _Passage(document, rank)
+        # A chunk can bridge two passages of its source, so the grown passage is merged again
+        merged = True
+        while merged:
+            merged = False
+            for other in passages:
+                if other.key != passage.key:
+                    continue
+                text = other.join(passage)
+                if text is not None:
+                    passages.remove(other)
+                    first, second = (other, passage) if other.rank < passage.rank else (passage, other)
+                    first.absorb(second, text)
+                    passage = first
+                    merged = True
+                    break
+        passages.append(passage)
+    return sorted(passages, key=lambda passage: passage.rank)
+
+
+# --- Packing ---
+def _shingles(text: str) -> Set[tuple]:
+    words = _WORD.findall(text.lower())
+    if len(words) < 3:
+        return {tuple(words)}
+    return set(zip(words, words[1:], words[2:]))
+
+
+def pack_context(documents: List[Document], token_budget: int) -> List[Document]:
+    """Packs retrieved chunks (most relevant first) into at most `token_budget` estimated tokens of context.
+
+    Overlapping chunks of a source are merged, passages that mostly repeat text already packed are
+    dropped, and the others are taken by relevance while they fit. The most relevant passage is
+    truncated rather than dropped when it alone exceeds the budget.
+    """
+    packed: List[Document] = []
+    seen: Set[tuple] = set()
+    used = 0
+    for passage in merge_chunks(documents):
+        shingles = _shingles(passage.text)
+        if len(shingles & seen) >= CONTEXT_DEDUP_THRESHOLD * len(shingles):
+            continue
+        tokens = estimate_tokens(passage.text)
+        if used + tokens > token_budget:
+            if packed:
+                continue
+            passage.text = passage.text[:token_budget * CHARS_PER_TOKEN]
+            tokens = estimate_tokens(passage.text)
+        packed.append(passage.to_document())
+        seen |= shingles
+        used += tokens
+
+    retrieved = sum(estimate_tokens(document.page_content) for document in documents)
+    metrics.CONTEXT_TOKENS.labels("retrieved").observe(retrieved)
+    metrics.CONTEXT_TOKENS.labels("packed").observe(used)
+    logger.debug(f"Packed {len(documents)} chunks ({retrieved} tokens) into {len(packed)} passages ({used} tokens).")
+    return packed
@@ -0,0 +1,145 @@
+import pickle
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Union
+
+from langchain_community.docstore.base import AddableMixin, Docstore
+from langchain_core.documents import Document
+
+
+# Chunks of a base, in index position order. Written once by a compaction and never modified
+SCHEMA = """
+CREATE TABLE documents (
+    position INTEGER PRIMARY KEY,
+    chunk_id TEXT NOT NULL UNIQUE,
+    text TEXT NOT NULL,
+    metadata BLOB NOT NULL
+);
+"""
+
+
+def _read_only_uri(path: Path) -> str:
+    # `immutable` skips file locking and change detection, the file is never written after creation
+    return f"{Path(path).resolve().as_uri()}?mode=ro&immutable=1"
+
+
+def _connect_read_only(path: Path) -> sqlite3.Connection:
+    return sqlite3.connect(_read_only_uri(path), uri=True, check_same_thread=False)
+
+
+def read_positions(path: Path) -> Dict[int, str]:
+    """Returns the index position -> chunk id mapping of a base docstore file."""
+    conn = _connect_read_only(path)
+    try:
+        return dict(conn.execute("SELECT position, chunk_id FROM documents ORDER BY position"))
+    finally:
+        conn.close()
+
+
+class LayeredDocstore(Docstore, AddableMixin):
+    """Chunk documents of an index base, read from its SQLite file when a search hits them, plus
+    the chunks added (kept in memory) and deleted since the base was written.
+
+    Only the chunks changed since the last compaction are resident, the text and metadata of the
+    others are fetched for the top k hits of a query. Without a file, every chunk is in memory.
+    """
+
+    def __init__(self, path: Optional[Path] = None, added: Optional[Dict[str, Document]] = None, deleted: Optional[Set[str]] = None):
+        self.path = path
+        self.added: Dict[str, Document] = added if added is not None else {}
+        # Ids of base chunks deleted since the base was written
+        self.deleted: Set[str] = deleted if deleted is not None else set()
+        # Opened right away so the file stays readable after a compaction removes it (on POSIX)
+        self._conn = _connect_read_only(path) if path is not None else None
+        self._conn_lock = threading.Lock()
+
+    def _base_row(self, chunk_id: str):
+        if self._conn is None or chunk_id in self.deleted:
+            return None
+        with self._conn_lock:
+            return self._conn.execute(
+                "SELECT text, metadata FROM documents WHERE chunk_id = ?", (chunk_id,)
+            ).fetchone()
+
+    def __contains__(self, chunk_id: str) -> bool:
+        return chunk_id in self.added or self._base_row(chunk_id) is not None
+
+    def search(self, search: str) -> Union[str, Document]:
+        document = self.added.get(search)
+        if document is not None:
+            return document
+        row = self._base_row(search)
+        if row is None:
+            return f"ID {search} not found."
+        return Document(id=search, page_content=row[0], metadata=pickle.loads(row[1]))
+
+    def mget(self, ids: List[str]) -> Dict[str, Document]:
+        """Looks up several chunks with a single query of the base file, returning those found by id."""
+        found = {chunk_id: self.added[chunk_id] for chunk_id in ids if chunk_id in self.added}
+        missing = [chunk_id for chunk_id in set(ids) if chunk_id not in found and chunk_id not in self.deleted]
+        if self._conn is not None and missing:
+            with self._conn_lock:
+                rows = self._conn.execute(
+                    f"SELECT chunk_id, text, metadata FROM documents WHERE chunk_id IN ({','.join('?' * len(missing))})",
+                    missing,
+                ).fetchall()
+            for chunk_id, text, metadata in rows:
+                found[chunk_id] = Document(id=chunk_id, page_content=text, metadata=pickle.loads(metadata))
+        return found
+
+    def add(self, texts: Dict[str, Document]) -> None:
+        overlapping = [chunk_id for chunk_id in texts if chunk_id in self]
+        if overlapping:
+            raise ValueError(f"Tried to add ids that already exist: {overlapping}")
+        self.added.update(texts)
+        # A base chunk deleted then added again is served from memory until the next compaction
+        self.deleted.difference_update(texts)
+
+    def delete(self, ids: List) -> None:
+        for chunk_id in ids:
+            if self.added.pop(chunk_id, None) is None and self._conn is not None:
+                self.deleted.add(chunk_id)
+
+    @property
+    def resident_count(self) -> int:
+        return len(self.added)
+
+    def snapshot(self) -> "LayeredDocstore":
+        """A copy unaffected by later changes, to write a new base from outside the index lock."""
+        return LayeredDocstore(self.path, dict(self.added), set(self.deleted))
+
+    def write(self, path: Path, index_to_docstore_id: Dict[int, str]):
+        """Writes the chunks of `index_to_docstore_id` (new position -> chunk id) as a base docstore file."""
+        # Opened as a URI so that the current base can be attached read-only
+        conn = sqlite3.connect(Path(path).resolve().as_uri(), uri=True)
+        try:
+            conn.executescript(SCHEMA)
+            if self.path is not None:
+                # Unchanged chunks are copied from the current base file without loading them
+                conn.execute("ATTACH DATABASE ? AS base", (_read_only_uri(self.path),))
+                conn.execute("CREATE TEMP TABLE live (position INTEGER PRIMARY KEY, chunk_id TEXT NOT NULL)")
+                conn.executemany(
+                    "INSERT INTO live VALUES (?, ?)",
+                    (
+                        (position, chunk_id) for position, chunk_id in index_to_docstore_id.items()
+                        if chunk_id not in self.added and chunk_id not in self.deleted
+                    ),
+                )
+                conn.execute(
+                    "INSERT INTO documents SELECT live.position, live.chunk_id, b.text, b.metadata "
+                    "FROM live JOIN base.documents AS b ON b.chunk_id = live.chunk_id"
+                )
+            conn.executemany(
+                "INSERT INTO documents VALUES (?, ?, ?, ?)",
+                (
+                    (position, chunk_id, self.added[chunk_id].page_content, pickle.dumps(self.added[chunk_id].metadata))
+                    for position, chunk_id in index_to_docstore_id.items() if chunk_id in self.added
+                ),
+            )
+            written = conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+            if written != len(index_to_docstore_id):
+                raise RuntimeError(f"Docstore snapshot is missing {len(index_to_docstore_id) - written} indexed chunk(s).")
+            conn.commit()
+        finally:
+            conn.close()
@@ -1,6 +1,9 @@
 import os
 from pathlib import Path
+from typing import Dict, Iterable, Iterator, Optional, Tuple
 import logging
+import threading
+import time
 import uuid
 
 from langchain_community.document_loaders import (
@@ -14,165 +17,187 @@ from langchain_core.documents import Document
 
 
 import pytesseract
-from PIL import Image
-import whisper
 
-from ..core.config import UPLOADED_FILES_DIR, PROCESSED_FILES_DIR, WHISPER_MODEL_SIZE
+from . import ocr
+from ..core.config import UPLOADED_FILES_DIR, PROCESSED_FILES_DIR, PDF_LOADER, WHISPER_MODEL_SIZE
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 
 # --- Whisper Model Loading ---
+# Whisper (and torch) are only imported and loaded when the first audio file is processed
 WHISPER_MODEL = None
+_whisper_lock = threading.Lock()
+
 def load_whisper_model():
     global WHISPER_MODEL
-    if WHISPER_MODEL is None:
-        try:
-            logger.info(f"Loading Whisper model: {WHISPER_MODEL_SIZE}")
-            WHISPER_MODEL = whisper.load_model(WHISPER_MODEL_SIZE)
-            logger.info("Whisper model loaded successfully.")
-        except Exception as e:
-            logger.error(f"Failed to load Whisper model '{WHISPER_MODEL_SIZE}': {e}", exc_info=True)
-            WHISPER_MODEL = None
-
-load_whisper_model()
+    with _whisper_lock:
+        if WHISPER_MODEL is None:
+            try:
+                start = time.perf_counter()
+                logger.info(f"Loading Whisper model: {WHISPER_MODEL_SIZE}")
+                import whisper
+                WHISPER_MODEL = whisper.load_model(WHISPER_MODEL_SIZE)
+                logger.info(f"Whisper model loaded successfully in {time.perf_counter() - start:.1f}s.")
+            except Exception as e:
+                logger.error(f"Failed to load Whisper model '{WHISPER_MODEL_SIZE}': {e}", exc_info=True)
+                WHISPER_MODEL = None
+    return WHISPER_MODEL
 
 # --- Helper Function to Save Processed Text ---
-def save_processed_text(text_content: str, original_filename: str) -> Path:
-    """Saves the extracted text content to a file in the processed directory."""
+def new_processed_path(original_filename: str) -> Path:
+    """Returns a new path in the processed directory for the extracted text of a file."""
     base_name = Path(original_filename).stem
     # Use a unique identifier to prevent collisions if multiple files have the same name
     unique_id = uuid.uuid4().hex[:8]
-    output_filename = f"{base_name}_{unique_id}.txt"
-    output_path = PROCESSED_FILES_DIR / output_filename
-
-    try:
-        with open(output_path, 'w', encoding='utf-8') as f:
-            f.write(text_content)
-        logger.info(f"Saved processed text to: {output_path}")
-        return output_path
-    except Exception as e:
-        logger.error(f"Failed to save processed text for {original_filename} to {output_path}: {e}")
-        raise
+    return PROCESSED_FILES_DIR / f"{base_name}_{unique_id}.txt"
 
 # --- Image Processing (OCR) ---
 def process_image(file_path: Path) -> list[Document]:
-    """Extracts text from an image file using Tesseract OCR."""
+    """Extracts text from an image, multi-page TIFF or scanned PDF using Tesseract OCR, page by page."""
     logger.info(f"Processing image file: {file_path}")
     try:
-        text = pytesseract.image_to_string(Image.open(file_path))
-        if not text.strip():
+        pages = [(page, text) for page, text in enumerate(ocr.ocr_pages(file_path), start=1) if text.strip()]
+        if not pages:
             logger.warning(f"No text found in image: {file_path}")
             return []
 
-        saved_path = save_processed_text(text, file_path.name)
-        # Create a LangChain Document object
-        metadata = {"source": str(file_path.name), "processed_path": str(saved_path)}
-        doc = Document(page_content=text, metadata=metadata)
-        return [doc]
+        saved_path, _ = write_processed_text((text for _, text in pages), file_path.name)
+        # Create a LangChain Document object per page
+        return [
+            Document(
+                page_content=text,
+                metadata={"source": str(file_path.name), "processed_path": str(saved_path), "page": page},
+            )
+            for page, text in pages
+        ]
     except pytesseract.TesseractNotFoundError:
         logger.error(
             "Tesseract is not installed or not in the system's PATH. "
             "Please install Tesseract and configure the path if necessary. "
-            "Skipping OCR for: {file_path}"
+            f"Skipping OCR for: {file_path}"
         )
-        return []
+        raise RuntimeError("OCR failed: Tesseract is not installed or not in the system's PATH.")
     except Exception as e:
         logger.error(f"Error processing image {file_path}: {e}")
-        return []
-
-
-# --- Audio Processing (Transcription) ---
-def process_audio(file_path: Path) -> list[Document]:
-    """Transcribes an audio file using Whisper."""
-    logger.info(f"Processing audio file: {file_path}")
-    if WHISPER_MODEL is None:
-        logger.error("Whisper model not loaded. Cannot process audio file: {file_path}")
-        return []
-    try:
-        result = WHISPER_MODEL.transcribe(str(file_path), fp16=False) # fp16=False for CPU
-        text = result['text']
-
-        if not text.strip():
-            logger.warning(f"No text transcribed from audio: {file_path}")
-            return []
+        raise
 
-        saved_path = save_processed_text(text, file_path.name)
-        metadata = {"source": str(file_path.name), "processed_path": str(saved_path)}
-        doc = Document(page_content=text, metadata=metadata)
-        return [doc]
-    except Exception as e:
-        logger.error(f"Error processing audio {file_path}: {e}", exc_info=True)
-        if "ffmpeg" in str(e).lower():
-             logger.error("FFmpeg might not be installed or found. Please ensure FFmpeg is installed and in your system PATH.")
-        return []
 
 # --- Document Loading and Processing Map ---
+PDF_LOADERS = {"pypdf": PyPDFLoader, "unstructured": UnstructuredFileLoader}
+if PDF_LOADER not in PDF_LOADERS:
+    raise ValueError(f"Unsupported PDF_LOADER '{PDF_LOADER}'. Expected one of {', '.join(PDF_LOADERS)}.")
+
+# Audio files are not in here: ingestion jobs transcribe them in segments (see audio_transcription)
 PROCESSOR_MAP = {
-    ".pdf": UnstructuredFileLoader,
+    # pypdf (the default) extracts page by page, so large PDFs are never held in memory as a whole.
+    # Its text differs from Unstructured's (no layout analysis), which PDF_LOADER=unstructured keeps
+    ".pdf": PDF_LOADERS[PDF_LOADER],
     ".txt": UnstructuredFileLoader,
     ".docx": UnstructuredFileLoader,
     ".png": process_image, 
     ".jpg": process_image,
     ".jpeg": process_image,
-    ".mp3": process_audio,
-    ".wav": process_audio,
+    ".tif": process_image,
+    ".tiff": process_image,
     ".csv": CSVLoader,
     ".html": UnstructuredFileLoader,
 }
 
-def load_and_process_document(file_path: Path) -> list[Document]:
-    """Loads a document using the appropriate LangChain loader based on its extension."""
+def _create_loader(loader_class: type, file_path: Path):
+    if loader_class is UnstructuredFileLoader:
+        # "elements" mode yields the elements one by one instead of one string joining them with blank
+        # lines, which the processed file writer does too: the extracted text is the same, less empty elements
+        return UnstructuredFileLoader(str(file_path), mode="elements")
+    return loader_class(str(file_path))
+
+def _iter_sections(loader_class: type, file_path: Path) -> Iterator[str]:
+    """Lazily yields the non-empty text sections (pages, elements, rows) of a document."""
+    logger.info(f"Using LangChain loader: {loader_class.__name__} for {file_path.name}")
+    for doc in _create_loader(loader_class, file_path).lazy_load():
+        if doc.page_content.strip():
+            yield doc.page_content
+
+def write_processed_text(sections: Iterable[str], original_filename: str) -> Tuple[Optional[Path], int]:
+    """Streams text sections to a file in the processed directory, separated by blank lines.
+
+    Returns the saved path and the number of sections, or (None, 0) if there was no text.
+    """
+    output_path = new_processed_path(original_filename)
+    count = 0
+    try:
+        PROCESSED_FILES_DIR.mkdir(parents=True, exist_ok=True)
+        with open(output_path, 'w', encoding='utf-8') as f:
+            for section in sections:
+                if count:
+                    f.write("\n\n")
+                f.write(section)
+                count += 1
+    except Exception as e:
+        logger.error(f"Failed to save processed text for {original_filename} to {output_path}: {e}")
+        output_path.unlink(missing_ok=True)
+        raise
+    if not count:
+        output_path.unlink(missing_ok=True)
+        return None, 0
+    logger.info(f"Saved {count} processed sections to: {output_path}")
+    return output_path, count
+
+def extract_document_text(file_path: Path) -> Optional[Dict]:
+    """Extracts the text of a document to the processed directory without holding it in memory.
+
+    Returns {"processed_path", "sections"}, or None if the document holds no text. This small
+    summary is all that crosses the process boundary of the ingestion parse pool. Raises if the
+    document cannot be read, so ingestion jobs report the actual cause.
+    """
     if not file_path.is_file():
-        logger.error(f"File not found: {file_path}")
-        return []
+        raise FileNotFoundError(f"File not found: {file_path}")
 
     file_ext = file_path.suffix.lower()
     logger.info(f"Attempting to process file: {file_path} with extension: {file_ext}")
-
     processor = PROCESSOR_MAP.get(file_ext)
 
-    docs = []
     try:
-        if processor:
-            if isinstance(processor, type):
-                logger.info(f"Using LangChain loader: {processor.__name__} for {file_path.name}")
-                loader = processor(str(file_path))
-                docs = loader.load()
-                if docs:
-                    full_text = "\n\n".join([doc.page_content for doc in docs])
-                    save_processed_text(full_text, file_path.name)
-                    for doc in docs:
-                        doc.metadata["source"] = str(file_path.name)
-
-            else:
-                logger.info(f"Using custom processor for {file_path.name}")
-                docs = processor(file_path)
-        else:
+        if processor is not None and not isinstance(processor, type):
+            # OCR produces one small section and saves it itself
+            logger.info(f"Using custom processor for {file_path.name}")
+            docs = processor(file_path)
+            if not docs:
+                logger.warning(f"No documents extracted from file: {file_path}")
+                return None
+            return {"processed_path": docs[0].metadata["processed_path"], "sections": len(docs)}
+
+        if processor is None:
             # For unsupported explicit types, trying generic Unstructured loader
             logger.warning(f"No specific loader for extension '{file_ext}'. Attempting generic UnstructuredFileLoader.")
-            try:
-                loader = UnstructuredFileLoader(str(file_path))
-                docs = loader.load()
-                if docs:
-                    full_text = "\n\n".join([doc.page_content for doc in docs])
-                    save_processed_text(full_text, file_path.name)
-                    for doc in docs:
-                         doc.metadata["source"] = str(file_path.name)
-                else:
-                     logger.warning(f"UnstructuredFileLoader could not extract content from {file_path.name}")
-            except Exception as e:
-                logger.error(f"UnstructuredFileLoader failed for {file_path.name}: {e}")
-                docs = []
-
-        if not docs:
+            processor = UnstructuredFileLoader
+        processed_path, sections = write_processed_text(_iter_sections(processor, file_path), file_path.name)
+        if processed_path is None and processor is PyPDFLoader:
+            # Scanned PDFs have no text layer: OCR their page images instead
+            logger.info(f"No text layer found in {file_path.name}, running OCR on its pages.")
+            docs = process_image(file_path)
+            if docs:
+                return {"processed_path": docs[0].metadata["processed_path"], "sections": len(docs)}
+        if processed_path is None:
             logger.warning(f"No documents extracted from file: {file_path}")
+            return None
 
-        logger.info(f"Successfully processed {file_path.name}. Extracted {len(docs)} document sections.")
-        return docs
+        logger.info(f"Successfully processed {file_path.name}. Extracted {sections} document sections.")
+        return {"processed_path": str(processed_path), "sections": sections}
 
     except Exception as e:
         logger.error(f"Failed to load or process document {file_path}: {e}", exc_info=True)
-        return []
+        raise
+
+def load_and_process_document(file_path: Path) -> list[Document]:
+    """Loads a document as a single LangChain Document holding its extracted text.
 
+    Prefer `extract_document_text` for large files, which never loads the whole text.
+    """
+    extracted = extract_document_text(file_path)
+    if extracted is None:
+        return []
+    processed_path = Path(extracted["processed_path"])
+    metadata = {"source": str(file_path.name), "processed_path": str(processed_path)}
+    return [Document(page_content=processed_path.read_text(encoding="utf-8"), metadata=metadata)]
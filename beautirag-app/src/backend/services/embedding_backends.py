@@ -0,0 +1,211 @@
+import logging
+import multiprocessing
+import os
+import platform
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import nullcontext
+from functools import partial
+from pathlib import Path
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from ..core.file_lock import file_lock, file_locking_supported
+from ..core.config import (
+    EMBEDDING_MODEL_NAME,
+    EMBEDDING_BACKEND,
+    EMBEDDING_ONNX_INT8,
+    EMBEDDING_ONNX_DIR,
+    EMBEDDING_BATCH_SIZE,
+    EMBEDDING_THREADS,
+    EMBEDDING_WORKERS,
+    EMBEDDING_POOL_MIN_TEXTS,
+)
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+BACKEND_SENTENCE_TRANSFORMERS = "sentence_transformers"
+BACKEND_ONNX = "onnx"
+EMBEDDING_BACKENDS = (BACKEND_SENTENCE_TRANSFORMERS, BACKEND_ONNX)
+
+
+# --- Backends ---
+def _quantization_target() -> str:
+    """The int8 kernels of ONNX Runtime dynamic quantisation matching this CPU."""
+    if platform.machine().lower() in ("arm64", "aarch64"):
+        return "arm64"
+    try:
+        with open("/proc/cpuinfo") as f:
+            flags = set(f.read().split())
+    except OSError:
+        return "avx2"
+    if "avx512_vnni" in flags:
+        return "avx512_vnni"
+    if "avx512f" in flags:
+        return "avx512"
+    return "avx2"
+
+
+def _export_int8_model(model_name: str) -> Tuple[Path, str]:
+    """Exports the model to ONNX and quantises it to int8, once: later calls reuse the files.
+
+    Returns the directory of the exported model and the path of the quantised file within it.
+    """
+    target = _quantization_target()
+    directory = EMBEDDING_ONNX_DIR / re.sub(r"[^A-Za-z0-9_.-]", "_", model_name)
+    file_name = f"onnx/model_qint8_{target}.onnx"
+    # Server workers starting together export the model once
+    lock = file_lock(directory.with_name(directory.name + ".lock")) if file_locking_supported() else nullcontext()
+    with lock:
+        if not (directory / file_name).exists():
+            from sentence_transformers import SentenceTransformer, export_dynamic_quantized_onnx_model
+
+            logger.info(f"Exporting embedding model {model_name} to ONNX with int8 quantisation ({target}).")
+            model = SentenceTransformer(model_name, device="cpu", backend=BACKEND_ONNX)
+            model.save(str(directory))
+            export_dynamic_quantized_onnx_model(model, target, str(directory))
+    return directory, file_name
+
+
+def create_backend(backend: str = EMBEDDING_BACKEND, int8: bool = EMBEDDING_ONNX_INT8, threads: int = EMBEDDING_THREADS, batch_size: int = EMBEDDING_BATCH_SIZE) -> Embeddings:
+    """Loads the embedding model on one backend, in this process.
+
+    Both backends run the same sentence-transformers model through `HuggingFaceEmbeddings`,
+    so their vectors agree up to numerical precision (and int8 quantisation error).
+    """
+    from langchain_community.embeddings import HuggingFaceEmbeddings
+
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Unsupported embedding backend: {backend}. Expected one of {', '.join(EMBEDDING_BACKENDS)}.")
+    model_name = EMBEDDING_MODEL_NAME
+    model_kwargs = {"device": "cpu"}
+    if backend == BACKEND_ONNX:
+        import onnxruntime
+
+        session_options = onnxruntime.SessionOptions()
+        if threads > 0:
+            session_options.intra_op_num_threads = threads
+        onnx_kwargs = {"provider": "CPUExecutionProvider", "session_options": session_options}
+        if int8:
+            directory, onnx_kwargs["file_name"] = _export_int8_model(model_name)
+            model_name = str(directory)
+        model_kwargs.update(backend=BACKEND_ONNX, model_kwargs=onnx_kwargs)
+    elif threads > 0:
+        import torch
+
+        torch.set_num_threads(threads)
+
+    logger.info(f"Loading embedding model {EMBEDDING_MODEL_NAME} on {backend}{' (int8)' if backend == BACKEND_ONNX and int8 else ''}.")
+    return HuggingFaceEmbeddings(
+        model_name=model_name,
+        model_kwargs=model_kwargs,
+        encode_kwargs={"batch_size": batch_size},
+    )
+
+
+def model_key(backend: str = EMBEDDING_BACKEND, int8: bool = EMBEDDING_ONNX_INT8) -> str:
+    """Name of the vectors a backend produces: quantised models get their own embedding cache."""
+    if backend == BACKEND_ONNX and int8:
+        return f"{EMBEDDING_MODEL_NAME}@onnx-int8"
+    return EMBEDDING_MODEL_NAME
+
+
+# --- Multi-Process Pool ---
+# Model of a pool worker process, created by its initializer
+_worker_model: Optional[Embeddings] = None
+
+# Pools started in this process, stopped by `shutdown`
+_pools: List["MultiProcessEmbeddings"] = []
+_pools_lock = threading.Lock()
+
+
+def _init_worker(factory: Callable[[], Embeddings]):
+    global _worker_model
+    _worker_model = factory()
+
+
+def _embed_in_worker(texts: List[str]) -> np.ndarray:
+    return np.asarray(_worker_model.embed_documents(texts), dtype=np.float32)
+
+
+class MultiProcessEmbeddings(Embeddings):
+    """Embeds large batches of texts on a pool of worker processes, each loading its own model
+    from `factory`, so that encoding uses every core instead of one process's thread pool.
+
+    A batch of at least `min_texts` texts is cut into one contiguous slice per worker. Queries
+    and smaller batches are embedded by a model in this process, which avoids the round trip.
+    """
+
+    def __init__(self, factory: Callable[[], Embeddings], workers: int, min_texts: int = EMBEDDING_POOL_MIN_TEXTS):
+        self.factory = factory
+        self.workers = workers
+        self.min_texts = min_texts
+        self.local = factory()
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        with _pools_lock:
+            _pools.append(self)
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                logger.info(f"Starting embedding pool with {self.workers} worker(s).")
+                # "spawn" avoids forking the server process while its threads hold locks
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                    initargs=(self.factory,),
+                )
+            return self._pool
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if len(texts) < self.min_texts or self.workers < 2:
+            return self.local.embed_documents(texts)
+        pool = self._get_pool()
+        bounds = np.linspace(0, len(texts), min(self.workers, len(texts)) + 1).astype(int)
+        try:
+            futures = [pool.submit(_embed_in_worker, texts[start:end]) for start, end in zip(bounds, bounds[1:])]
+            return np.concatenate([future.result() for future in futures]).tolist()
+        except BrokenProcessPool:
+            logger.warning("Embedding pool is broken, it will be restarted. Embedding this batch in-process.")
+            with self._lock:
+                if self._pool is pool:
+                    self._pool = None
+            pool.shutdown(wait=False, cancel_futures=True)
+            return self.local.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.local.embed_query(text)
+
+    def shutdown(self, wait: bool = True):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=wait, cancel_futures=True)
+
+
+def create_embeddings() -> Embeddings:
+    """The configured embedding model: EMBEDDING_BACKEND, on EMBEDDING_WORKERS processes when more than one."""
+    if EMBEDDING_WORKERS > 1:
+        # Workers share the cores instead of each using all of them
+        threads = EMBEDDING_THREADS or max(1, (os.cpu_count() or 1) // EMBEDDING_WORKERS)
+        if EMBEDDING_BACKEND == BACKEND_ONNX and EMBEDDING_ONNX_INT8:
+            # Exported here once rather than by every worker
+            _export_int8_model(EMBEDDING_MODEL_NAME)
+        return MultiProcessEmbeddings(partial(create_backend, threads=threads), EMBEDDING_WORKERS)
+    return create_backend()
+
+
+def shutdown(wait: bool = True):
+    """Stops the embedding pools. Called on application shutdown."""
+    with _pools_lock:
+        pools = list(_pools)
+        _pools.clear()
+    for pool in pools:
+        pool.shutdown(wait=wait)
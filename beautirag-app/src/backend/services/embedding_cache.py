@@ -0,0 +1,224 @@
+import hashlib
+import json
+import logging
+import re
+import threading
+from contextlib import nullcontext
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from ..core import metrics
+from ..core.file_lock import file_lock
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+KEY_BYTES = 16
+INITIAL_CAPACITY = 1024
+# Fraction of the cache freed at once when it is full, so eviction is not paid on every insert
+EVICTION_FRACTION = 0.1
+
+
+def text_key(text: str) -> bytes:
+    """Compact cache key of a chunk text."""
+    return hashlib.sha256(text.encode("utf-8")).digest()[:KEY_BYTES]
+
+
+class EmbeddingCache:
+    """On-disk cache of float32 embeddings for one embedding model.
+
+    Vectors live in a memory-mapped `(capacity, dim)` float32 file, next to a memory-mapped
+    array of text hashes (the key index) and a last-access clock used for LRU eviction once
+    `max_entries` vectors are stored. Only the hash -> slot dictionary is kept in memory.
+
+    When `shared`, several processes use the same files: lookups and writes take a file lock,
+    and every write bumps a generation number that makes the other processes reload the
+    hash -> slot dictionary before their next access.
+    """
+
+    def __init__(self, directory: Path, model_name: str, max_entries: int, shared: bool = False):
+        safe_name = re.sub(r"[^A-Za-z0-9_.-]", "_", model_name)
+        self.directory = Path(directory) / safe_name
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.shared = shared
+        self.dim: Optional[int] = None
+        self.capacity = 0
+        self._clock = 0
+        self._generation = 0
+        self._slots: Dict[bytes, int] = {}
+        self._free: List[int] = []
+        self._vectors: Optional[np.memmap] = None
+        self._keys: Optional[np.memmap] = None
+        self._last_used: Optional[np.memmap] = None
+        self._lock = threading.Lock()
+        self._load()
+
+    # --- Storage ---
+    @property
+    def _meta_file(self) -> Path:
+        return self.directory / "meta.json"
+
+    def _open_arrays(self, capacity: int):
+        """(Re)maps the storage files with the given capacity, growing them if needed."""
+        specs = (
+            ("vectors.f32", np.float32, (capacity, self.dim)),
+            ("keys.bin", np.uint8, (capacity, KEY_BYTES)),
+            ("last_used.u64", np.uint64, (capacity,)),
+        )
+        arrays = []
+        for filename, dtype, shape in specs:
+            path = self.directory / filename
+            size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+            with open(path, "ab") as f:
+                if f.tell() < size:
+                    f.truncate(size)
+            arrays.append(np.memmap(path, dtype=dtype, mode="r+", shape=shape))
+        self._vectors, self._keys, self._last_used = arrays
+        self.capacity = capacity
+
+    def _save_meta(self):
+        self._meta_file.write_text(json.dumps({
+            "model_name": self.model_name,
+            "dim": self.dim,
+            "capacity": self.capacity,
+            "clock": self._clock,
+            "generation": self._generation,
+        }))
+
+    def _load(self):
+        if not self._meta_file.exists():
+            return
+        try:
+            meta = json.loads(self._meta_file.read_text())
+            self.dim = meta["dim"]
+            self._clock = meta["clock"]
+            self._generation = meta.get("generation", 0)
+            self._open_arrays(meta["capacity"])
+            last_used = np.asarray(self._last_used)
+            self._slots = {self._keys[slot].tobytes(): int(slot) for slot in np.flatnonzero(last_used)}
+            self._free = np.flatnonzero(last_used == 0).tolist()
+            logger.info(f"Loaded embedding cache for '{self.model_name}' with {len(self._slots)} vectors.")
+        except Exception as e:
+            logger.error(f"Failed to load embedding cache from {self.directory}, starting empty: {e}", exc_info=True)
+            self.dim, self.capacity, self._clock = None, 0, 0
+            self._slots, self._free = {}, []
+
+    def _file_lock(self, shared: bool):
+        if not self.shared:
+            return nullcontext()
+        return file_lock(self.directory / "cache.lock", shared=shared)
+
+    def _sync(self):
+        """Reloads the slot dictionary if another process wrote to the cache. Called under the file lock."""
+        if not self.shared or not self._meta_file.exists():
+            return
+        meta = json.loads(self._meta_file.read_text())
+        if meta.get("generation", 0) != self._generation:
+            self._load()
+        self._clock = max(self._clock, meta["clock"])
+
+    def _grow_or_evict(self, needed: int):
+        """Makes room for `needed` new vectors, growing the files up to `max_entries` then evicting LRU entries."""
+        if len(self._free) >= needed:
+            return
+        if self.capacity < self.max_entries:
+            new_capacity = min(self.max_entries, max(INITIAL_CAPACITY, self.capacity * 2, len(self._slots) + needed))
+            self._free.extend(range(self.capacity, new_capacity))
+            self._open_arrays(new_capacity)
+        if len(self._free) < needed and self._slots:
+            evict_count = min(len(self._slots), max(needed - len(self._free), int(self.capacity * EVICTION_FRACTION)))
+            used = np.fromiter(self._slots.values(), dtype=np.int64)
+            oldest = used[np.argpartition(self._last_used[used], evict_count - 1)[:evict_count]]
+            for slot in oldest.tolist():
+                del self._slots[self._keys[slot].tobytes()]
+                self._last_used[slot] = 0
+                self._free.append(slot)
+            logger.info(f"Evicted {evict_count} least recently used vectors from the embedding cache.")
+
+    # --- Public API ---
+    def get_many(self, keys: List[bytes]) -> Dict[int, np.ndarray]:
+        """Returns the cached vectors as a {position in keys: vector} dict."""
+        found = {}
+        with self._lock, self._file_lock(shared=True):
+            self._sync()
+            if self.dim is None:
+                return found
+            self._clock += 1
+            for position, key in enumerate(keys):
+                slot = self._slots.get(key)
+                if slot is not None:
+                    found[position] = np.array(self._vectors[slot])
+                    self._last_used[slot] = self._clock
+        return found
+
+    def put_many(self, keys: List[bytes], vectors: np.ndarray):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self._lock, self._file_lock(shared=False):
+            self._sync()
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+                self.directory.mkdir(parents=True, exist_ok=True)
+            new_keys = {}
+            for key, vector in zip(keys, vectors):
+                if key not in self._slots:
+                    new_keys[key] = vector
+            # A batch larger than the whole cache only keeps its last vectors
+            new_items = list(new_keys.items())[-self.max_entries:]
+            if not new_items:
+                return
+            self._grow_or_evict(len(new_items))
+            self._clock += 1
+            self._generation += 1
+            for key, vector in new_items:
+                slot = self._free.pop()
+                self._vectors[slot] = vector
+                self._keys[slot] = np.frombuffer(key, dtype=np.uint8)
+                self._last_used[slot] = self._clock
+                self._slots[key] = slot
+            self._vectors.flush()
+            self._keys.flush()
+            self._last_used.flush()
+            self._save_meta()
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that only runs the model on chunk texts missing from an `EmbeddingCache`.
+
+    Queries are passed through, they are rarely repeated verbatim.
+    """
+
+    def __init__(self, base: Embeddings, cache: EmbeddingCache):
+        self.base = base
+        self.cache = cache
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [text_key(text) for text in texts]
+        found = self.cache.get_many(keys)
+        missing = [position for position in range(len(texts)) if position not in found]
+        if missing:
+            # Duplicate texts inside the batch are embedded once
+            unique_positions = {}
+            for position in missing:
+                unique_positions.setdefault(keys[position], position)
+            computed = np.asarray(
+                self.base.embed_documents([texts[position] for position in unique_positions.values()]),
+                dtype=np.float32,
+            )
+            self.cache.put_many(list(unique_positions.keys()), computed)
+            computed_by_key = dict(zip(unique_positions.keys(), computed))
+            for position in missing:
+                found[position] = computed_by_key[keys[position]]
+        metrics.CACHE_LOOKUPS.labels("embedding", "hit").inc(len(texts) - len(missing))
+        metrics.CACHE_LOOKUPS.labels("embedding", "miss").inc(len(missing))
+        logger.info(f"Embedding cache: {len(texts) - len(missing)} hit(s), {len(missing)} miss(es).")
+        return [found[position].tolist() for position in range(len(texts))]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.base.embed_query(text)
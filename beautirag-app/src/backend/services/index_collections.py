@@ -0,0 +1,389 @@
+import hashlib
+import heapq
+import itertools
+import json
+import logging
+import re
+import shutil
+import threading
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from operator import itemgetter
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import faiss
+import numpy as np
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+
+from .index_segments import SegmentedIndex, index_exists
+from ..core.config import (
+    DEFAULT_COLLECTION,
+    COLLECTIONS_DIR,
+    COLLECTION_SHARDS,
+    FAISS_INDEX_DIR,
+    INGESTION_MANIFEST_FILE,
+    UPLOADED_FILES_DIR,
+)
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+COLLECTION_NAME_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+# Written next to the shards of a collection when it is created: {"shards": <count>}
+CONFIG_NAME = "collection.json"
+# Suffix of the directory a collection is rebuilt into, next to its own
+STAGING_SUFFIX = ".rebuild"
+# Directory of the upload directory holding uploads not indexed yet (collection names cannot start with a dot)
+INCOMING_DIR_NAME = ".incoming"
+
+# Incremented on every collection load, so versions stay unique across unloads and reloads
+_generations = itertools.count(1)
+
+
+class CollectionNotFoundError(LookupError):
+    pass
+
+
+# --- Paths ---
+def validate_collection_name(name: str) -> str:
+    if not COLLECTION_NAME_PATTERN.match(name or ""):
+        raise ValueError(f"Invalid collection name '{name}'. Use 1 to 64 letters, digits, '-' or '_'.")
+    return name
+
+def collection_index_dir(name: str) -> Path:
+    # The default collection keeps the location of the single index of earlier versions
+    return FAISS_INDEX_DIR if name == DEFAULT_COLLECTION else COLLECTIONS_DIR / name / "index"
+
+def collection_manifest_file(name: str) -> Path:
+    return INGESTION_MANIFEST_FILE if name == DEFAULT_COLLECTION else COLLECTIONS_DIR / name / INGESTION_MANIFEST_FILE.name
+
+def collection_upload_dir(name: str) -> Path:
+    return UPLOADED_FILES_DIR if name == DEFAULT_COLLECTION else UPLOADED_FILES_DIR / name
+
+def collection_incoming_dir(name: str) -> Path:
+    """Uploads wait here, each in a directory of its own, until they are indexed and moved to the upload directory."""
+    return collection_upload_dir(name) / INCOMING_DIR_NAME
+
+def list_collection_names() -> List[str]:
+    """Returns the default collection and every collection created on disk."""
+    names = {DEFAULT_COLLECTION}
+    if COLLECTIONS_DIR.exists():
+        names.update(path.name for path in COLLECTIONS_DIR.iterdir() if (path / "index" / CONFIG_NAME).exists())
+    return sorted(names)
+
+def collection_exists(name: str) -> bool:
+    """The default collection always exists, the others once they were created by an ingestion."""
+    return name == DEFAULT_COLLECTION or (collection_index_dir(name) / CONFIG_NAME).exists()
+
+def create_collection(name: str):
+    """Creates an empty collection on disk with the configured shard count, unless it exists already."""
+    directory = collection_index_dir(validate_collection_name(name))
+    if (directory / CONFIG_NAME).exists() or index_exists(directory):
+        return
+    directory.mkdir(parents=True, exist_ok=True)
+    (directory / CONFIG_NAME).write_text(json.dumps({"shards": max(1, COLLECTION_SHARDS)}))
+
+def _shard_of(chunk_id: str, shard_count: int) -> int:
+    return int.from_bytes(hashlib.sha1(chunk_id.encode("utf-8")).digest()[:8], "big") % shard_count
+
+
+# --- Shard Search ---
+def _search_store(store: FAISS, query_vectors: np.ndarray, k: int) -> List[List[Tuple[float, Document]]]:
+    """Searches one shard, returning (distance, chunk) pairs per query."""
+    if store._normalize_L2:
+        query_vectors = query_vectors.copy()
+        faiss.normalize_L2(query_vectors)
+    distances, positions = store.index.search(query_vectors, k)
+    hit_ids = [
+        [(float(distance), store.index_to_docstore_id[position]) for distance, position in zip(row_distances, row_positions) if position != -1]
+        for row_distances, row_positions in zip(distances, positions)
+    ]
+    # The documents of all hits are fetched at once, from disk for chunks of the base
+    documents = store.docstore.mget([chunk_id for row in hit_ids for _, chunk_id in row])
+    return [
+        [(distance, documents[chunk_id]) for distance, chunk_id in row if chunk_id in documents]
+        for row in hit_ids
+    ]
+
+
+class Collection:
+    """A named set of documents stored in one or more `SegmentedIndex` shards.
+
+    Chunks are assigned to a shard by a hash of their id, so a shard holds about 1 / n of the
+    collection. A search queries every non-empty shard, in parallel when there are several,
+    and merges their top k results by distance.
+
+    On disk a single-shard collection is one segmented index directory; with n shards the
+    directory holds shard-00 ... shard-<n-1>.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        directory: Path,
+        index_factory: Callable[[Path], SegmentedIndex],
+        search_executor: ThreadPoolExecutor,
+        shard_count: Optional[int] = None,
+    ):
+        self.name = name
+        self.directory = directory
+        self.shard_count = shard_count or self._read_shard_count()
+        if self.shard_count == 1:
+            shard_dirs = [directory]
+        else:
+            shard_dirs = [directory / f"shard-{shard:02d}" for shard in range(self.shard_count)]
+        self.shards = [index_factory(shard_dir) for shard_dir in shard_dirs]
+        self.generation = next(_generations)
+        # Operations currently using the collection, which is only unloaded when there are none
+        self.pins = 0
+        self._search_executor = search_executor
+        self._loaded = False
+        self._load_lock = threading.Lock()
+
+    @property
+    def _config_path(self) -> Path:
+        return self.directory / CONFIG_NAME
+
+    def _read_shard_count(self) -> int:
+        if self._config_path.exists():
+            return json.loads(self._config_path.read_text())["shards"]
+        if index_exists(self.directory):
+            # Index written before collections existed
+            return 1
+        return max(1, COLLECTION_SHARDS)
+
+    def _save_config(self):
+        if not self._config_path.exists():
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self._config_path.write_text(json.dumps({"shards": self.shard_count}))
+
+    def ensure_loaded(self):
+        """Loads the shards from disk on first use."""
+        if self._loaded:
+            return
+        with self._load_lock:
+            if self._loaded:
+                return
+            for shard in self.shards:
+                # In shared mode loading also starts following the index published by the other workers
+                if not (shard.exists() or shard.shared):
+                    continue
+                try:
+                    logger.info(f"Loading FAISS index of collection '{self.name}' from: {shard.directory}")
+                    shard.load()
+                except Exception as e:
+                    logger.error(f"Failed to load FAISS index from {shard.directory}: {e}", exc_info=True)
+            self._loaded = True
+
+    @property
+    def version(self) -> Tuple[int, int]:
+        """Changes every time the collection changes, and when it is reloaded."""
+        return self.generation, sum(shard.version for shard in self.shards)
+
+    @property
+    def busy(self) -> bool:
+        return any(shard.busy for shard in self.shards)
+
+    def chunk_count(self) -> int:
+        return sum(shard.chunk_count() for shard in self.shards)
+
+    # --- Writing ---
+    def contains(self, chunk_id: str) -> bool:
+        store = self.shards[_shard_of(chunk_id, self.shard_count)].store
+        return store is not None and chunk_id in store.docstore
+
+    def get_documents(self, ids: Iterable[str]) -> Dict[str, Document]:
+        """Returns the stored chunks of these ids, by id. Unknown ids are left out."""
+        ids_by_shard = defaultdict(list)
+        for chunk_id in ids:
+            ids_by_shard[_shard_of(chunk_id, self.shard_count)].append(chunk_id)
+        documents = {}
+        for shard, shard_ids in ids_by_shard.items():
+            store = self.shards[shard].store
+            if store is not None:
+                documents.update(store.docstore.mget(shard_ids))
+        return documents
+
+    def add(self, texts: List[str], vectors, metadatas: List[dict], ids: List[str]):
+        self._save_config()
+        vectors = np.asarray(vectors, dtype=np.float32)
+        positions_by_shard = defaultdict(list)
+        for position, chunk_id in enumerate(ids):
+            positions_by_shard[_shard_of(chunk_id, self.shard_count)].append(position)
+        for shard, positions in positions_by_shard.items():
+            self.shards[shard].add(
+                [texts[position] for position in positions],
+                vectors[positions],
+                [metadatas[position] for position in positions],
+                [ids[position] for position in positions],
+            )
+
+    def delete(self, ids: List[str]) -> int:
+        ids_by_shard = defaultdict(list)
+        for chunk_id in ids:
+            ids_by_shard[_shard_of(chunk_id, self.shard_count)].append(chunk_id)
+        return sum(self.shards[shard].delete(shard_ids) for shard, shard_ids in ids_by_shard.items())
+
+    def flush(self):
+        for shard in self.shards:
+            shard.flush()
+
+    def compact(self):
+        for shard in self.shards:
+            shard.compact()
+
+    # --- Rebuild ---
+    def write_base(self):
+        """Writes every shard as a single base of the target index type (see `SegmentedIndex.write_base`)."""
+        for shard in self.shards:
+            shard.write_base()
+
+    def install(self, staged: "Collection"):
+        """Replaces the content of every shard with the base of the same shard of a staged rebuild."""
+        if staged.shard_count != self.shard_count:
+            raise RuntimeError(f"Cannot install {staged.shard_count} shard(s) in collection '{self.name}' of {self.shard_count}.")
+        self._save_config()
+        for shard, staged_shard in zip(self.shards, staged.shards):
+            shard.install_base(staged_shard)
+
+    def close(self):
+        for shard in self.shards:
+            shard.close()
+
+    # --- Search ---
+    def search_batch(self, query_vectors, k: int) -> List[List[Document]]:
+        """Returns the k chunks closest to each query vector, over all shards."""
+        stores = [shard.store for shard in self.shards if shard.store is not None]
+        if not stores:
+            raise RuntimeError(f"Collection '{self.name}' is empty. Add documents first.")
+        matrix = np.asarray(query_vectors, dtype=np.float32).reshape(-1, stores[0].index.d)
+        if len(stores) == 1:
+            return [[document for _, document in row] for row in _search_store(stores[0], matrix, k)]
+
+        shard_results = list(self._search_executor.map(lambda store: _search_store(store, matrix, k), stores))
+        select = heapq.nlargest if stores[0].index.metric_type == faiss.METRIC_INNER_PRODUCT else heapq.nsmallest
+        return [
+            [document for _, document in select(k, itertools.chain(*rows), key=itemgetter(0))]
+            for rows in zip(*shard_results)
+        ]
+
+    def search(self, query_vector, k: int) -> List[Document]:
+        return self.search_batch([query_vector], k)[0]
+
+    # --- Reporting ---
+    def stats(self) -> Dict:
+        return {
+            "collection": self.name,
+            "chunks": self.chunk_count(),
+            "shard_count": self.shard_count,
+            "shards": [shard.stats() for shard in self.shards],
+        }
+
+    def measure_recall(self, k: int = 5) -> Dict:
+        return {"collection": self.name, "shards": [shard.measure_recall(k) for shard in self.shards]}
+
+
+class CollectionRegistry:
+    """Loads collections on first use and keeps at most `max_loaded` of them in memory.
+
+    Collections are pinned by `use` while an operation runs on them. Beyond `max_loaded` loaded
+    collections, the least recently used ones that are neither pinned nor compacting are
+    unloaded, after persisting their pending changes. A collection used again while it is being
+    unloaded is only reloaded once its changes are persisted.
+    """
+
+    def __init__(self, index_factory: Callable[[Path], SegmentedIndex], max_loaded: int, search_workers: int):
+        self.max_loaded = max_loaded
+        self._index_factory = index_factory
+        # Least recently used first
+        self._collections: "OrderedDict[str, Collection]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Collections being unloaded, set once their pending changes are persisted
+        self._closing: Dict[str, threading.Event] = {}
+        self._search_executor = ThreadPoolExecutor(max_workers=search_workers, thread_name_prefix="shard-search")
+
+    @contextmanager
+    def use(self, name: str) -> Iterator[Collection]:
+        """Yields the loaded collection of this name.
+
+        Raises CollectionNotFoundError if it was never created (see `create_collection`).
+        """
+        validate_collection_name(name)
+        with self._lock:
+            collection = self._collections.get(name)
+            if collection is None:
+                if not collection_exists(name):
+                    raise CollectionNotFoundError(f"Collection '{name}' not found.")
+                collection = Collection(name, collection_index_dir(name), self._index_factory, self._search_executor)
+                self._collections[name] = collection
+            self._collections.move_to_end(name)
+            collection.pins += 1
+            closing = self._closing.get(name)
+        try:
+            if closing is not None:
+                closing.wait()
+            collection.ensure_loaded()
+            yield collection
+        finally:
+            with self._lock:
+                collection.pins -= 1
+                idle = self._take_idle()
+            self._unload(idle)
+
+    def create_staging(self, name: str, shard_count: int, index_factory: Callable[[Path], SegmentedIndex]) -> Collection:
+        """Returns an empty collection in a directory next to the one of `name`, with `shard_count`
+        shards, to rebuild it into. It is not registered: queries keep using the current collection
+        until the staged one is installed into it (`Collection.install`)."""
+        directory = collection_index_dir(validate_collection_name(name))
+        staging_dir = directory.with_name(directory.name + STAGING_SUFFIX)
+        # Left over by an interrupted rebuild
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        return Collection(name, staging_dir, index_factory, self._search_executor, shard_count=shard_count)
+
+    def _take_idle(self) -> List[Tuple[Collection, threading.Event]]:
+        """Removes the collections to unload from the registry. Called under the registry lock."""
+        idle = []
+        excess = len(self._collections) - self.max_loaded
+        for name, collection in list(self._collections.items()):
+            if excess <= 0:
+                break
+            if collection.pins or collection.busy or name in self._closing:
+                continue
+            del self._collections[name]
+            excess -= 1
+            self._closing[name] = closed = threading.Event()
+            idle.append((collection, closed))
+        return idle
+
+    def _unload(self, idle: List[Tuple[Collection, threading.Event]]):
+        # Persisting runs outside the registry lock, so it does not hold up the other collections
+        for collection, closed in idle:
+            try:
+                collection.close()
+                logger.info(f"Unloaded idle collection '{collection.name}'.")
+            except Exception as e:
+                logger.error(f"Failed to persist collection '{collection.name}' while unloading it: {e}", exc_info=True)
+            finally:
+                with self._lock:
+                    del self._closing[collection.name]
+                closed.set()
+
+    def loaded_chunk_count(self) -> int:
+        with self._lock:
+            return sum(collection.chunk_count() for collection in self._collections.values())
+
+    def describe(self) -> List[Dict]:
+        """Lists the collections on disk, with the size of the loaded ones."""
+        with self._lock:
+            loaded = dict(self._collections)
+        return [
+            {
+                "collection": name,
+                "loaded": name in loaded,
+                "chunks": loaded[name].chunk_count() if name in loaded else None,
+            }
+            for name in list_collection_names()
+        ]
@@ -0,0 +1,309 @@
+import argparse
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from langchain_core.documents import Document
+
+from . import audio_transcription, embedding_backends, ingestion_jobs, ingestion_manifest, vector_store_manager
+from .index_collections import Collection, list_collection_names, validate_collection_name
+from .ingestion_jobs import JOB_COMPLETED, JOB_FAILED, JOB_QUEUED, JOB_RUNNING
+from ..core import metrics
+from ..core.config import (
+    DEFAULT_COLLECTION,
+    INDEX_REBUILD_WORKERS,
+    INGEST_EMBED_BATCH_SIZE,
+    INGEST_FLUSH_CHUNKS,
+    INGEST_JOB_HISTORY,
+)
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# A rebuild re-creates the vector index of a collection from the text extracted from its documents
+# at ingestion, without parsing them again: the text is split and embedded again,
+# INDEX_REBUILD_WORKERS documents at a time, into a staging index next to the collection's, which
+# keeps serving queries and ingesting uploads meanwhile. Documents added, replaced or deleted during
+# the rebuild are then caught up on the index worker, and the staged index is swapped in at once.
+# It moves a collection to a new embedding model, chunking or index type, or recovers a damaged index.
+#
+# Transcripts of audio files, and documents whose extracted text is gone, are re-embedded from the
+# chunks stored in the current index instead, which keep their audio timings. Only documents
+# recorded in the ingestion manifest are rebuilt.
+#
+# From the command line (with the server stopped, unless INDEX_SHARED is set):
+#     python -m backend.services.index_rebuild [--collection NAME ...]
+
+# The swap waits for files being ingested into the collection, checking again this often
+_IN_FLIGHT_RETRY_SECONDS = 1.0
+
+# --- Rebuild Stages ---
+STAGE_BUILDING = "building"
+STAGE_CATCHING_UP = "catching_up"
+STAGE_INSTALLED = "installed"
+
+
+class RebuildJob:
+    """Tracks the progress of one index rebuild."""
+
+    def __init__(self, collection: str = DEFAULT_COLLECTION):
+        self.id = uuid.uuid4().hex
+        self.collection = collection
+        self.status = JOB_QUEUED
+        self.stage: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.sources_total = 0
+        self.sources_done = 0
+        # Sources added, replaced or deleted while the rebuild ran
+        self.sources_caught_up = 0
+        self.chunks = 0
+        self.error: Optional[str] = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_finished(self) -> bool:
+        return self.status in (JOB_COMPLETED, JOB_FAILED)
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                "job_id": self.id,
+                "status": self.status,
+                "stage": self.stage,
+                "collection": self.collection,
+                "created_at": self.created_at,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at,
+                "sources_total": self.sources_total,
+                "sources_done": self.sources_done,
+                "sources_caught_up": self.sources_caught_up,
+                "chunks": self.chunks,
+                "error": self.error,
+            }
+
+
+# --- Job Registry ---
+_jobs: "OrderedDict[str, RebuildJob]" = OrderedDict()
+_jobs_lock = threading.Lock()
+
+
+def get_job(job_id: str) -> Optional[RebuildJob]:
+    with _jobs_lock:
+        return _jobs.get(job_id)
+
+
+def _register_job(job: RebuildJob):
+    """Registers a rebuild, unless one of the same collection is still running."""
+    with _jobs_lock:
+        for other in _jobs.values():
+            if other.collection == job.collection and not other.is_finished:
+                raise RuntimeError(f"Collection '{job.collection}' is already being rebuilt (job {other.id}).")
+        _jobs[job.id] = job
+        finished = [job_id for job_id, j in _jobs.items() if j.is_finished]
+        for job_id in finished[:max(0, len(_jobs) - INGEST_JOB_HISTORY)]:
+            del _jobs[job_id]
+
+
+# --- Building ---
+class _StagedIndex:
+    """The staging collection of a rebuild, filled by several threads."""
+
+    def __init__(self, job: RebuildJob, staged: Collection):
+        self.job = job
+        self.collection = staged
+        self._unsaved = 0
+        self._lock = threading.Lock()
+
+    def index_chunks(self, chunks: Iterable[Document], skip: Iterable[str] = ()) -> List[str]:
+        """Embeds and adds a chunk stream, `INGEST_EMBED_BATCH_SIZE` chunks at a time, leaving out
+        the ids in `skip`. Returns the ids of all chunks of the stream, in order."""
+        skip = set(skip)
+        chunk_ids = []
+        chunks = iter(chunks)
+        while batch := list(islice(chunks, INGEST_EMBED_BATCH_SIZE)):
+            chunk_ids.extend(chunk.metadata["chunk_id"] for chunk in batch)
+            batch = [chunk for chunk in batch if chunk.metadata["chunk_id"] not in skip]
+            if not batch:
+                continue
+            texts = [chunk.page_content for chunk in batch]
+            with metrics.timed("embed"):
+                vectors = vector_store_manager.embed_chunks(texts)
+            self.collection.add(
+                texts, vectors, [chunk.metadata for chunk in batch], [chunk.metadata["chunk_id"] for chunk in batch]
+            )
+            self._added(len(batch))
+        return chunk_ids
+
+    def _added(self, count: int):
+        with self.job._lock:
+            self.job.chunks += count
+        with self._lock:
+            self._unsaved += count
+            flush = self._unsaved >= INGEST_FLUSH_CHUNKS
+            if flush:
+                self._unsaved = 0
+        # Persist along the way so pending segment data does not grow with the collection
+        if flush:
+            self.collection.flush()
+
+
+def _source_chunks(filename: str, content_hash: str, collection: str) -> Iterator[Document]:
+    """The chunks of an indexed file version, split again from its extracted text when there is one."""
+    entry = ingestion_manifest.get_file(filename, content_hash, collection)
+    processed_path = Path(entry["processed_path"]) if entry and entry["processed_path"] else None
+    if processed_path is not None and processed_path.exists() and not audio_transcription.is_audio(Path(filename)):
+        return vector_store_manager.iter_file_chunks(processed_path, source=filename)
+
+    # Transcript chunks carry the audio timings of their segments, which the extracted text does not
+    chunk_ids = ingestion_manifest.get_chunk_ids(filename, content_hash, collection)
+    stored = vector_store_manager.get_chunks(chunk_ids, collection)
+    if len(stored) < len(chunk_ids):
+        logger.warning(f"{len(chunk_ids) - len(stored)} chunk(s) of {filename} are missing from collection "
+                       f"'{collection}': they are left out of the rebuild.")
+    return (stored[chunk_id] for chunk_id in chunk_ids if chunk_id in stored)
+
+
+def _index_source(staged: _StagedIndex, filename: str, content_hash: str) -> List[str]:
+    chunk_ids = staged.index_chunks(_source_chunks(filename, content_hash, staged.job.collection))
+    with staged.job._lock:
+        staged.job.sources_done += 1
+    return chunk_ids
+
+
+# --- Installing ---
+def _catch_up_and_install(
+    staged: _StagedIndex, snapshot: Dict[str, str], chunk_ids: Dict[Tuple[str, str], List[str]]
+) -> bool:
+    """Applies the sources changed since `snapshot` (file name -> content hash) to the staged index,
+    then installs it and records the new chunk ids ((file name, content hash) -> ids).
+
+    Runs on the index worker, so no other write interleaves. Returns False without installing while
+    files are being ingested into the collection: chunks of an audio file are indexed before its
+    transcription finishes and would be lost.
+    """
+    job, collection = staged.job, staged.job.collection
+    if ingestion_manifest.has_in_flight(collection):
+        return False
+    current = {source["filename"]: source["content_hash"] for source in ingestion_manifest.list_sources(collection)}
+    changed = 0
+    for filename, content_hash in current.items():
+        previous_hash = snapshot.get(filename)
+        if previous_hash == content_hash:
+            continue
+        previous_ids = chunk_ids.pop((filename, previous_hash), []) if previous_hash else []
+        # Chunks that did not change between the versions are kept
+        ids = staged.index_chunks(_source_chunks(filename, content_hash, collection), skip=previous_ids)
+        staged.collection.delete(list(set(previous_ids).difference(ids)))
+        chunk_ids[filename, content_hash] = ids
+        changed += 1
+    for filename, content_hash in snapshot.items():
+        if filename not in current:
+            staged.collection.delete(chunk_ids.pop((filename, content_hash)))
+            changed += 1
+
+    if changed:
+        logger.info(f"[rebuild {job.id}] Caught up with {changed} source(s) changed during the rebuild.")
+        staged.collection.flush()
+        staged.collection.write_base()
+    vector_store_manager.install_rebuilt(staged.collection, collection)
+    ingestion_manifest.record_rebuild(chunk_ids, collection)
+    with job._lock:
+        job.sources_caught_up = changed
+    return True
+
+
+def rebuild_collection(job: RebuildJob):
+    """Rebuilds the index of `job.collection` and swaps it in. Raises on failure, leaving the current index in place."""
+    collection = job.collection
+    start = time.perf_counter()
+    snapshot = {source["filename"]: source["content_hash"] for source in ingestion_manifest.list_sources(collection)}
+    with job._lock:
+        job.status = JOB_RUNNING
+        job.stage = STAGE_BUILDING
+        job.started_at = time.time()
+        job.sources_total = len(snapshot)
+    logger.info(f"[rebuild {job.id}] Rebuilding {len(snapshot)} source(s) of collection '{collection}'.")
+
+    staged = _StagedIndex(job, vector_store_manager.create_rebuild_target(collection))
+    try:
+        with ThreadPoolExecutor(max_workers=INDEX_REBUILD_WORKERS, thread_name_prefix="index-rebuild") as pool:
+            futures = {
+                (filename, content_hash): pool.submit(_index_source, staged, filename, content_hash)
+                for filename, content_hash in snapshot.items()
+            }
+            chunk_ids = {version: future.result() for version, future in futures.items()}
+        staged.collection.flush()
+        staged.collection.write_base()
+
+        with job._lock:
+            job.stage = STAGE_CATCHING_UP
+        while not ingestion_jobs.run_on_index_worker(_catch_up_and_install, staged, snapshot, chunk_ids):
+            time.sleep(_IN_FLIGHT_RETRY_SECONDS)
+    except BaseException:
+        vector_store_manager.discard_rebuild_target(staged.collection)
+        raise
+
+    with job._lock:
+        job.stage = STAGE_INSTALLED
+        job.status = JOB_COMPLETED
+        job.finished_at = time.time()
+    logger.info(f"[rebuild {job.id}] Rebuilt collection '{collection}' ({job.chunks} chunks embedded) "
+                f"in {time.perf_counter() - start:.1f}s.")
+
+
+def _run_job(job: RebuildJob):
+    try:
+        rebuild_collection(job)
+    except Exception as e:
+        logger.error(f"[rebuild {job.id}] Rebuild of collection '{job.collection}' failed: {e}", exc_info=True)
+        with job._lock:
+            job.status = JOB_FAILED
+            job.error = str(e)
+            job.finished_at = time.time()
+
+
+def start_rebuild(collection: str = DEFAULT_COLLECTION) -> RebuildJob:
+    """Starts rebuilding a collection in a background thread and returns its job.
+
+    Raises ValueError if the collection has no documents, and RuntimeError if it is already being rebuilt.
+    """
+    if not ingestion_manifest.list_sources(collection):
+        raise ValueError(f"Collection '{collection}' has no documents to rebuild.")
+    job = RebuildJob(collection)
+    _register_job(job)
+    threading.Thread(target=_run_job, args=(job,), name=f"index-rebuild-{collection}", daemon=True).start()
+    return job
+
+
+# --- Command Line ---
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Rebuild collection indexes from the extracted text of their documents.")
+    parser.add_argument("--collection", action="append", help="Collection to rebuild (repeatable). Defaults to all.")
+    args = parser.parse_args(argv)
+
+    collections = [validate_collection_name(name) for name in args.collection or list_collection_names()]
+    failed = 0
+    try:
+        for collection in collections:
+            if not ingestion_manifest.list_sources(collection):
+                logger.info(f"Collection '{collection}' has no documents to rebuild.")
+                continue
+            job = RebuildJob(collection)
+            _run_job(job)
+            failed += job.status == JOB_FAILED
+    finally:
+        ingestion_jobs.shutdown()
+        embedding_backends.shutdown()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
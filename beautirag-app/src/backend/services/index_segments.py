@@ -0,0 +1,912 @@
+import json
+import logging
+import os
+import pickle
+import shutil
+import threading
+import uuid
+from contextlib import nullcontext
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import faiss
+import numpy as np
+from langchain_community.vectorstores import FAISS
+from langchain_core.embeddings import Embeddings
+
+from . import ann_index
+from .docstore import LayeredDocstore, read_positions
+from ..core.file_lock import file_lock, file_locking_supported
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = "MANIFEST.json"
+WAL_NAME = "wal.log"
+SEGMENTS_DIR_NAME = "segments"
+BASE_INDEX_NAME = "index"
+# Files of a base next to its index: the chunk documents and, for quantised indexes, the exact vectors
+DOCSTORE_NAME = "documents.sqlite3"
+EXACT_VECTORS_NAME = "vectors.npy"
+# Index written by earlier versions with `FAISS.save_local`, adopted as the first base
+LEGACY_INDEX_NAME = "beautirag_index"
+# Lock file serialising writers (and excluding readers from a write in progress) in shared mode
+LOCK_NAME = "index.lock"
+
+OP_ADD = "add"
+OP_DELETE = "delete"
+
+
+# --- Durable File Helpers ---
+def _fsync_dir(path: Path):
+    fd = os.open(str(path), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def _fsync_file(path: Path):
+    with open(path, "rb") as f:
+        os.fsync(f.fileno())
+
+def _atomic_write(path: Path, data: bytes):
+    """Writes a file through a temporary file and a rename, so readers never see a partial file."""
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    _fsync_dir(path.parent)
+
+def _write_vectors(path: Path, parts: List[np.ndarray]):
+    """Writes arrays of vectors one after the other as a single .npy file, without concatenating them in memory."""
+    count = sum(len(part) for part in parts)
+    vectors = np.lib.format.open_memmap(path, mode="w+", dtype=np.float32, shape=(count, parts[0].shape[1]))
+    start = 0
+    for part in parts:
+        vectors[start:start + len(part)] = part
+        start += len(part)
+    vectors.flush()
+    del vectors
+
+
+def index_exists(directory: Path) -> bool:
+    """Whether a segmented (or legacy) index was written to this directory."""
+    return (
+        (directory / MANIFEST_NAME).exists()
+        or (directory / WAL_NAME).exists()
+        or (directory / f"{LEGACY_INDEX_NAME}.faiss").exists()
+    )
+
+
+class SegmentedIndex:
+    """FAISS store persisted as a compacted base index plus append-only segments.
+
+    Every batch of added chunks is written as a small immutable segment (vectors + documents)
+    and recorded in a write-ahead log, as are deletions. Persisting an upload therefore costs
+    time proportional to the upload, not to the corpus. A background compaction snapshots the
+    in-memory store into a new base index and atomically swaps the manifest to point at it,
+    after which the log records and segments it covers are dropped.
+
+    Deleted chunks leave the docstore at once but their vectors stay in the index as tombstones,
+    masked out of searches (`ann_index.LayeredIndex`). Compactions rebuild the index without them,
+    and one is started as soon as `tombstone_ratio` of the indexed vectors are tombstones.
+
+    Only the chunks changed since the last compaction are held in memory. A base keeps the text
+    and metadata of its chunks in an SQLite file, read for the hits of a search
+    (`docstore.LayeredDocstore`). Quantised indexes (SQ8, IVF-PQ) keep a copy of the exact vectors
+    next to the base, memory-mapped to re-rank their candidates (`ann_index.RerankedIndex`). After
+    a compaction, the store is reopened from the new base so that memory holds no more than that.
+
+    The store starts as an exact flat index. Once it holds `promotion_threshold` chunks it is
+    retrained into `index_type` (IVF-Flat, IVF-PQ, HNSW or SQ8) in the background and swapped in,
+    queries keep using the previous index until the swap.
+
+    In shared mode several processes (e.g. uvicorn workers) serve the same directory. Writes
+    (flushes and compactions) happen under an exclusive file lock, after catching up with the
+    records of the other processes, and bump the manifest version. The base is memory-mapped
+    read-only, so its pages are shared by all processes, with later additions kept in a private
+    delta (`ann_index.LayeredIndex`). A refresh thread polls the version and applies new log
+    records, or swaps in a new base, without blocking queries.
+
+    On disk:
+        MANIFEST.json            {"base": <dir name or null>, "wal_seq": <last seq in base>, "version": <n>}
+        base-<seq>/              index.faiss + documents.sqlite3 (+ vectors.npy when quantised)
+        segments/seg-<seq>/      vectors.npy + documents.pkl
+        wal.log                  one JSON record per line: add (segment) or delete (ids)
+    """
+
+    def __init__(
+        self,
+        directory: Path,
+        embedding_factory: Callable[[], Embeddings],
+        compaction_threshold: int,
+        index_type: str = ann_index.INDEX_FLAT,
+        promotion_threshold: int = 0,
+        recall_sample_size: int = 200,
+        shared: bool = False,
+        refresh_interval: float = 1.0,
+        tombstone_ratio: float = 0.2,
+    ):
+        if shared and not file_locking_supported():
+            raise RuntimeError("The shared index mode needs inter-process file locks, which this platform lacks.")
+        self.directory = Path(directory)
+        self.segments_dir = self.directory / SEGMENTS_DIR_NAME
+        self._embedding_factory = embedding_factory
+        self.compaction_threshold = compaction_threshold
+        self.index_type = index_type
+        self.promotion_threshold = promotion_threshold
+        self.recall_sample_size = recall_sample_size
+        self.shared = shared
+        self.refresh_interval = refresh_interval
+        self.tombstone_ratio = tombstone_ratio
+        self.store: Optional[FAISS] = None
+        # Incremented on every change of the store, so dependent caches can detect stale entries
+        self.version = 0
+        self.recall_report: Dict = {}
+        self._manifest: Dict = {"base": None, "wal_seq": 0, "version": 0}
+        self._last_seq = 0
+        self._records_since_checkpoint = 0
+        # Operations applied in memory but not yet written to the log, in order
+        self._pending: List[Dict] = []
+        self._lock = threading.RLock()
+        self._compaction_thread: Optional[threading.Thread] = None
+        self._compaction_lock = threading.Lock()
+        # Set when the in-memory index type differs from the persisted base, forcing a compaction
+        self._base_stale = False
+        # Incremented when a compaction renumbers the index positions, dropping its tombstones
+        self._layout = 0
+        self._conversion_thread: Optional[threading.Thread] = None
+        self._refresh_thread: Optional[threading.Thread] = None
+        # Set by `close`, stops the refresh thread and the start of new background work
+        self._closed = threading.Event()
+
+    @property
+    def embedding(self) -> Embeddings:
+        return self._embedding_factory()
+
+    @property
+    def _manifest_path(self) -> Path:
+        return self.directory / MANIFEST_NAME
+
+    @property
+    def _wal_path(self) -> Path:
+        return self.directory / WAL_NAME
+
+    @property
+    def _lock_path(self) -> Path:
+        return self.directory / LOCK_NAME
+
+    # --- Loading ---
+    def exists(self) -> bool:
+        return index_exists(self.directory)
+
+    def _read_manifest(self) -> Dict:
+        if self._manifest_path.exists():
+            return {"version": 0, **json.loads(self._manifest_path.read_text())}
+        if (self.directory / f"{LEGACY_INDEX_NAME}.faiss").exists():
+            return {"base": ".", "wal_seq": 0, "version": 0}
+        return {"base": None, "wal_seq": 0, "version": 0}
+
+    def load(self) -> Optional[FAISS]:
+        """Rebuilds the in-memory store from the base index and the log records written after it."""
+        if not self._manifest_path.exists() and (self.directory / f"{LEGACY_INDEX_NAME}.faiss").exists():
+            logger.info("Adopting legacy FAISS index as the base of the segmented index.")
+        if self.shared:
+            return self._load_shared()
+        with self._lock:
+            self._manifest = self._read_manifest()
+
+            store = self._open_base(self._manifest)
+            records = self._read_wal()
+            replayed = [record for record in records if record["seq"] > self._manifest["wal_seq"]]
+            for record in replayed:
+                store = self._apply_record(store, record)
+
+            self._last_seq = max([self._manifest["wal_seq"]] + [record["seq"] for record in records])
+            self._records_since_checkpoint = len(replayed)
+            self._remove_obsolete_files(replayed)
+            if store is not None:
+                ann_index.apply_search_params(store.index)
+            self.store = store
+            self.version += 1
+            logger.info(f"Loaded segmented index (base: {self._manifest['base']}, {len(replayed)} log record(s) replayed).")
+
+        if self._compaction_due():
+            self.compact_in_background()
+        self.convert_in_background()
+        return store
+
+    def _open_base(self, manifest: Dict, mapped: bool = False) -> Optional[FAISS]:
+        """Opens a base, with its documents left on disk. With `mapped`, its index is memory-mapped
+        read-only, shared with the other processes, and new vectors go to a private delta."""
+        base = manifest["base"]
+        if base is None:
+            return None
+        index_name = LEGACY_INDEX_NAME if base == "." else BASE_INDEX_NAME
+        base_dir = self.directory / base
+        if mapped:
+            # IO_FLAG_MMAP_IFC (faiss >= 1.8) maps flat, IVF and HNSW storage; IO_FLAG_MMAP only maps IVF lists
+            flags = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+            index = faiss.read_index(str(base_dir / f"{index_name}.faiss"), flags)
+        else:
+            index = faiss.read_index(str(base_dir / f"{index_name}.faiss"))
+        if (base_dir / EXACT_VECTORS_NAME).exists():
+            index = ann_index.with_reranking(index, np.load(base_dir / EXACT_VECTORS_NAME, mmap_mode="r"))
+        if (base_dir / DOCSTORE_NAME).exists():
+            docstore = LayeredDocstore(base_dir / DOCSTORE_NAME)
+            index_to_docstore_id = read_positions(base_dir / DOCSTORE_NAME)
+        else:
+            # Base written by earlier versions with a pickled in-memory docstore, rewritten by the next compaction
+            with open(base_dir / f"{index_name}.pkl", "rb") as f:
+                in_memory, index_to_docstore_id = pickle.load(f)
+            docstore = LayeredDocstore(added=dict(in_memory._dict))
+            self._base_stale = True
+        if mapped:
+            index = ann_index.LayeredIndex(index, faiss.IndexFlat(index.d, index.metric_type))
+        return FAISS(
+            embedding_function=self.embedding,
+            index=index,
+            docstore=docstore,
+            index_to_docstore_id=index_to_docstore_id,
+        )
+
+    def _read_wal(self, truncate: bool = True) -> List[Dict]:
+        """Reads the log, truncating a torn last record left by a crash mid-append (unless `truncate` is False)."""
+        if not self._wal_path.exists():
+            return []
+        records = []
+        valid_bytes = 0
+        with open(self._wal_path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    break
+                valid_bytes += len(line)
+        if truncate and valid_bytes < self._wal_path.stat().st_size:
+            logger.warning(f"Truncating torn write-ahead log record in {self._wal_path}")
+            with open(self._wal_path, "r+b") as f:
+                f.truncate(valid_bytes)
+        return records
+
+    def _apply_record(self, store: Optional[FAISS], record: Dict) -> Optional[FAISS]:
+        if record["op"] == OP_ADD:
+            segment_dir = self.segments_dir / record["segment"]
+            with open(segment_dir / "documents.pkl", "rb") as f:
+                operation = {"op": OP_ADD, **pickle.load(f), "vectors": [np.load(segment_dir / "vectors.npy")]}
+            return self._apply_operation(store, operation)
+        return self._apply_operation(store, record)
+
+    def _apply_operation(self, store: Optional[FAISS], operation: Dict) -> Optional[FAISS]:
+        """Applies an add or delete, skipping chunks already added or already deleted.
+
+        Being idempotent lets shared-mode processes re-apply their unflushed operations after
+        catching up with records written by other processes.
+        """
+        if operation["op"] == OP_ADD:
+            vectors = np.concatenate(operation["vectors"])
+            new = [
+                position for position, chunk_id in enumerate(operation["ids"])
+                if store is None or chunk_id not in store.docstore
+            ]
+            if not new:
+                return store
+            if len(new) < len(operation["ids"]):
+                vectors = vectors[new]
+            return self._add_to_store(
+                store,
+                [operation["texts"][position] for position in new],
+                vectors,
+                [operation["metadatas"][position] for position in new],
+                [operation["ids"][position] for position in new],
+            )
+        if operation["op"] == OP_DELETE and store is not None:
+            ids = [chunk_id for chunk_id in operation["ids"] if chunk_id in store.docstore]
+            if ids:
+                store = self._delete_from_store(store, ids)
+        return store
+
+    def _delete_from_store(self, store: FAISS, ids: List[str]) -> FAISS:
+        # Removing vectors would shift the positions of all later ones (and IVF and HNSW indexes
+        # cannot remove them cleanly), so deleted positions are masked until the next compaction.
+        # The mapped base of the shared mode is read-only anyway
+        if not isinstance(store.index, ann_index.LayeredIndex):
+            store.index = ann_index.LayeredIndex(None, store.index)
+        deleted = set(ids)
+        store.index.mark_deleted(
+            position for position, chunk_id in store.index_to_docstore_id.items() if chunk_id in deleted
+        )
+        store.docstore.delete(ids)
+        return store
+
+    def _add_to_store(self, store: Optional[FAISS], texts, vectors, metadatas, ids) -> FAISS:
+        if store is None:
+            index = faiss.IndexFlatL2(vectors.shape[1])
+            store = FAISS(
+                embedding_function=self.embedding,
+                index=ann_index.LayeredIndex(None, index) if self.shared else index,
+                docstore=LayeredDocstore(),
+                index_to_docstore_id={},
+            )
+        store.add_embeddings(zip(texts, vectors), metadatas=metadatas, ids=ids)
+        return store
+
+    # --- Shared Mode ---
+    def _load_shared(self) -> Optional[FAISS]:
+        with file_lock(self._lock_path, shared=True):
+            self._refresh_locked()
+        logger.info(f"Loaded shared index (base: {self._manifest['base']}, version {self._manifest['version']}).")
+        with self._lock:
+            if self._refresh_thread is None:
+                self._refresh_thread = threading.Thread(target=self._refresh_loop, name="index-refresh", daemon=True)
+                self._refresh_thread.start()
+        return self.store
+
+    def _refresh_locked(self):
+        """Catches up with the published index: applies new log records, or loads a new base.
+
+        The caller holds the file lock (shared or exclusive), so no process writes meanwhile.
+        Operations not flushed yet are re-applied on top, so they stay ordered after the
+        records of other processes, as they will be once flushed.
+        """
+        manifest = self._read_manifest()
+        if manifest["base"] == self._manifest["base"]:
+            records = [record for record in self._read_wal(truncate=False) if record["seq"] > self._last_seq]
+            if not records and manifest["version"] == self._manifest["version"]:
+                return
+            with self._lock:
+                store = self.store
+                for record in records:
+                    store = self._apply_record(store, record)
+                if records:
+                    for operation in self._pending:
+                        store = self._apply_operation(store, operation)
+                self._last_seq = max([self._last_seq] + [record["seq"] for record in records])
+                self._records_since_checkpoint += len(records)
+                self._swap_in(store, manifest)
+        else:
+            # The new base is mapped and its log tail replayed without blocking queries
+            store = self._open_base(manifest, mapped=True)
+            records = [record for record in self._read_wal(truncate=False) if record["seq"] > manifest["wal_seq"]]
+            for record in records:
+                store = self._apply_record(store, record)
+            with self._lock:
+                for operation in self._pending:
+                    store = self._apply_operation(store, operation)
+                self._last_seq = max([manifest["wal_seq"]] + [record["seq"] for record in records])
+                self._records_since_checkpoint = len(records)
+                self._swap_in(store, manifest)
+            logger.info(f"Swapped in index base {manifest['base']} (version {manifest['version']}).")
+
+    def _swap_in(self, store: Optional[FAISS], manifest: Dict):
+        if store is not None:
+            ann_index.apply_search_params(store.index)
+        self.store = store
+        self._manifest = manifest
+        self.version += 1
+
+    def refresh(self):
+        """Catches up with the index published by other processes."""
+        with file_lock(self._lock_path, shared=True):
+            self._refresh_locked()
+
+    def _refresh_loop(self):
+        while not self._closed.wait(self.refresh_interval):
+            try:
+                if self._read_manifest()["version"] != self._manifest["version"]:
+                    self.refresh()
+            except Exception as e:
+                logger.error(f"Index refresh failed: {e}", exc_info=True)
+
+    def _publish(self):
+        """Bumps the manifest version so other processes refresh. The caller holds the exclusive file lock."""
+        self._manifest = {**self._manifest, "version": self._manifest["version"] + 1}
+        _atomic_write(self._manifest_path, json.dumps(self._manifest).encode("utf-8"))
+
+    def _remove_obsolete_files(self, live_records: List[Dict]):
+        """Deletes segments no longer referenced by the log and bases other than the current one."""
+        live_segments = {record["segment"] for record in live_records if record["op"] == OP_ADD}
+        if self.segments_dir.exists():
+            for segment_dir in self.segments_dir.iterdir():
+                if segment_dir.name not in live_segments:
+                    shutil.rmtree(segment_dir, ignore_errors=True)
+        for base_dir in self.directory.glob("base-*"):
+            # In shared mode another process may be writing a new base into its temporary directory
+            if self.shared and base_dir.suffix == ".tmp":
+                continue
+            if base_dir.name != self._manifest["base"]:
+                shutil.rmtree(base_dir, ignore_errors=True)
+        if self._manifest["base"] not in (None, "."):
+            for suffix in (".faiss", ".pkl"):
+                (self.directory / f"{LEGACY_INDEX_NAME}{suffix}").unlink(missing_ok=True)
+
+    # --- Writing ---
+    def add(self, texts: List[str], vectors: np.ndarray, metadatas: List[dict], ids: List[str]):
+        """Adds embedded chunks to the in-memory store. They are persisted by the next `flush`."""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self._lock:
+            self.store = self._add_to_store(self.store, texts, vectors, metadatas, ids)
+            self.version += 1
+            if self._pending and self._pending[-1]["op"] == OP_ADD:
+                pending = self._pending[-1]
+                pending["texts"].extend(texts)
+                pending["metadatas"].extend(metadatas)
+                pending["ids"].extend(ids)
+                pending["vectors"].append(vectors)
+            else:
+                self._pending.append({
+                    "op": OP_ADD, "texts": list(texts), "metadatas": list(metadatas),
+                    "ids": list(ids), "vectors": [vectors],
+                })
+
+    def delete(self, ids: List[str]) -> int:
+        """Deletes chunks from the in-memory store, ignoring unknown ids. Persisted by the next `flush`."""
+        with self._lock:
+            if self.store is None:
+                return 0
+            ids = [chunk_id for chunk_id in ids if chunk_id in self.store.docstore]
+            if ids:
+                self.store = self._delete_from_store(self.store, ids)
+                self._pending.append({"op": OP_DELETE, "ids": ids})
+                self.version += 1
+            return len(ids)
+
+    def _write_segment(self, name: str, operation: Dict):
+        tmp_dir = self.segments_dir / f"{name}.tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        tmp_dir.mkdir(parents=True)
+        np.save(tmp_dir / "vectors.npy", np.concatenate(operation["vectors"]))
+        with open(tmp_dir / "documents.pkl", "wb") as f:
+            pickle.dump({key: operation[key] for key in ("ids", "texts", "metadatas")}, f)
+        for path in tmp_dir.iterdir():
+            _fsync_file(path)
+        os.replace(tmp_dir, self.segments_dir / name)
+        _fsync_dir(self.segments_dir)
+
+    def _append_wal(self, record: Dict):
+        with open(self._wal_path, "ab") as f:
+            f.write(json.dumps(record).encode("utf-8") + b"\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def flush(self):
+        """Writes pending operations as new segments and log records, compacting when too many accumulated."""
+        if self.shared:
+            self._flush_shared()
+        else:
+            self._flush_pending()
+        if self._compaction_due():
+            self.compact_in_background()
+        self.convert_in_background()
+
+    def tombstone_count(self) -> int:
+        store = self.store
+        return len(getattr(store.index, "deleted", ())) if store is not None else 0
+
+    def _compaction_due(self) -> bool:
+        if self._base_stale or self._records_since_checkpoint >= self.compaction_threshold:
+            return True
+        store = self.store
+        if store is None:
+            return False
+        tombstones = len(getattr(store.index, "deleted", ()))
+        return tombstones > 0 and tombstones >= self.tombstone_ratio * store.index.ntotal
+
+    def _flush_shared(self):
+        with file_lock(self._lock_path):
+            # Records of other processes come first, so the log sequence stays contiguous
+            self._refresh_locked()
+            flushed_seq = self._last_seq
+            try:
+                self._flush_pending()
+            finally:
+                if self._last_seq != flushed_seq:
+                    self._publish()
+
+    def _flush_pending(self):
+        with self._lock:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            pending, self._pending = self._pending, []
+            for position, operation in enumerate(pending):
+                seq = self._last_seq + 1
+                try:
+                    if operation["op"] == OP_ADD:
+                        name = f"seg-{seq:08d}"
+                        self._write_segment(name, operation)
+                        record = {"seq": seq, "op": OP_ADD, "segment": name, "count": len(operation["ids"])}
+                    else:
+                        record = {"seq": seq, "op": OP_DELETE, "ids": operation["ids"]}
+                    self._append_wal(record)
+                except Exception:
+                    # Keep the unwritten operations so a later flush can retry them
+                    self._pending = pending[position:] + self._pending
+                    raise
+                self._last_seq = seq
+                self._records_since_checkpoint += 1
+            if pending:
+                logger.info(f"Persisted {len(pending)} index operation(s) up to log sequence {self._last_seq}.")
+
+    # --- Compaction ---
+    def _write_base(
+        self,
+        base_name: str,
+        index_bytes: np.ndarray,
+        docstore: LayeredDocstore,
+        index_to_docstore_id: Dict,
+        exact_vectors: Optional[List[np.ndarray]] = None,
+    ):
+        tmp_dir = self.directory / f"{base_name}.tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        tmp_dir.mkdir(parents=True)
+        index_bytes.tofile(tmp_dir / f"{BASE_INDEX_NAME}.faiss")
+        docstore.write(tmp_dir / DOCSTORE_NAME, index_to_docstore_id)
+        if exact_vectors is not None:
+            _write_vectors(tmp_dir / EXACT_VECTORS_NAME, exact_vectors)
+        for path in tmp_dir.iterdir():
+            _fsync_file(path)
+        os.replace(tmp_dir, self.directory / base_name)
+        _fsync_dir(self.directory)
+
+    def compact(self):
+        """Snapshots the in-memory store into a new base and drops the log records it covers."""
+        with self._compaction_lock:
+            if self.shared:
+                self._compact_shared()
+            else:
+                self._compact()
+
+    def _compact(self):
+        rebuilt = None
+        exact_vectors = None
+        with self._lock:
+            self._flush_pending()
+            if self.store is None or (self._last_seq == self._manifest["wal_seq"] and not self._base_stale):
+                return
+            seq = self._last_seq
+            self._base_stale = False
+            store = self.store
+            # Copies taken under the lock; serialising them to disk happens outside it
+            docstore = store.docstore.snapshot()
+            if isinstance(store.index, ann_index.LayeredIndex):
+                # The index holds tombstones: it is rebuilt from the live vectors, outside the lock
+                deleted = set(store.index.deleted)
+                live = [position for position in range(store.index.ntotal) if position not in deleted]
+                vectors = ann_index.reconstruct(store.index)[live]
+                rebuilt = ann_index.empty_like(store.index)
+                if ann_index.is_reranked(store.index):
+                    exact_vectors = [vectors]
+                index_to_docstore_id = {
+                    new_position: store.index_to_docstore_id[position] for new_position, position in enumerate(live)
+                }
+            else:
+                index = store.index
+                if isinstance(index, ann_index.RerankedIndex):
+                    exact_vectors = index.exact_parts()
+                    index = index.index
+                # Cloned in memory under the lock, writes wait for the copy but not for the serialisation
+                snapshot = faiss.clone_index(index)
+                index_to_docstore_id = dict(store.index_to_docstore_id)
+
+        if rebuilt is None:
+            index_bytes = faiss.serialize_index(snapshot)
+            del snapshot
+        else:
+            logger.info(f"Rebuilding index without {len(deleted)} deleted chunk(s), {len(live)} remain.")
+            rebuilt.add(vectors)
+            del vectors
+            index_bytes = faiss.serialize_index(rebuilt)
+            rebuilt.reset()
+
+        base_name = f"base-{seq:08d}-{uuid.uuid4().hex[:8]}"
+        logger.info(f"Compacting segmented index into {base_name}.")
+        self._write_base(base_name, index_bytes, docstore, index_to_docstore_id, exact_vectors)
+        del index_bytes, docstore, exact_vectors
+        manifest = {"base": base_name, "wal_seq": seq, "version": self._manifest["version"] + 1}
+        # The store is reopened from the new base, leaving its documents and exact vectors on disk
+        # and dropping tombstones
+        reopened = self._open_base(manifest)
+
+        with self._lock:
+            self._manifest = manifest
+            _atomic_write(self._manifest_path, json.dumps(self._manifest).encode("utf-8"))
+            remaining = [record for record in self._read_wal() if record["seq"] > seq]
+            _atomic_write(self._wal_path, b"".join(json.dumps(record).encode("utf-8") + b"\n" for record in remaining))
+            self._records_since_checkpoint = len(remaining)
+            # Catches up with the operations since the snapshot
+            for record in remaining:
+                reopened = self._apply_record(reopened, record)
+            for operation in self._pending:
+                reopened = self._apply_operation(reopened, operation)
+            if self.store is store:
+                ann_index.apply_search_params(reopened.index)
+                self.store = reopened
+                if rebuilt is not None:
+                    self._layout += 1
+            elif self.store is not None:
+                # A conversion swapped the index meanwhile and marked the base stale, the next
+                # compaction writes it. Documents are looked up by id, so it takes the new docstore
+                self.store.docstore = reopened.docstore
+            self.version += 1
+            self._remove_obsolete_files(remaining)
+        logger.info(f"Compaction finished, {len(remaining)} log record(s) remain after {base_name}.")
+
+    def _compact_shared(self):
+        """Writes the live chunks as a new base, converting its type when due, then publishes it.
+
+        The mapped base cannot be modified or copied in place, so the new index is filled from
+        reconstructed vectors: a fresh flat index, an emptied owned copy of a trained base, or a
+        newly trained index of the conversion target.
+        """
+        with file_lock(self._lock_path):
+            self._refresh_locked()
+            with self._lock:
+                # Flushed under the same lock as the snapshot, so the base only holds logged operations
+                flushed_seq = self._last_seq
+                try:
+                    self._flush_pending()
+                finally:
+                    if self._last_seq != flushed_seq:
+                        self._publish()
+                target = self._conversion_target()
+                if self.store is None or (
+                    self._last_seq == self._manifest["wal_seq"] and target is None and not self._base_stale
+                ):
+                    return
+                seq = self._last_seq
+                self._base_stale = False
+                previous_base = self._manifest["base"]
+                layered = self.store.index
+                live = [position for position in range(layered.ntotal) if position not in layered.deleted]
+                vectors = ann_index.reconstruct(layered)
+                exact = ann_index.has_exact_vectors(layered)
+                if len(live) < len(vectors):
+                    vectors = vectors[live]
+                docstore = self.store.docstore.snapshot()
+                index_to_docstore_id = {
+                    new_position: self.store.index_to_docstore_id[position] for new_position, position in enumerate(live)
+                }
+
+        if target is not None:
+            logger.info(f"Converting index from '{ann_index.index_type_of(layered)}' to '{target}' ({len(live)} chunks).")
+            index = ann_index.build_index(target, vectors)
+            self.recall_report = ann_index.measure_recall(index, vectors, self.recall_sample_size)
+        elif layered.base is None or ann_index.index_type_of(layered) == ann_index.INDEX_FLAT:
+            index = faiss.IndexFlat(layered.d, layered.metric_type)
+            index.add(vectors)
+        else:
+            index_name = LEGACY_INDEX_NAME if previous_base == "." else BASE_INDEX_NAME
+            index = faiss.read_index(str(self.directory / previous_base / f"{index_name}.faiss"))
+            index.reset()
+            index.add(vectors)
+        exact_vectors = [vectors] if exact and ann_index.reranks(ann_index.index_type_of(index)) else None
+
+        base_name = f"base-{seq:08d}-{uuid.uuid4().hex[:8]}"
+        logger.info(f"Compacting shared index into {base_name}.")
+        self._write_base(base_name, faiss.serialize_index(index), docstore, index_to_docstore_id, exact_vectors)
+        del index, vectors, exact_vectors
+
+        with file_lock(self._lock_path):
+            manifest = self._read_manifest()
+            if manifest["base"] != previous_base:
+                logger.info(f"Another process compacted the index meanwhile, dropping {base_name}.")
+                shutil.rmtree(self.directory / base_name, ignore_errors=True)
+                return
+            _atomic_write(self._manifest_path, json.dumps(
+                {"base": base_name, "wal_seq": seq, "version": manifest["version"] + 1}
+            ).encode("utf-8"))
+            remaining = [record for record in self._read_wal() if record["seq"] > seq]
+            _atomic_write(self._wal_path, b"".join(json.dumps(record).encode("utf-8") + b"\n" for record in remaining))
+            # Maps the new base in place of the private copy of this process
+            self._refresh_locked()
+            # Processes still mapping a removed base keep its pages until they swap
+            self._remove_obsolete_files(remaining)
+        logger.info(f"Compaction finished, {len(remaining)} log record(s) remain after {base_name}.")
+
+    def compact_in_background(self):
+        """Starts a compaction thread unless one is already running."""
+        with self._lock:
+            if self._closed.is_set() or (self._compaction_thread is not None and self._compaction_thread.is_alive()):
+                return
+            self._compaction_thread = threading.Thread(target=self._compact_safely, name="index-compaction", daemon=True)
+            self._compaction_thread.start()
+
+    def _compact_safely(self):
+        try:
+            self.compact()
+            # A conversion may have swapped the index while the snapshot was being written
+            if self._base_stale:
+                self.compact()
+        except Exception as e:
+            logger.error(f"Index compaction failed: {e}", exc_info=True)
+
+    # --- Index Type Conversion ---
+    def _conversion_target(self) -> Optional[str]:
+        """Returns the index type the store should be converted to, if any."""
+        if self.store is None:
+            return None
+        current = ann_index.index_type_of(self.store.index)
+        if current == self.index_type:
+            return self.index_type if ann_index.needs_retraining(self.store.index) else None
+        if not ann_index.has_exact_vectors(self.store.index):
+            # Quantised codes cannot be turned back into exact vectors, converting would lose precision
+            return None
+        if self.index_type == ann_index.INDEX_FLAT or self.store.index.ntotal >= self.promotion_threshold:
+            return self.index_type
+        return None
+
+    def convert_in_background(self):
+        """Starts a background conversion to the configured index type when one is due."""
+        with self._lock:
+            target = self._conversion_target()
+            if self._closed.is_set() or target is None or (self._conversion_thread is not None and self._conversion_thread.is_alive()):
+                return
+            if self.shared:
+                # The mapped base cannot be retrained in place, the compaction builds the converted base
+                self.compact_in_background()
+                return
+            self._conversion_thread = threading.Thread(target=self._convert_safely, args=(target,), name="index-conversion", daemon=True)
+            self._conversion_thread.start()
+
+    def _convert_safely(self, target: str):
+        try:
+            self.convert(target)
+        except Exception as e:
+            logger.error(f"Index conversion to '{target}' failed: {e}", exc_info=True)
+
+    def convert(self, target: str):
+        """Retrains the store into an index of type `target` off the write lock, then swaps it in.
+
+        Chunks added during the build are appended to the new index before the swap, and tombstones
+        carry over as positions are unchanged. If a compaction dropped tombstones meanwhile, positions
+        have shifted and the conversion is abandoned for a later retry.
+        """
+        with self._lock:
+            store = self.store
+            if store is None:
+                return
+            layout = self._layout
+            built_count = store.index.ntotal
+            vectors = ann_index.reconstruct(store.index)
+
+        logger.info(f"Converting index from '{ann_index.index_type_of(store.index)}' to '{target}' ({built_count} chunks).")
+        new_index = ann_index.with_reranking(ann_index.build_index(target, vectors), vectors)
+        report = ann_index.measure_recall(new_index, vectors, self.recall_sample_size)
+
+        with self._lock:
+            if self._layout != layout or self.store is None:
+                logger.info("Index changed during conversion, it will be retried later.")
+                return
+            # A compaction may have reopened the store from its new base meanwhile, with the same positions
+            store = self.store
+            if store.index.ntotal > built_count:
+                new_index.add(ann_index.reconstruct(store.index, built_count))
+            deleted = getattr(store.index, "deleted", ())
+            if deleted:
+                new_index = ann_index.LayeredIndex(None, new_index)
+                new_index.mark_deleted(deleted)
+            self.store = FAISS(
+                embedding_function=store.embedding_function,
+                index=new_index,
+                docstore=store.docstore,
+                index_to_docstore_id=store.index_to_docstore_id,
+                distance_strategy=store.distance_strategy,
+            )
+            self.recall_report = report
+            self.version += 1
+            self._base_stale = True
+        logger.info(f"Index converted to '{target}'.")
+        self.compact_in_background()
+
+    # --- Rebuild ---
+    def _join_background_work(self):
+        for thread in (self._conversion_thread, self._compaction_thread):
+            if thread is not None:
+                thread.join()
+
+    def write_base(self):
+        """Writes everything added so far as the base, converted to the target index type when due.
+
+        Finishes a staging index filled by a rebuild, before `install_base` moves its base.
+        """
+        self._join_background_work()
+        target = self._conversion_target()
+        if target is not None:
+            self.convert(target)
+        self.compact()
+        # The conversion may have started a compaction of its own
+        self._join_background_work()
+
+    def install_base(self, staged: "SegmentedIndex"):
+        """Replaces the whole index with the base written by `staged.write_base()`.
+
+        The base is moved into this directory and published like a compaction's, but it covers the
+        whole log: the records, segments and pending operations of the current store are dropped.
+        In shared mode the other processes swap it in on their next refresh.
+        """
+        if staged._pending or staged._last_seq != staged._manifest["wal_seq"]:
+            raise RuntimeError("The staged index has changes that are not in its base.")
+        lock = file_lock(self._lock_path) if self.shared else nullcontext()
+        with self._compaction_lock, lock:
+            if self.shared:
+                self._refresh_locked()
+            with self._lock:
+                self.directory.mkdir(parents=True, exist_ok=True)
+                base_name = None
+                if staged._manifest["base"] is not None:
+                    base_name = f"base-{self._last_seq:08d}-{uuid.uuid4().hex[:8]}"
+                    os.replace(staged.directory / staged._manifest["base"], self.directory / base_name)
+                    _fsync_dir(self.directory)
+                manifest = {"base": base_name, "wal_seq": self._last_seq, "version": self._manifest["version"] + 1}
+                store = self._open_base(manifest, mapped=self.shared)
+                _atomic_write(self._manifest_path, json.dumps(manifest).encode("utf-8"))
+                _atomic_write(self._wal_path, b"")
+                self._pending = []
+                self._records_since_checkpoint = 0
+                self._base_stale = False
+                # Abandons a conversion of the replaced store
+                self._layout += 1
+                self.recall_report = staged.recall_report
+                self._swap_in(store, manifest)
+                self._remove_obsolete_files([])
+        logger.info(f"Installed rebuilt index base {base_name} in {self.directory}.")
+
+    # --- Unloading ---
+    @property
+    def busy(self) -> bool:
+        """Whether a background compaction or conversion is running."""
+        return any(
+            thread is not None and thread.is_alive() for thread in (self._conversion_thread, self._compaction_thread)
+        )
+
+    def close(self):
+        """Persists pending operations and releases the in-memory store. The index is not used afterwards."""
+        self._closed.set()
+        # A conversion may still start a compaction, so it is waited for first
+        self._join_background_work()
+        if self.shared:
+            self._flush_shared()
+        else:
+            self._flush_pending()
+        with self._lock:
+            self.store = None
+
+    def measure_recall(self, k: int = 5) -> Dict:
+        """Measures the current index's recall@k against exact search on a sample of stored vectors."""
+        with self._lock:
+            if self.store is None:
+                return {}
+            vectors = ann_index.reconstruct(self.store.index)
+            self.recall_report = ann_index.measure_recall(self.store.index, vectors, self.recall_sample_size, k)
+            if not ann_index.has_exact_vectors(self.store.index):
+                # Ground truth computed from vectors reconstructed from quantised codes
+                self.recall_report["approximate_ground_truth"] = True
+            return self.recall_report
+
+    def chunk_count(self) -> int:
+        store = self.store
+        if store is None:
+            return 0
+        return store.index.ntotal - len(getattr(store.index, "deleted", ()))
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "index_type": ann_index.index_type_of(self.store.index) if self.store is not None else None,
+                "target_index_type": self.index_type,
+                "promotion_threshold": self.promotion_threshold,
+                "chunks": self.chunk_count(),
+                "tombstones": self.tombstone_count(),
+                "resident_documents": self.store.docstore.resident_count if self.store is not None else 0,
+                "exact_reranking": self.store is not None and ann_index.is_reranked(self.store.index),
+                "compaction_tombstone_ratio": self.tombstone_ratio,
+                "version": self.version,
+                "shared": self.shared,
+                "published_version": self._manifest["version"],
+                "log_sequence": self._last_seq,
+                "log_records_since_compaction": self._records_since_checkpoint,
+                "recall": self.recall_report,
+            }
@@ -0,0 +1,614 @@
+import logging
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from . import audio_transcription, document_processor, ingestion_manifest, vector_store_manager
+from .index_collections import collection_upload_dir, create_collection
+from ..core import metrics
+from ..core.config import DEFAULT_COLLECTION, INGEST_PARSE_WORKERS, INGEST_JOB_HISTORY, WARMUP_WHISPER
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# --- Job and File States ---
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_COMPLETED = "completed"
+JOB_COMPLETED_WITH_ERRORS = "completed_with_errors"
+JOB_FAILED = "failed"
+
+FILE_QUEUED = "queued"
+FILE_PARSING = "parsing"
+FILE_PARSED = "parsed"
+FILE_INDEXED = "indexed"
+FILE_FAILED = "failed"
+
+_FINISHED_STATES = (JOB_COMPLETED, JOB_COMPLETED_WITH_ERRORS, JOB_FAILED)
+
+
+class IngestionJob:
+    """Tracks the progress of one upload request through parsing and indexing."""
+
+    def __init__(self, file_paths: List[Path], content_hashes: Dict[str, str], collection: str = DEFAULT_COLLECTION):
+        self.id = uuid.uuid4().hex
+        self.collection = collection
+        self.status = JOB_QUEUED
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.file_paths = {path.name: path for path in file_paths}
+        self.files: Dict[str, str] = {path.name: FILE_QUEUED for path in file_paths}
+        self.content_hashes = content_hashes
+        self.errors: Dict[str, str] = {}
+        self.sections = 0
+        self.chunks = 0
+        self.chunks_removed = 0
+        # Transcription progress of segmented audio files: {filename: {"done", "total"}}
+        self.audio_segments: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def is_finished(self) -> bool:
+        return self.status in _FINISHED_STATES
+
+    def _count(self, *states: str) -> int:
+        return sum(1 for state in self.files.values() if state in states)
+
+    def progress(self) -> dict:
+        """Returns a compact progress summary for polling clients."""
+        with self._lock:
+            total = len(self.files)
+            done = self._count(FILE_INDEXED, FILE_FAILED)
+            return {
+                "job_id": self.id,
+                "status": self.status,
+                "collection": self.collection,
+                "files_total": total,
+                "files_parsed": self._count(FILE_PARSED, FILE_INDEXED),
+                "files_done": done,
+                "percent": round(100.0 * done / total, 1) if total else 100.0,
+            }
+
+    def to_dict(self) -> dict:
+        """Returns the full job state."""
+        summary = self.progress()
+        with self._lock:
+            summary.update({
+                "created_at": self.created_at,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at,
+                "files": dict(self.files),
+                "failed_files": [name for name, state in self.files.items() if state == FILE_FAILED],
+                "errors": dict(self.errors),
+                "sections": self.sections,
+                "chunks": self.chunks,
+                "chunks_removed": self.chunks_removed,
+                "audio_segments": {name: dict(counts) for name, counts in self.audio_segments.items()},
+            })
+        return summary
+
+
+# --- Executors ---
+# Parsing (Unstructured, Tesseract, Whisper) is CPU bound and runs in a bounded process pool.
+# Embedding and FAISS updates mutate the shared in-memory index, so they run on a single
+# dedicated thread which serialises all writes to the store.
+_parse_pool: Optional[ProcessPoolExecutor] = None
+_index_worker: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+_jobs: "OrderedDict[str, IngestionJob]" = OrderedDict()
+_jobs_lock = threading.Lock()
+
+
+def _init_parse_worker():
+    # Share the cores between workers instead of every worker's torch/OpenMP using all of them
+    os.environ.setdefault("OMP_NUM_THREADS", str(max(1, (os.cpu_count() or 1) // INGEST_PARSE_WORKERS)))
+    if WARMUP_WHISPER:
+        document_processor.load_whisper_model()
+
+
+def _ping() -> bool:
+    return True
+
+
+def _run_timed(stage: str, func, *args):
+    """Runs in a parse worker: returns the result of `func` with the stage timings recorded
+    meanwhile (including `stage` itself), for the server process to export."""
+    with metrics.collect_timings() as timings:
+        with metrics.timed(stage):
+            result = func(*args)
+    return result, timings
+
+
+def _timed_result(future: Future):
+    """Unwraps the result of a `_run_timed` task, recording its stage timings in this process."""
+    result, timings = future.result()
+    metrics.observe_all(timings)
+    return result
+
+
+def _get_parse_pool() -> ProcessPoolExecutor:
+    global _parse_pool
+    with _executor_lock:
+        if _parse_pool is None:
+            logger.info(f"Starting ingestion parse pool with {INGEST_PARSE_WORKERS} worker(s).")
+            # "spawn" avoids forking the server process while its threads hold locks
+            _parse_pool = ProcessPoolExecutor(
+                max_workers=INGEST_PARSE_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_parse_worker,
+            )
+        return _parse_pool
+
+
+def warm_up_parse_pool():
+    """Starts every parse worker ahead of the first upload (loading Whisper in each if WARMUP_WHISPER)."""
+    pool = _get_parse_pool()
+    for future in [pool.submit(_ping) for _ in range(INGEST_PARSE_WORKERS)]:
+        future.result()
+
+
+def _reset_parse_pool(broken_pool: ProcessPoolExecutor):
+    """Drops a pool whose worker died so the next submission starts a fresh one."""
+    global _parse_pool
+    with _executor_lock:
+        if _parse_pool is broken_pool:
+            logger.warning("Ingestion parse pool is broken, it will be restarted.")
+            _parse_pool = None
+    broken_pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _get_index_worker() -> ThreadPoolExecutor:
+    global _index_worker
+    with _executor_lock:
+        if _index_worker is None:
+            _index_worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ingest-index")
+        return _index_worker
+
+
+def run_on_index_worker(func, *args):
+    """Runs `func` on the index worker, after the writes already queued there, and returns its result."""
+    return _get_index_worker().submit(func, *args).result()
+
+
+def shutdown(wait: bool = True):
+    """Stops the ingestion executors. Called on application shutdown."""
+    global _parse_pool, _index_worker
+    with _executor_lock:
+        parse_pool, index_worker = _parse_pool, _index_worker
+        _parse_pool, _index_worker = None, None
+    if parse_pool is not None:
+        parse_pool.shutdown(wait=wait, cancel_futures=True)
+    if index_worker is not None:
+        index_worker.shutdown(wait=wait)
+
+
+# --- Job Registry ---
+def _register_job(job: IngestionJob):
+    with _jobs_lock:
+        _jobs[job.id] = job
+        # Forget the oldest finished jobs once the history limit is reached
+        finished = [job_id for job_id, j in _jobs.items() if j.is_finished]
+        for job_id in finished[:max(0, len(_jobs) - INGEST_JOB_HISTORY)]:
+            del _jobs[job_id]
+
+
+def get_job(job_id: str) -> Optional[IngestionJob]:
+    with _jobs_lock:
+        return _jobs.get(job_id)
+
+
+def list_jobs() -> List[IngestionJob]:
+    with _jobs_lock:
+        return list(_jobs.values())
+
+
+# --- Pipeline Stages ---
+def _mark_file_failed(job: IngestionJob, filename: str, error: str):
+    logger.error(f"[job {job.id}] Failed to ingest {filename}: {error}")
+    metrics.FILES.labels("failed").inc()
+    with job._lock:
+        job.files[filename] = FILE_FAILED
+        job.errors[filename] = error
+    # Only the staged upload goes: an indexed previous version keeps its file and chunks
+    _discard_upload(job.file_paths[filename])
+
+
+def _discard_upload(file_path: Path):
+    file_path.unlink(missing_ok=True)
+    try:
+        file_path.parent.rmdir()
+    except OSError:
+        pass
+
+
+def _mark_job_started(job: IngestionJob):
+    """Moves a queued job to running, once the index worker handles its first file."""
+    with job._lock:
+        if job.status == JOB_QUEUED:
+            job.status = JOB_RUNNING
+            job.started_at = time.time()
+
+
+def _finish_job_if_done(job: IngestionJob):
+    """Saves the index once and closes the job after its last file is handled."""
+    with job._lock:
+        pending = job._count(FILE_QUEUED, FILE_PARSING, FILE_PARSED)
+        indexed = job._count(FILE_INDEXED)
+    if pending:
+        return
+
+    if indexed:
+        try:
+            vector_store_manager.save_vector_store(job.collection)
+        except Exception as e:
+            logger.error(f"[job {job.id}] Failed to save vector store: {e}", exc_info=True)
+            metrics.FAILURES.labels("index_save").inc()
+            with job._lock:
+                job.errors["vector_store"] = f"Files processed, but failed to save vector store: {e}"
+                job.status = JOB_FAILED
+                job.finished_at = time.time()
+            return
+
+    with job._lock:
+        failed = job._count(FILE_FAILED)
+        if not indexed:
+            job.status = JOB_FAILED
+        elif failed:
+            job.status = JOB_COMPLETED_WITH_ERRORS
+        else:
+            job.status = JOB_COMPLETED
+        job.finished_at = time.time()
+        if job.started_at is None:
+            job.started_at = job.finished_at
+    logger.info(f"[job {job.id}] Finished with status '{job.status}' ({indexed} indexed, {failed} failed).")
+
+
+def _index_parsed_file(job: IngestionJob, filename: str, pool: ProcessPoolExecutor, parse_future: Future):
+    """Runs on the index worker: streams the extracted text of one file into the store in batches."""
+    _mark_job_started(job)
+    try:
+        try:
+            extracted = _timed_result(parse_future)
+        except BrokenProcessPool as e:
+            _reset_parse_pool(pool)
+            _mark_file_failed(job, filename, f"Parser process crashed: {e}")
+            return
+        except Exception as e:
+            _mark_file_failed(job, filename, str(e))
+            return
+
+        if not extracted:
+            _mark_file_failed(job, filename, "No content extracted.")
+            return
+
+        with job._lock:
+            job.files[filename] = FILE_PARSED
+            job.sections += extracted["sections"]
+        logger.info(f"[job {job.id}] Parsed {filename}, found {extracted['sections']} sections.")
+
+        processed_path = Path(extracted["processed_path"])
+        try:
+            added, removed = _index_file_version(job, filename, processed_path)
+        except Exception as e:
+            processed_path.unlink(missing_ok=True)
+            _mark_file_failed(job, filename, f"Failed to add to vector store: {e}")
+            return
+
+        with job._lock:
+            job.files[filename] = FILE_INDEXED
+            job.chunks += added
+            job.chunks_removed += removed
+        metrics.FILES.labels("indexed").inc()
+    finally:
+        ingestion_manifest.release(filename, job.collection)
+        _finish_job_if_done(job)
+
+
+def _index_file_version(job: IngestionJob, filename: str, processed_path: Path) -> tuple:
+    """Indexes only the chunks that changed since the previously indexed version of the file,
+    then records the new version in the ingestion manifest.
+
+    The extracted text is split and embedded as a stream, so memory does not grow with the file size.
+    On failure, the chunks added for the new version are removed again.
+    """
+    chunks = vector_store_manager.iter_file_chunks(processed_path, source=filename)
+    previous_chunk_ids, reusable = _previous_chunk_ids(job, filename)
+    added, _, chunk_ids = vector_store_manager.index_source_chunks(
+        chunks, previous_chunk_ids, save=False, collection=job.collection, reembed=not reusable, remove_stale=False
+    )
+    try:
+        removed = _record_file_version(job, filename, processed_path, chunk_ids, previous_chunk_ids)
+    except Exception:
+        vector_store_manager.delete_chunks(set(chunk_ids).difference(previous_chunk_ids), save=False, collection=job.collection)
+        raise
+    if previous_chunk_ids:
+        logger.info(f"[job {job.id}] {filename} changed: {added} chunk(s) added, {removed} removed, "
+                    f"{len(chunk_ids) - added} reused.")
+    return added, removed
+
+
+def _previous_chunk_ids(job: IngestionJob, filename: str) -> Tuple[List[str], bool]:
+    """Returns the chunk ids of the indexed version of a file, and whether a new version can reuse
+    their vectors.
+
+    Chunks embedded with another embedding model or backend are not reusable: the new version
+    embeds them again, replacing the stored ones.
+    """
+    previous_hash = ingestion_manifest.get_current_hash(filename, job.collection)
+    if not previous_hash:
+        return [], True
+    chunk_ids = ingestion_manifest.get_chunk_ids(filename, previous_hash, job.collection)
+    if ingestion_manifest.is_current_embedding(ingestion_manifest.get_file(filename, previous_hash, job.collection)):
+        return chunk_ids, True
+    logger.info(f"[job {job.id}] {filename} was indexed with another embedding model, re-embedding all its chunks.")
+    return chunk_ids, False
+
+
+def _record_file_version(
+    job: IngestionJob, filename: str, processed_path: Path, chunk_ids: List[str], previous_chunk_ids: Iterable[str]
+) -> int:
+    """Records a new version of a file as indexed, then removes what only the replaced version used.
+
+    Returns the number of chunks of the replaced version removed from the store.
+    """
+    file_path = job.file_paths[filename]
+    processed_path = str(processed_path)
+    previous = ingestion_manifest.record_indexed(
+        job.content_hashes[filename],
+        filename,
+        file_path.stat().st_size if file_path.exists() else None,
+        processed_path,
+        chunk_ids,
+        job.collection,
+    )
+    # Drop the chunks and extracted text of the replaced version, now that nothing maps to them
+    removed = 0
+    try:
+        removed = vector_store_manager.delete_chunks(
+            set(previous_chunk_ids).difference(chunk_ids), save=False, collection=job.collection
+        )
+    except Exception as e:
+        logger.error(f"[job {job.id}] Failed to remove the replaced chunks of {filename}: {e}", exc_info=True)
+    if previous and previous["processed_path"] and previous["processed_path"] != processed_path:
+        Path(previous["processed_path"]).unlink(missing_ok=True)
+
+    # The indexed version becomes the uploaded file of its name
+    upload_path = collection_upload_dir(job.collection) / filename
+    try:
+        file_path.replace(upload_path)
+        file_path.parent.rmdir()
+        job.file_paths[filename] = upload_path
+    except OSError as e:
+        logger.error(f"[job {job.id}] Failed to move the upload of {filename} to {upload_path}: {e}")
+    return removed
+
+
+# --- Segmented Audio Transcription ---
+class _AudioTranscript:
+    """State of one audio file transcribed as parallel segments.
+
+    Only touched on the index worker thread. Segments may finish in any order; they are
+    indexed in recording order, as soon as all the segments before them are indexed.
+    """
+
+    def __init__(self, filename: str, segments: List[Dict], previous_chunk_ids: List[str], reusable: bool):
+        self.filename = filename
+        self.segments = segments
+        self.previous_chunk_ids = set(previous_chunk_ids)
+        self.reusable = reusable
+        self.processed_path = document_processor.new_processed_path(filename)
+        self.results: Dict[int, Dict] = {}
+        self.next_index = 0
+        self.occurrences = Counter()
+        self.chunk_ids: List[str] = []
+        self.finished = False
+
+
+def _start_audio_transcription(job: IngestionJob, filename: str, pool: ProcessPoolExecutor, plan_future: Future):
+    """Runs on the index worker once an audio file is split: queues its segments for transcription."""
+    _mark_job_started(job)
+    segments, error = None, "No audio content."
+    try:
+        segments = _timed_result(plan_future)
+    except BrokenProcessPool as e:
+        _reset_parse_pool(pool)
+        error = f"Parser process crashed: {e}"
+    except Exception as e:
+        error = f"Failed to decode audio: {e}"
+    if not segments:
+        _mark_file_failed(job, filename, error)
+        ingestion_manifest.release(filename, job.collection)
+        _finish_job_if_done(job)
+        return
+
+    try:
+        previous_chunk_ids, reusable = _previous_chunk_ids(job, filename)
+    except Exception as e:
+        logger.error(f"[job {job.id}] Failed to prepare the index for {filename}: {e}", exc_info=True)
+        _mark_file_failed(job, filename, f"Failed to add to vector store: {e}")
+        ingestion_manifest.release(filename, job.collection)
+        _finish_job_if_done(job)
+        return
+    transcript = _AudioTranscript(filename, segments, previous_chunk_ids, reusable)
+    with job._lock:
+        job.audio_segments[filename] = {"done": 0, "total": len(segments)}
+    logger.info(f"[job {job.id}] Transcribing {filename} as {len(segments)} segment(s).")
+
+    for segment in segments:
+        try:
+            future = pool.submit(_run_timed, "transcribe", audio_transcription.transcribe_segment, segment)
+        except BrokenProcessPool as e:
+            _reset_parse_pool(pool)
+            _fail_audio_transcription(job, transcript, f"Parser process crashed: {e}")
+            return
+        future.add_done_callback(
+            lambda f, index=segment["index"]: _get_index_worker().submit(
+                _index_audio_segment, job, transcript, index, pool, f
+            )
+        )
+
+
+def _index_audio_segment(job: IngestionJob, transcript: _AudioTranscript, index: int, pool: ProcessPoolExecutor, future: Future):
+    """Runs on the index worker: adds the chunks of every segment transcribed so far, in order."""
+    if transcript.finished:
+        return
+    filename = transcript.filename
+    try:
+        transcript.results[index] = _timed_result(future)
+    except BrokenProcessPool as e:
+        _reset_parse_pool(pool)
+        _fail_audio_transcription(job, transcript, f"Parser process crashed: {e}")
+        return
+    except Exception as e:
+        _fail_audio_transcription(job, transcript, f"Failed to transcribe segment {index}: {e}")
+        return
+
+    try:
+        while transcript.next_index in transcript.results:
+            result = transcript.results.pop(transcript.next_index)
+            parts = [part for part in result["segments"] if part["text"].strip()]
+            added = 0
+            if parts:
+                with open(transcript.processed_path, "a", encoding="utf-8") as f:
+                    f.write("".join(part["text"] for part in parts).strip() + "\n\n")
+                with metrics.timed("split"):
+                    chunks = vector_store_manager.split_timed_text(
+                        parts, filename, transcript.processed_path, transcript.occurrences
+                    )
+                transcript.chunk_ids.extend(chunk.metadata["chunk_id"] for chunk in chunks)
+                if transcript.reusable:
+                    chunks = [chunk for chunk in chunks if chunk.metadata["chunk_id"] not in transcript.previous_chunk_ids]
+                added = vector_store_manager.add_chunks_to_store(
+                    chunks, save=False, collection=job.collection, replace=not transcript.reusable
+                )
+            transcript.next_index += 1
+            with job._lock:
+                job.sections += 1
+                job.chunks += added
+                job.audio_segments[filename]["done"] = transcript.next_index
+    except Exception as e:
+        _fail_audio_transcription(job, transcript, f"Failed to add to vector store: {e}")
+        return
+
+    if transcript.next_index == len(transcript.segments):
+        _finish_audio_transcription(job, transcript)
+
+
+def _finish_audio_transcription(job: IngestionJob, transcript: _AudioTranscript):
+    filename = transcript.filename
+    if not transcript.chunk_ids:
+        _fail_audio_transcription(job, transcript, "No speech transcribed.")
+        return
+    try:
+        removed = _record_file_version(
+            job, filename, transcript.processed_path, transcript.chunk_ids, transcript.previous_chunk_ids
+        )
+    except Exception as e:
+        _fail_audio_transcription(job, transcript, f"Failed to add to vector store: {e}")
+        return
+    transcript.finished = True
+    with job._lock:
+        job.files[filename] = FILE_INDEXED
+        job.chunks_removed += removed
+    metrics.FILES.labels("indexed").inc()
+    audio_transcription.remove_segments(transcript.segments)
+    ingestion_manifest.release(filename, job.collection)
+    _finish_job_if_done(job)
+
+
+def _fail_audio_transcription(job: IngestionJob, transcript: _AudioTranscript, error: str):
+    """Fails an audio file and removes the chunks of its already indexed segments."""
+    if transcript.finished:
+        return
+    transcript.finished = True
+    try:
+        vector_store_manager.delete_chunks(
+            set(transcript.chunk_ids) - transcript.previous_chunk_ids, save=False, collection=job.collection
+        )
+    except Exception as e:
+        logger.error(f"[job {job.id}] Failed to remove partial chunks of {transcript.filename}: {e}", exc_info=True)
+    transcript.processed_path.unlink(missing_ok=True)
+    audio_transcription.remove_segments(transcript.segments)
+    _mark_file_failed(job, transcript.filename, error)
+    ingestion_manifest.release(transcript.filename, job.collection)
+    _finish_job_if_done(job)
+
+
+# --- Document Removal ---
+def _delete_source(filename: str, collection: str) -> Optional[Dict]:
+    content_hash = ingestion_manifest.get_current_hash(filename, collection)
+    if content_hash is None:
+        return None
+    # The chunks go first: if removing them fails, the manifest still maps the file to them for a retry
+    removed = vector_store_manager.delete_chunks(ingestion_manifest.get_chunk_ids(filename, content_hash, collection), collection=collection)
+    entry = ingestion_manifest.remove_source(filename, collection)
+    if entry and entry["processed_path"]:
+        Path(entry["processed_path"]).unlink(missing_ok=True)
+    (collection_upload_dir(collection) / filename).unlink(missing_ok=True)
+    logger.info(f"Deleted {filename} from collection '{collection}' ({removed} chunk(s) removed).")
+    return {"filename": filename, "collection": collection, "chunks_removed": removed}
+
+
+def delete_source(filename: str, collection: str = DEFAULT_COLLECTION) -> Optional[Dict]:
+    """Removes the chunks, extracted text and uploaded file of an indexed document.
+
+    Runs on the index worker, after the indexing already queued there, and waits for it.
+    Returns {"filename", "collection", "chunks_removed"}, or None if the file name is not indexed.
+    """
+    return run_on_index_worker(_delete_source, filename, collection)
+
+
+def submit_job(file_paths: List[Path], content_hashes: Dict[str, str], collection: str = DEFAULT_COLLECTION) -> IngestionJob:
+    """Queues already-saved files for parsing and indexing into a collection, created if it does not
+    exist yet, and returns immediately.
+
+    The files are staged under their own name (see `collection_incoming_dir`) and moved to the upload
+    directory of the collection once indexed; the staged copies of files that fail are removed.
+
+    `content_hashes` maps each file name to the SHA-256 of its content. Every file name is claimed
+    beforehand for the collection with `ingestion_manifest.claim`; the claims are released once each file is handled.
+    """
+    create_collection(collection)
+    job = IngestionJob(file_paths, content_hashes, collection)
+    _register_job(job)
+    logger.info(f"[job {job.id}] Queued {len(file_paths)} file(s) for ingestion into collection '{collection}'.")
+
+    for file_path in file_paths:
+        filename = file_path.name
+        with job._lock:
+            job.files[filename] = FILE_PARSING
+        # Audio is first split at silences, then its segments are transcribed in parallel
+        if audio_transcription.is_audio(file_path):
+            stage, parse, on_done = "audio_split", audio_transcription.plan_segments, _start_audio_transcription
+        else:
+            stage, parse, on_done = "parse", document_processor.extract_document_text, _index_parsed_file
+        pool = _get_parse_pool()
+        try:
+            try:
+                future = pool.submit(_run_timed, stage, parse, file_path)
+            except BrokenProcessPool:
+                _reset_parse_pool(pool)
+                pool = _get_parse_pool()
+                future = pool.submit(_run_timed, stage, parse, file_path)
+        except Exception as e:
+            # The job is registered: its files fail one by one rather than the whole submission
+            _mark_file_failed(job, filename, f"Failed to queue for parsing: {e}")
+            ingestion_manifest.release(filename, collection)
+            _finish_job_if_done(job)
+            continue
+        future.add_done_callback(
+            lambda f, name=filename, p=pool, handler=on_done: _get_index_worker().submit(handler, job, name, p, f)
+        )
+
+    if not file_paths:
+        _finish_job_if_done(job)
+    return job
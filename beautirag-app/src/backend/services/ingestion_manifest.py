@@ -0,0 +1,235 @@
+import logging
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+from . import embedding_backends
+from .index_collections import collection_manifest_file
+from ..core.config import DEFAULT_COLLECTION
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# The manifest maps every ingested file version (file name and SHA-256 of its content) to its
+# extracted text, its chunk ids and the embedding model its chunks were indexed with, so
+# identical re-uploads of a file can be skipped without parsing or embedding and modified files
+# only re-index changed chunks. Every collection has its own manifest, next to its index.
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    content_hash TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    size INTEGER,
+    processed_path TEXT,
+    embedding_model TEXT,
+    state TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (filename, content_hash)
+);
+CREATE TABLE IF NOT EXISTS chunks (
+    chunk_id TEXT NOT NULL,
+    content_hash TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    filename TEXT NOT NULL,
+    PRIMARY KEY (filename, content_hash, position)
+);
+CREATE TABLE IF NOT EXISTS sources (
+    filename TEXT PRIMARY KEY,
+    content_hash TEXT NOT NULL
+);
+"""
+
+# Manifests written before file versions were keyed by file name as well as content
+_MIGRATE_V1 = """
+ALTER TABLE files RENAME TO files_v1;
+ALTER TABLE chunks RENAME TO chunks_v1;
+""" + _SCHEMA + """
+INSERT INTO files SELECT content_hash, filename, size, processed_path, embedding_model, state, updated_at FROM files_v1;
+INSERT INTO chunks SELECT chunks_v1.chunk_id, chunks_v1.content_hash, chunks_v1.position, files_v1.filename
+    FROM chunks_v1 JOIN files_v1 ON files_v1.content_hash = chunks_v1.content_hash;
+DROP TABLE files_v1;
+DROP TABLE chunks_v1;
+"""
+
+STATE_INDEXED = "indexed"
+
+# --- Claim Results ---
+CLAIMED = "claimed"
+ALREADY_INDEXED = "already_indexed"
+IN_FLIGHT = "in_flight"
+
+_connections: Dict[str, sqlite3.Connection] = {}
+_lock = threading.RLock()
+# (collection, file name) pairs currently being ingested: a file name is only written by one job at a time
+_in_flight: Set[Tuple[str, str]] = set()
+
+
+def _get_connection(collection: str) -> sqlite3.Connection:
+    connection = _connections.get(collection)
+    if connection is None:
+        path = collection_manifest_file(collection)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        connection = sqlite3.connect(str(path), check_same_thread=False)
+        connection.row_factory = sqlite3.Row
+        connection.execute("PRAGMA journal_mode=WAL")
+        columns = [row["name"] for row in connection.execute("PRAGMA table_info(chunks)")]
+        if columns and "filename" not in columns:
+            connection.executescript("BEGIN;" + _MIGRATE_V1 + "COMMIT;")
+            logger.info(f"Ingestion manifest at {path} migrated to per file name versions.")
+        connection.executescript(_SCHEMA)
+        _connections[collection] = connection
+        logger.info(f"Ingestion manifest opened at: {path}")
+    return connection
+
+
+def get_file(filename: str, content_hash: str, collection: str = DEFAULT_COLLECTION) -> Optional[Dict]:
+    """Returns the manifest entry of a file version, if any."""
+    with _lock:
+        row = _get_connection(collection).execute(
+            "SELECT * FROM files WHERE filename = ? AND content_hash = ?", (filename, content_hash)
+        ).fetchone()
+    return dict(row) if row else None
+
+
+def is_indexed(filename: str, content_hash: str, collection: str = DEFAULT_COLLECTION) -> bool:
+    """Returns True if this exact content is the indexed version of the file name, with the current embedding model."""
+    if get_current_hash(filename, collection) != content_hash:
+        return False
+    entry = get_file(filename, content_hash, collection)
+    return bool(entry) and entry["state"] == STATE_INDEXED and is_current_embedding(entry)
+
+
+def is_current_embedding(entry: Dict) -> bool:
+    """Returns True if a file version was embedded with the current embedding model and backend
+    (see `embedding_backends.model_key`), so its vectors can be reused."""
+    return entry["embedding_model"] == embedding_backends.model_key()
+
+
+def claim(filename: str, content_hash: str, collection: str = DEFAULT_COLLECTION) -> str:
+    """Reserves a file name for the ingestion of a new version into a collection.
+
+    Returns CLAIMED, ALREADY_INDEXED if this content is already the indexed version of the file,
+    or IN_FLIGHT if another job is ingesting a version of the file. Every CLAIMED must be
+    followed by a `release`.
+    """
+    with _lock:
+        if (collection, filename) in _in_flight:
+            return IN_FLIGHT
+        if is_indexed(filename, content_hash, collection):
+            return ALREADY_INDEXED
+        _in_flight.add((collection, filename))
+        return CLAIMED
+
+
+def release(filename: str, collection: str = DEFAULT_COLLECTION):
+    with _lock:
+        _in_flight.discard((collection, filename))
+
+
+def has_in_flight(collection: str = DEFAULT_COLLECTION) -> bool:
+    """Returns True while files claimed for a collection are being ingested."""
+    with _lock:
+        return any(claimed == collection for claimed, _ in _in_flight)
+
+
+def get_current_hash(filename: str, collection: str = DEFAULT_COLLECTION) -> Optional[str]:
+    """Returns the content hash of the latest indexed version of a file name."""
+    with _lock:
+        row = _get_connection(collection).execute(
+            "SELECT content_hash FROM sources WHERE filename = ?", (filename,)
+        ).fetchone()
+    return row["content_hash"] if row else None
+
+
+def get_chunk_ids(filename: str, content_hash: str, collection: str = DEFAULT_COLLECTION) -> List[str]:
+    """Returns the ids of the chunks indexed for a file version, in document order."""
+    with _lock:
+        rows = _get_connection(collection).execute(
+            "SELECT chunk_id FROM chunks WHERE filename = ? AND content_hash = ? ORDER BY position",
+            (filename, content_hash),
+        ).fetchall()
+    return [row["chunk_id"] for row in rows]
+
+
+def record_indexed(
+    content_hash: str,
+    filename: str,
+    size: Optional[int],
+    processed_path: Optional[str],
+    chunk_ids: List[str],
+    collection: str = DEFAULT_COLLECTION,
+) -> Optional[Dict]:
+    """Records a file version as indexed and makes it the current version of its file name.
+
+    Returns the manifest entry of the version it replaced, if any.
+    """
+    with _lock:
+        connection = _get_connection(collection)
+        previous_hash = get_current_hash(filename, collection)
+        previous = get_file(filename, previous_hash, collection) if previous_hash and previous_hash != content_hash else None
+        with connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (content_hash, filename, size, processed_path, embedding_backends.model_key(), STATE_INDEXED, time.time()),
+            )
+            _replace_chunk_ids(connection, filename, content_hash, chunk_ids)
+            connection.execute("INSERT OR REPLACE INTO sources VALUES (?, ?)", (filename, content_hash))
+            if previous is not None:
+                _delete_version(connection, filename, previous_hash)
+    return previous
+
+
+def _replace_chunk_ids(connection: sqlite3.Connection, filename: str, content_hash: str, chunk_ids: List[str]):
+    connection.execute("DELETE FROM chunks WHERE filename = ? AND content_hash = ?", (filename, content_hash))
+    connection.executemany(
+        "INSERT INTO chunks VALUES (?, ?, ?, ?)",
+        [(chunk_id, content_hash, position, filename) for position, chunk_id in enumerate(chunk_ids)],
+    )
+
+
+def _delete_version(connection: sqlite3.Connection, filename: str, content_hash: str):
+    connection.execute("DELETE FROM chunks WHERE filename = ? AND content_hash = ?", (filename, content_hash))
+    connection.execute("DELETE FROM files WHERE filename = ? AND content_hash = ?", (filename, content_hash))
+
+
+def record_rebuild(chunk_ids: Dict[Tuple[str, str], List[str]], collection: str = DEFAULT_COLLECTION):
+    """Records the chunk ids of file versions re-indexed by a rebuild ((file name, content hash) ->
+    ids, in document order), as indexed with the current embedding model."""
+    with _lock:
+        connection = _get_connection(collection)
+        with connection:
+            for (filename, content_hash), ids in chunk_ids.items():
+                connection.execute(
+                    "UPDATE files SET embedding_model = ?, state = ?, updated_at = ? WHERE filename = ? AND content_hash = ?",
+                    (embedding_backends.model_key(), STATE_INDEXED, time.time(), filename, content_hash),
+                )
+                _replace_chunk_ids(connection, filename, content_hash, ids)
+
+
+def list_sources(collection: str = DEFAULT_COLLECTION) -> List[Dict]:
+    """Returns the current version of every indexed file name, with its chunk count."""
+    with _lock:
+        rows = _get_connection(collection).execute(
+            "SELECT sources.filename, files.content_hash, files.size, files.updated_at, COUNT(chunks.chunk_id) AS chunks "
+            "FROM sources JOIN files ON files.filename = sources.filename AND files.content_hash = sources.content_hash "
+            "LEFT JOIN chunks ON chunks.filename = sources.filename AND chunks.content_hash = sources.content_hash "
+            "GROUP BY sources.filename ORDER BY sources.filename"
+        ).fetchall()
+    return [dict(row) for row in rows]
+
+
+def remove_source(filename: str, collection: str = DEFAULT_COLLECTION) -> Optional[Dict]:
+    """Forgets the current version of a file name and its chunk ids.
+
+    Returns its manifest entry, or None if the file name is not indexed.
+    """
+    with _lock:
+        connection = _get_connection(collection)
+        content_hash = get_current_hash(filename, collection)
+        if content_hash is None:
+            return None
+        entry = get_file(filename, content_hash, collection)
+        with connection:
+            connection.execute("DELETE FROM sources WHERE filename = ?", (filename,))
+            _delete_version(connection, filename, content_hash)
+    return entry
@@ -0,0 +1,187 @@
+import hashlib
+import logging
+import os
+import threading
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
+import pytesseract
+from PIL import Image, ImageOps
+
+from ..core import metrics
+from ..core.config import (
+    OCR_WORKERS,
+    OCR_LANGUAGE,
+    OCR_TARGET_DPI,
+    OCR_MAX_DIMENSION,
+    OCR_BINARIZE,
+    OCR_CACHE_DIR,
+)
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Every page is OCRed by its own Tesseract process (pytesseract runs the binary), so a thread
+# per in-flight page is enough to keep OCR_WORKERS cores busy. Tesseract's internal OpenMP
+# threading only competes with that page-level parallelism.
+os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".tif", ".tiff")
+# Upscaling beyond this factor only makes noise bigger
+MAX_UPSCALE = 4.0
+
+
+# --- Page Loading ---
+class _PageSource:
+    """The pages of an image file or a PDF, opened once for all of its pages."""
+
+    def __init__(self, file_path: Path):
+        self.file_path = file_path
+        self._pdf = None
+        # pypdf reads every page from the one file stream of its reader, so pages are extracted
+        # one at a time; their preprocessing and OCR still run in parallel
+        self._pdf_lock = threading.Lock()
+        if file_path.suffix.lower() == ".pdf":
+            from pypdf import PdfReader
+            self._pdf = PdfReader(str(file_path))
+
+    def count(self) -> int:
+        if self._pdf is not None:
+            return len(self._pdf.pages)
+        with Image.open(self.file_path) as image:
+            return getattr(image, "n_frames", 1)
+
+    def load(self, page: int) -> List[Image.Image]:
+        """Loads the images of one page: a frame of an image file, or the scans embedded in a PDF page."""
+        if self._pdf is None:
+            with Image.open(self.file_path) as image:
+                image.seek(page)
+                image = ImageOps.exif_transpose(image)
+                image.load()
+                return [image]
+
+        with self._pdf_lock:
+            pdf_page = self._pdf.pages[page]
+            page_width_inches = float(pdf_page.mediabox.width) / 72
+            images = [embedded.image for embedded in pdf_page.images]
+        images = [image for image in images if image is not None]
+        # The scan resolution follows from its pixel width and the page width
+        if page_width_inches > 0:
+            for image in images:
+                dpi = image.width / page_width_inches
+                image.info["dpi"] = (dpi, dpi)
+        return images
+
+
+# --- Preprocessing ---
+def _otsu_threshold(pixels: np.ndarray) -> int:
+    """Grey level that best separates dark and light pixels (Otsu's method)."""
+    histogram = np.bincount(pixels.ravel(), minlength=256).astype(np.float64)
+    weights = np.cumsum(histogram) / histogram.sum()
+    means = np.cumsum(histogram * np.arange(256)) / histogram.sum()
+    with np.errstate(divide="ignore", invalid="ignore"):
+        between_variance = (means[-1] * weights - means) ** 2 / (weights * (1 - weights))
+    return int(np.nanargmax(between_variance)) if np.isfinite(between_variance).any() else 127
+
+
+def preprocess(image: Image.Image) -> Tuple[Image.Image, int]:
+    """Prepares an image for Tesseract: grayscale, resolution normalised to OCR_TARGET_DPI,
+    longest side capped at OCR_MAX_DIMENSION and, unless disabled, binarised.
+
+    Returns the image and its resulting DPI.
+    """
+    dpi = float((image.info.get("dpi") or (0, 0))[0] or 0)
+    scale = 1.0
+    if dpi and dpi < OCR_TARGET_DPI:
+        scale = min(OCR_TARGET_DPI / dpi, MAX_UPSCALE)
+    longest = max(image.size)
+    if longest * scale > OCR_MAX_DIMENSION:
+        scale = OCR_MAX_DIMENSION / longest
+
+    image = image.convert("L")
+    if scale != 1.0:
+        size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+        image = image.resize(size, Image.LANCZOS)
+    if OCR_BINARIZE:
+        pixels = np.asarray(image)
+        image = Image.fromarray(np.where(pixels > _otsu_threshold(pixels), 255, 0).astype(np.uint8))
+    # Images without resolution info are assumed to be at the target DPI
+    return image, round(dpi * scale) if dpi else OCR_TARGET_DPI
+
+
+# --- Result Cache ---
+def _cache_key(image: Image.Image) -> str:
+    """Hash of the page pixels and of every setting that changes the OCR output."""
+    digest = hashlib.sha256()
+    digest.update(
+        f"{image.mode}|{image.size}|{image.info.get('dpi')}|{OCR_LANGUAGE}|{OCR_TARGET_DPI}|"
+        f"{OCR_MAX_DIMENSION}|{OCR_BINARIZE}".encode("utf-8")
+    )
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+
+def _cache_path(key: str) -> Path:
+    return OCR_CACHE_DIR / key[:2] / f"{key}.txt"
+
+
+def _read_cache(key: str) -> Optional[str]:
+    try:
+        return _cache_path(key).read_text(encoding="utf-8")
+    except FileNotFoundError:
+        return None
+
+
+def _write_cache(key: str, text: str):
+    path = _cache_path(key)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Parse workers may OCR the same page concurrently; the rename keeps readers from seeing partial files
+    tmp_path = path.with_name(f".{key}.{uuid.uuid4().hex[:8]}.tmp")
+    tmp_path.write_text(text, encoding="utf-8")
+    os.replace(tmp_path, path)
+
+
+# --- OCR ---
+def ocr_image(image: Image.Image) -> str:
+    """OCRs one image, reusing the cached result of identical pixels."""
+    key = _cache_key(image)
+    text = _read_cache(key)
+    if text is None:
+        processed, dpi = preprocess(image)
+        text = pytesseract.image_to_string(processed, lang=OCR_LANGUAGE, config=f"--dpi {dpi}")
+        _write_cache(key, text)
+    return text
+
+
+def _ocr_page(pages: _PageSource, page: int) -> str:
+    try:
+        images = pages.load(page)
+    except Exception as e:
+        logger.warning(f"Could not read page {page + 1} of {pages.file_path.name}: {e}")
+        return ""
+    with metrics.timed("ocr_page"):
+        return "\n".join(text.strip() for text in map(ocr_image, images) if text.strip())
+
+
+def ocr_pages(file_path: Path) -> Iterator[str]:
+    """Yields the OCR text of every page of an image, multi-page TIFF or scanned PDF, in order.
+
+    Up to OCR_WORKERS pages are OCRed concurrently, and only a bounded window of pages is in
+    flight at a time, so memory does not grow with the page count.
+    """
+    pages = _PageSource(file_path)
+    page_count = pages.count()
+    logger.info(f"Running OCR on {page_count} page(s) of {file_path.name}.")
+    workers = max(1, min(OCR_WORKERS, page_count))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ocr") as pool:
+        in_flight = deque()
+        for page in range(page_count):
+            in_flight.append(pool.submit(_ocr_page, pages, page))
+            if len(in_flight) >= 2 * workers:
+                yield in_flight.popleft().result()
+        while in_flight:
+            yield in_flight.popleft().result()
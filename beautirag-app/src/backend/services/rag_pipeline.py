@@ -1,7 +1,19 @@
+import asyncio
+import contextvars
+import hashlib
 import logging
-from typing import Optional, Dict, Any
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from functools import cached_property
+from typing import Optional, Dict, Any, AsyncIterator, List, Tuple
 
-from langchain_core.runnables import RunnablePassthrough, RunnableParallel
+import anthropic
+import httpx
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.runnables import RunnablePassthrough
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_core.messages import AIMessage, HumanMessage
@@ -10,22 +22,156 @@ from langchain_anthropic import ChatAnthropic
 from langchain_deepseek import ChatDeepSeek
 
 
-from .vector_store_manager import get_vector_store
+from .vector_store_manager import (
+    get_index_version,
+    embed_query,
+    embed_queries,
+    similarity_search,
+    similarity_search_batch,
+)
+from .semantic_cache import get_semantic_cache, list_semantic_caches
+from .context_packing import pack_context, token_budget_for
+from ..core import metrics
+from ..core.cache import TTLCache
 from ..core.config import (
+    DEFAULT_COLLECTION,
     OPENAI_API_KEY,
     ANTHROPIC_API_KEY,
     DEEPSEEK_API_KEY,
+    LLM_CACHE_SIZE,
+    LLM_CACHE_TTL_SECONDS,
+    LLM_HTTP_MAX_CONNECTIONS,
+    LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS,
+    LLM_REQUEST_TIMEOUT_SECONDS,
+    LLM_MAX_RETRIES,
+    LLM_MAX_CONCURRENCY,
+    LLM_QUEUE_TIMEOUT_SECONDS,
+    RETRIEVAL_K,
+    QUERY_RETRIEVAL_WORKERS,
+    BATCH_QUERY_CONCURRENCY,
+    SEMANTIC_CACHE_ENABLED,
+    SEMANTIC_CACHE_THRESHOLD,
 )
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# --- Client and Chain Caches ---
+_llm_cache = TTLCache(maxsize=LLM_CACHE_SIZE, ttl=LLM_CACHE_TTL_SECONDS)
+_chain_cache = TTLCache(maxsize=LLM_CACHE_SIZE, ttl=LLM_CACHE_TTL_SECONDS)
+
+# --- Providers ---
+LLM_PROVIDERS = {"gpt-": "openai", "claude-": "anthropic", "deepseek-": "deepseek"}
+
+def _provider_of(model_name: str) -> str:
+    for prefix, provider in LLM_PROVIDERS.items():
+        if model_name.startswith(prefix):
+            return provider
+    raise ValueError(f"Unsupported LLM model specified: {model_name}")
+
+# Pooled HTTP clients of the LLM providers (OpenAI, Anthropic, DeepSeek), one pair per provider,
+# so cached and rebuilt LLM clients keep reusing warm keep-alive connections
+_HTTP_LIMITS = httpx.Limits(
+    max_connections=LLM_HTTP_MAX_CONNECTIONS,
+    max_keepalive_connections=LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS,
+)
+_HTTP_TIMEOUT = httpx.Timeout(LLM_REQUEST_TIMEOUT_SECONDS, connect=10.0)
+_http_clients: Dict[str, Tuple[Any, Any]] = {}
+_http_clients_lock = threading.Lock()
+
+def _new_http_clients(provider: str) -> Tuple[Any, Any]:
+    if provider == "anthropic":
+        # The Anthropic SDK may be built on its own fork of httpx: its default client, limits and
+        # timeout classes are the ones it accepts
+        limits = type(anthropic.DEFAULT_CONNECTION_LIMITS)(
+            max_connections=LLM_HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        )
+        timeout = anthropic.Timeout(LLM_REQUEST_TIMEOUT_SECONDS, connect=10.0)
+        return (
+            anthropic.DefaultHttpxClient(limits=limits, timeout=timeout),
+            anthropic.DefaultAsyncHttpxClient(limits=limits, timeout=timeout),
+        )
+    return (
+        httpx.Client(limits=_HTTP_LIMITS, timeout=_HTTP_TIMEOUT),
+        httpx.AsyncClient(limits=_HTTP_LIMITS, timeout=_HTTP_TIMEOUT),
+    )
+
+def _get_http_clients(provider: str) -> Tuple[Any, Any]:
+    """Returns the pooled (sync, async) HTTP clients of a provider."""
+    with _http_clients_lock:
+        if provider not in _http_clients:
+            _http_clients[provider] = _new_http_clients(provider)
+        return _http_clients[provider]
+
+async def aclose_http_clients():
+    """Closes the pooled HTTP clients. Called on application shutdown."""
+    with _http_clients_lock:
+        clients = list(_http_clients.values())
+        _http_clients.clear()
+    clear_caches()
+    for client, async_client in clients:
+        client.close()
+        await async_client.aclose()
+
+# Concurrent LLM calls per provider: queries beyond the limit wait for a slot (up to
+# LLM_QUEUE_TIMEOUT_SECONDS) instead of piling up on a slow upstream
+_provider_semaphores: Dict[str, asyncio.Semaphore] = {}
+
+@asynccontextmanager
+async def _llm_slot(model_name: str):
+    provider = _provider_of(model_name)
+    semaphore = _provider_semaphores.setdefault(provider, asyncio.Semaphore(LLM_MAX_CONCURRENCY))
+    try:
+        await asyncio.wait_for(semaphore.acquire(), LLM_QUEUE_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        metrics.FAILURES.labels("llm_queue").inc()
+        raise RuntimeError(f"Too many concurrent requests to {provider}, please try again later.")
+    try:
+        yield
+    finally:
+        semaphore.release()
+
+def _cache_key(model_name: str, api_key: Optional[str], llm_kwargs: Dict[str, Any]) -> tuple:
+    """Builds a cache key from the model name, a hash of the API key and the LLM kwargs."""
+    api_key_hash = hashlib.sha256(api_key.encode("utf-8")).hexdigest() if api_key else None
+    return (model_name, api_key_hash, tuple(sorted((name, repr(value)) for name, value in llm_kwargs.items())))
+
+def clear_caches():
+    """Drops all cached LLM clients and RAG chains."""
+    _llm_cache.clear()
+    _chain_cache.clear()
+
 def get_llm(model_name: str, api_key: Optional[str] = None, **kwargs):
+    """Returns the specified LangChain LLM instance, reusing a cached client when possible."""
+    return _llm_cache.get_or_create(
+        _cache_key(model_name, api_key, kwargs),
+        lambda: _create_llm(model_name, api_key, **kwargs),
+    )
+
+class _PooledChatAnthropic(ChatAnthropic):
+    """ChatAnthropic on the pooled HTTP clients of the Anthropic provider.
+
+    ChatAnthropic takes no HTTP client parameter, it builds its SDK clients in these two properties.
+    """
+
+    @cached_property
+    def _client(self) -> anthropic.Client:
+        return anthropic.Client(**self._client_params, http_client=_get_http_clients("anthropic")[0])
+
+    @cached_property
+    def _async_client(self) -> anthropic.AsyncClient:
+        return anthropic.AsyncClient(**self._client_params, http_client=_get_http_clients("anthropic")[1])
+
+def _create_llm(model_name: str, api_key: Optional[str] = None, **kwargs):
     """Initializes and returns the specified LangChain LLM instance."""
     logger.info(f"Initializing LLM: {model_name}")
 
+    # The provider SDKs retry failed and timed out requests with exponential backoff
     llm_kwargs = {
         "temperature": 1,
+        "timeout": LLM_REQUEST_TIMEOUT_SECONDS,
+        "max_retries": LLM_MAX_RETRIES,
         **kwargs
     }
 
@@ -36,6 +182,7 @@ def get_llm(model_name: str, api_key: Optional[str] = None, **kwargs):
                 raise ValueError("OpenAI API key is required for GPT models but not found.")
             llm_kwargs["model_name"] = model_name
             llm_kwargs["api_key"] = key
+            llm_kwargs["http_client"], llm_kwargs["http_async_client"] = _get_http_clients("openai")
             return ChatOpenAI(**llm_kwargs)
 
         elif model_name.startswith("claude-"):
@@ -44,7 +191,7 @@ def get_llm(model_name: str, api_key: Optional[str] = None, **kwargs):
                 raise ValueError("Anthropic API key is required for Claude models but not found.")
             llm_kwargs["model"] = model_name # Anthropic uses 'model' parameter
             llm_kwargs["api_key"] = key
-            return ChatAnthropic(**llm_kwargs)
+            return _PooledChatAnthropic(**llm_kwargs)
 
         elif model_name.startswith("deepseek-"):
             key = api_key or DEEPSEEK_API_KEY
@@ -52,6 +199,7 @@ def get_llm(model_name: str, api_key: Optional[str] = None, **kwargs):
                 raise ValueError("DeepSeek API key is required for DeepSeek models but not found.")
             llm_kwargs["model"] = model_name
             llm_kwargs["api_key"] = key
+            llm_kwargs["http_client"], llm_kwargs["http_async_client"] = _get_http_clients("deepseek")
             return ChatDeepSeek(**llm_kwargs)
 
         else:
@@ -64,19 +212,12 @@ def get_llm(model_name: str, api_key: Optional[str] = None, **kwargs):
         logger.error(f"Failed to initialize LLM '{model_name}': {e}", exc_info=True)
         raise
 
-def create_rag_chain(model_name: str = "gpt-4o", api_key: Optional[str] = None, llm_kwargs: Optional[Dict[str, Any]] = None):
-    """Creates the full RAG chain using LCEL."""
-    vector_store = get_vector_store()
-    if vector_store is None:
-        raise RuntimeError("Vector store is not initialized. Add documents first.")
-
-    retriever = vector_store.as_retriever(
-        search_type="similarity",
-        search_kwargs={'k': 5}
-    )
-
-    llm = get_llm(model_name, api_key, **(llm_kwargs or {}))
+def _create_answer_chain(llm, model_name: str):
+    """Creates the chain answering {"documents", "question"} inputs with the given LLM.
 
+    The documents are packed into the model's context token budget, or the "context_tokens" of the
+    inputs when given (see `context_packing`).
+    """
     template = """
         You are a helpful assistant for question-answering tasks.
         Be friendly and concise.
@@ -94,37 +235,373 @@ def create_rag_chain(model_name: str = "gpt-4o", api_key: Optional[str] = None,
     """
     prompt = ChatPromptTemplate.from_template(template)
 
-    def format_docs(docs):
-        return "\n\n".join(doc.page_content for doc in docs)
+    default_budget = token_budget_for(model_name)
 
-    rag_chain = (
-        RunnableParallel(
-            context=retriever | format_docs,
-            question=RunnablePassthrough()
-        )
+    def format_docs(inputs):
+        with metrics.timed("context_pack"):
+            passages = pack_context(inputs["documents"], inputs.get("context_tokens") or default_budget)
+        return "\n\n".join(passage.page_content for passage in passages)
+
+    return (
+        RunnablePassthrough.assign(context=format_docs)
         | prompt
         | llm
         | StrOutputParser()
     )
 
-    logger.info(f"RAG chain created successfully with model: {model_name}")
-    return rag_chain
+def get_answer_chain(model_name: str = "gpt-4o", api_key: Optional[str] = None, llm_kwargs: Optional[Dict[str, Any]] = None):
+    """Returns a cached answer chain. It does not depend on the index: callers retrieve the documents."""
+    llm_kwargs = llm_kwargs or {}
+    return _chain_cache.get_or_create(
+        ("answer", *_cache_key(model_name, api_key, llm_kwargs)),
+        lambda: _create_answer_chain(get_llm(model_name, api_key, **llm_kwargs), model_name),
+    )
+
+QUERY_LLM_KWARGS = {"temperature": 0.7}
+
+class _AnswerTimer(BaseCallbackHandler):
+    """Times one answer chain run: prompt building (chain start to LLM start), time to first
+    token (streamed answers only) and the LLM call."""
+
+    run_inline = True
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.llm_start: Optional[float] = None
+        self.first_token_seen = False
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        self.llm_start = time.perf_counter()
+        metrics.observe("prompt_build", self.llm_start - self.start)
+
+    def on_llm_new_token(self, token: str, **kwargs):
+        if not self.first_token_seen and self.llm_start is not None:
+            self.first_token_seen = True
+            metrics.observe("llm_first_token", time.perf_counter() - self.llm_start)
+
+    def on_llm_end(self, response, **kwargs):
+        if self.llm_start is not None:
+            metrics.observe("llm", time.perf_counter() - self.llm_start)
+
+    def on_llm_error(self, error: BaseException, **kwargs):
+        metrics.FAILURES.labels("llm").inc()
+
+def _timed_answer_config() -> Dict[str, Any]:
+    return {"callbacks": [_AnswerTimer()]}
+
+# --- Retrieval ---
+# Query embedding and FAISS search are blocking (FAISS releases the GIL), so the async query
+# path runs them on a dedicated pool instead of the event loop or the shared default pool
+_retrieval_executor = ThreadPoolExecutor(max_workers=QUERY_RETRIEVAL_WORKERS, thread_name_prefix="retrieval")
+
+async def _run_in_retrieval_pool(func, *args):
+    # Runs in the caller's context, so stage timings are attributed to the current request
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(_retrieval_executor, context.run, func, *args)
 
-def query_rag(query: str, model_name: str = "gpt-4o", api_key: Optional[str] = None) -> str:
-    """Queries the RAG chain with the provided question and model selection."""
+def _retrieve(query: str, query_vector=None, collection: str = DEFAULT_COLLECTION, k: Optional[int] = None) -> list:
+    """Returns the k (default RETRIEVAL_K) chunks of a collection most similar to the query,
+    reusing its embedding when already computed."""
+    if query_vector is None:
+        with metrics.timed("query_embed"):
+            query_vector = embed_query(query)
+    with metrics.timed("retrieve"):
+        return similarity_search(query_vector, k or RETRIEVAL_K, collection)
+
+def _describe_sources(documents) -> list:
+    return [{"source": doc.metadata.get("source"), "content": doc.page_content} for doc in documents]
+
+# --- Semantic Cache ---
+def _answer_key(model_name: str, k: Optional[int] = None, context_tokens: Optional[int] = None) -> tuple:
+    """Cached answers are only reused for the same model, number of retrieved chunks and context budget,
+    which all change the prompt."""
+    return model_name, k or RETRIEVAL_K, context_tokens or token_budget_for(model_name)
+
+def _lookup_cached_answer(query: str, answer_key: tuple, collection: str = DEFAULT_COLLECTION):
+    """Embeds the query and looks it up in the semantic cache of the collection.
+
+    Returns (query vector, cached entry or None, index version at lookup time).
+    """
+    index_version = get_index_version(collection)
+    try:
+        with metrics.timed("query_embed"):
+            query_vector = embed_query(query)
+    except Exception as e:
+        logger.warning(f"Could not embed query for the semantic cache, bypassing it: {e}")
+        return None, None, index_version
+    return query_vector, _lookup_cached_vector(answer_key, query_vector, collection), index_version
+
+def _lookup_cached_vector(answer_key: tuple, query_vector, collection: str = DEFAULT_COLLECTION):
+    try:
+        return get_semantic_cache(collection).lookup(answer_key, query_vector)
+    except Exception as e:
+        logger.warning(f"Semantic cache lookup failed, bypassing it: {e}")
+        return None
+
+def _store_answer(
+    query: str,
+    answer_key: tuple,
+    query_vector,
+    answer: str,
+    sources: list,
+    index_version,
+    collection: str = DEFAULT_COLLECTION,
+):
+    if query_vector is None or not answer:
+        return
+    try:
+        get_semantic_cache(collection).store(answer_key, query, query_vector, answer, sources, index_version)
+    except Exception as e:
+        logger.warning(f"Could not store answer in the semantic cache: {e}")
+
+def get_semantic_cache_stats() -> Dict[str, Any]:
+    if not SEMANTIC_CACHE_ENABLED:
+        return {"enabled": False}
+    collections = {name: cache.stats() for name, cache in list_semantic_caches().items()}
+    return {
+        "enabled": True,
+        "entries": sum(stats["entries"] for stats in collections.values()),
+        "hits": sum(stats["hits"] for stats in collections.values()),
+        "misses": sum(stats["misses"] for stats in collections.values()),
+        "threshold": SEMANTIC_CACHE_THRESHOLD,
+        "collections": collections,
+    }
+
+
+async def aquery_rag(
+    query: str,
+    model_name: str = "gpt-4o",
+    api_key: Optional[str] = None,
+    use_cache: bool = True,
+    collection: str = DEFAULT_COLLECTION,
+    k: Optional[int] = None,
+    context_tokens: Optional[int] = None,
+) -> Dict[str, Any]:
+    """Queries a collection with the provided question and model selection, for the API.
+
+    Returns the answer and whether it was served from the semantic cache. Retrieval runs on the
+    retrieval thread pool and the LLM call is awaited while holding one of the provider's
+    concurrency slots, so slow upstream calls do not block other queries. `k` and
+    `context_tokens` override the number of chunks retrieved and the model's context token budget.
+    """
     logger.info(f"Received query: '{query}' for model: {model_name}")
+    use_cache = use_cache and SEMANTIC_CACHE_ENABLED
+    answer_key = _answer_key(model_name, k, context_tokens)
+    start = time.perf_counter()
     try:
-        rag_chain = create_rag_chain(model_name=model_name, api_key=api_key, llm_kwargs={"temperature": 0.7})
-        response = rag_chain.invoke(query)
+        query_vector, index_version = None, None
+        if use_cache:
+            query_vector, cached, index_version = await _run_in_retrieval_pool(
+                _lookup_cached_answer, query, answer_key, collection
+            )
+            if cached is not None:
+                metrics.observe("query_total", time.perf_counter() - start)
+                return {"response": cached["answer"], "cache_hit": True}
+
+        documents = await _run_in_retrieval_pool(_retrieve, query, query_vector, collection, k)
+        answer_chain = get_answer_chain(model_name=model_name, api_key=api_key, llm_kwargs=QUERY_LLM_KWARGS)
+        async with _llm_slot(model_name):
+            response = await answer_chain.ainvoke(
+                {"documents": documents, "question": query, "context_tokens": context_tokens},
+                config=_timed_answer_config(),
+            )
         logger.info(f"Generated response: '{response}'")
-        return response
+        if use_cache:
+            await _run_in_retrieval_pool(
+                _store_answer, query, answer_key, query_vector, response, _describe_sources(documents), index_version,
+                collection,
+            )
+        metrics.observe("query_total", time.perf_counter() - start)
+        return {"response": response, "cache_hit": False}
     except RuntimeError as e:
         logger.error(f"Runtime error during RAG query: {e}")
-        return f"Error: {e}"
+        metrics.FAILURES.labels("query").inc()
+        return {"response": f"Error: {e}", "cache_hit": False}
     except ValueError as e:
         logger.error(f"Configuration error during RAG query: {e}")
-        return f"Configuration Error: {e}"
+        metrics.FAILURES.labels("query").inc()
+        return {"response": f"Configuration Error: {e}", "cache_hit": False}
     except Exception as e:
         logger.error(f"An unexpected error occurred during the RAG query: {e}", exc_info=True)
-        return "An unexpected error occurred while processing your request."
+        metrics.FAILURES.labels("query").inc()
+        return {"response": "An unexpected error occurred while processing your request.", "cache_hit": False}
 
+def _batch_retrieve(queries: List[str], answer_key: tuple, use_cache: bool, collection: str, k: Optional[int] = None) -> Tuple[list, list, list, Any]:
+    """Embeds all queries in one model call, looks them up in the semantic cache and retrieves the
+    chunks of the misses with one multi-query FAISS search.
+
+    Returns (query vectors, cached entries or None, documents or None, index version), per query.
+    """
+    index_version = get_index_version(collection)
+    with metrics.timed("query_embed"):
+        vectors = embed_queries(queries)
+    cached = [_lookup_cached_vector(answer_key, vector, collection) if use_cache else None for vector in vectors]
+    misses = [position for position, entry in enumerate(cached) if entry is None]
+    documents = [None] * len(queries)
+    if misses:
+        with metrics.timed("retrieve"):
+            results = similarity_search_batch([vectors[p] for p in misses], k or RETRIEVAL_K, collection)
+        for position, docs in zip(misses, results):
+            documents[position] = docs
+    return vectors, cached, documents, index_version
+
+async def abatch_query_rag(
+    queries: List[str],
+    model_name: str = "gpt-4o",
+    api_key: Optional[str] = None,
+    use_cache: bool = True,
+    max_concurrency: Optional[int] = None,
+    collection: str = DEFAULT_COLLECTION,
+    k: Optional[int] = None,
+    context_tokens: Optional[int] = None,
+) -> AsyncIterator[Dict[str, Any]]:
+    """Answers many queries, yielding {"index", "query", "response", "cache_hit"} results as they complete.
+
+    Retrieval is vectorised (one embedding call and one FAISS search for the whole batch), then up to
+    `max_concurrency` LLM calls run at once, on top of the provider's own concurrency limit.
+    Failed queries get an "error" instead of a "response". `k` and `context_tokens` apply to every query.
+    """
+    logger.info(f"Received batch of {len(queries)} queries for model: {model_name}")
+    use_cache = use_cache and SEMANTIC_CACHE_ENABLED
+    answer_key = _answer_key(model_name, k, context_tokens)
+    start = time.perf_counter()
+    try:
+        vectors, cached, documents, index_version = await _run_in_retrieval_pool(
+            _batch_retrieve, queries, answer_key, use_cache, collection, k
+        )
+        answer_chain = get_answer_chain(model_name=model_name, api_key=api_key, llm_kwargs=QUERY_LLM_KWARGS)
+    except (RuntimeError, ValueError) as e:
+        logger.error(f"Error during batch RAG query retrieval: {e}")
+        metrics.FAILURES.labels("query").inc(len(queries))
+        for index, query in enumerate(queries):
+            yield {"index": index, "query": query, "error": f"Error: {e}"}
+        return
+    logger.info(f"Batch retrieval of {len(queries)} queries took {(time.perf_counter() - start) * 1000:.0f} ms.")
+
+    for index, entry in enumerate(cached):
+        if entry is not None:
+            yield {"index": index, "query": queries[index], "response": entry["answer"], "cache_hit": True}
+
+    fan_out = asyncio.Semaphore(max_concurrency or BATCH_QUERY_CONCURRENCY)
+
+    async def answer(index: int) -> Dict[str, Any]:
+        query = queries[index]
+        async with fan_out:
+            try:
+                async with _llm_slot(model_name):
+                    response = await answer_chain.ainvoke(
+                        {"documents": documents[index], "question": query, "context_tokens": context_tokens},
+                        config=_timed_answer_config(),
+                    )
+            except RuntimeError as e:
+                metrics.FAILURES.labels("query").inc()
+                return {"index": index, "query": query, "error": f"Error: {e}"}
+            except Exception as e:
+                logger.error(f"An unexpected error occurred during batch query {index}: {e}", exc_info=True)
+                metrics.FAILURES.labels("query").inc()
+                return {"index": index, "query": query, "error": "An unexpected error occurred while processing this query."}
+        if use_cache:
+            try:
+                await _run_in_retrieval_pool(
+                    _store_answer, query, answer_key, vectors[index], response,
+                    _describe_sources(documents[index]), index_version, collection,
+                )
+            except Exception as e:
+                logger.warning(f"Failed to cache the answer of batch query {index}: {e}")
+        return {"index": index, "query": query, "response": response, "cache_hit": False}
+
+    tasks = [asyncio.create_task(answer(index)) for index, entry in enumerate(cached) if entry is None]
+    try:
+        for next_result in asyncio.as_completed(tasks):
+            yield await next_result
+    finally:
+        # Stops the remaining LLM calls if the caller goes away
+        for task in tasks:
+            task.cancel()
+    metrics.observe("batch_query_total", time.perf_counter() - start)
+    logger.info(f"Answered batch of {len(queries)} queries in {(time.perf_counter() - start):.1f}s.")
+
+async def stream_rag(
+    query: str,
+    model_name: str = "gpt-4o",
+    api_key: Optional[str] = None,
+    use_cache: bool = True,
+    collection: str = DEFAULT_COLLECTION,
+    k: Optional[int] = None,
+    context_tokens: Optional[int] = None,
+) -> AsyncIterator[Dict[str, Any]]:
+    """Streams a RAG answer as events: 'sources' once retrieval is done, then 'token' events, then 'done'.
+
+    A semantic cache hit is streamed as its sources and a single token holding the whole answer.
+    Errors are reported as a final 'error' event. Closing the generator cancels the upstream LLM call.
+    """
+    logger.info(f"Received streaming query: '{query}' for model: {model_name}")
+    start = time.perf_counter()
+    first_token_at = None
+    answer_parts = []
+    sources = []
+    use_cache = use_cache and SEMANTIC_CACHE_ENABLED
+    answer_key = _answer_key(model_name, k, context_tokens)
+    query_vector, index_version = None, None
+    try:
+        if use_cache:
+            query_vector, cached, index_version = await _run_in_retrieval_pool(
+                _lookup_cached_answer, query, answer_key, collection
+            )
+            if cached is not None:
+                metrics.observe("query_total", time.perf_counter() - start)
+                elapsed_ms = round((time.perf_counter() - start) * 1000, 1)
+                yield {"event": "sources", "data": {"sources": cached["sources"], "retrieval_ms": elapsed_ms}}
+                yield {"event": "token", "data": {"token": cached["answer"]}}
+                yield {
+                    "event": "done",
+                    "data": {"time_to_first_token_ms": elapsed_ms, "total_ms": elapsed_ms, "cache_hit": True},
+                }
+                return
+
+        documents = await _run_in_retrieval_pool(_retrieve, query, query_vector, collection, k)
+        sources = _describe_sources(documents)
+        yield {
+            "event": "sources",
+            "data": {
+                "sources": sources,
+                "retrieval_ms": round((time.perf_counter() - start) * 1000, 1),
+            },
+        }
+
+        answer_chain = get_answer_chain(model_name=model_name, api_key=api_key, llm_kwargs=QUERY_LLM_KWARGS)
+        async with _llm_slot(model_name):
+            async for token in answer_chain.astream(
+                {"documents": documents, "question": query, "context_tokens": context_tokens},
+                config=_timed_answer_config(),
+            ):
+                if token:
+                    if first_token_at is None:
+                        first_token_at = time.perf_counter()
+                    answer_parts.append(token)
+                    yield {"event": "token", "data": {"token": token}}
+    except RuntimeError as e:
+        logger.error(f"Runtime error during streaming RAG query: {e}")
+        metrics.FAILURES.labels("query").inc()
+        yield {"event": "error", "data": {"detail": f"Error: {e}"}}
+        return
+    except ValueError as e:
+        logger.error(f"Configuration error during streaming RAG query: {e}")
+        metrics.FAILURES.labels("query").inc()
+        yield {"event": "error", "data": {"detail": f"Configuration Error: {e}"}}
+        return
+    except Exception as e:
+        logger.error(f"An unexpected error occurred during the streaming RAG query: {e}", exc_info=True)
+        metrics.FAILURES.labels("query").inc()
+        yield {"event": "error", "data": {"detail": "An unexpected error occurred while processing your request."}}
+        return
+
+    metrics.observe("query_total", time.perf_counter() - start)
+    total_ms = round((time.perf_counter() - start) * 1000, 1)
+    ttft_ms = round((first_token_at - start) * 1000, 1) if first_token_at is not None else None
+    logger.info(f"Streamed response of {len(answer_parts)} chunks (time to first token: {ttft_ms} ms, total: {total_ms} ms)")
+    if use_cache:
+        await _run_in_retrieval_pool(
+            _store_answer, query, answer_key, query_vector, "".join(answer_parts), sources, index_version, collection
+        )
+    yield {"event": "done", "data": {"time_to_first_token_ms": ttft_ms, "total_ms": total_ms, "cache_hit": False}}
@@ -0,0 +1,159 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, List, Optional
+
+import faiss
+import numpy as np
+
+from .vector_store_manager import get_index_version
+from ..core import metrics
+from ..core.config import (
+    DEFAULT_COLLECTION,
+    SEMANTIC_CACHE_THRESHOLD,
+    SEMANTIC_CACHE_MAX_ENTRIES,
+    SEMANTIC_CACHE_TTL_SECONDS,
+)
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+class SemanticCache:
+    """Answers cache looked up by query embedding similarity instead of exact query text.
+
+    Each answer key (the model and the retrieval and packing settings the answer was generated
+    with) has its own small inner-product index over normalised query embeddings, so a lookup
+    returns the stored answer of the most similar earlier query for the same key when its cosine
+    similarity reaches `threshold`. Entries are evicted least recently used first
+    beyond `max_entries` and expire after `ttl` seconds. The whole cache is dropped when the
+    document index version reported by `index_version_getter` changes.
+    """
+
+    def __init__(self, threshold: float, max_entries: int, ttl: float, index_version_getter: Callable[[], Hashable]):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._index_version_getter = index_version_getter
+        self._index_version: Optional[Hashable] = None
+        self._indexes: Dict[Hashable, faiss.IndexIDMap2] = {}
+        # entry id -> entry, least recently used first
+        self._entries: "OrderedDict[int, Dict]" = OrderedDict()
+        self._next_id = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalise(vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32).reshape(1, -1)
+        faiss.normalize_L2(vector)
+        return vector
+
+    def _check_index_version(self):
+        current = self._index_version_getter()
+        if current != self._index_version:
+            if self._entries:
+                logger.info("Document index changed, clearing the semantic cache.")
+            self._clear()
+            self._index_version = current
+
+    def _remove(self, entry_id: int):
+        entry = self._entries.pop(entry_id)
+        self._indexes[entry["answer_key"]].remove_ids(np.array([entry_id], dtype=np.int64))
+
+    def _clear(self):
+        self._indexes.clear()
+        self._entries.clear()
+
+    def clear(self):
+        with self._lock:
+            self._clear()
+
+    def _record(self, hit: bool):
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+        metrics.CACHE_LOOKUPS.labels("semantic", "hit" if hit else "miss").inc()
+
+    def lookup(self, answer_key: Hashable, query_vector) -> Optional[Dict]:
+        """Returns the cached entry of the most similar earlier query for this answer key, or None."""
+        with self._lock:
+            self._check_index_version()
+            index = self._indexes.get(answer_key)
+            if index is None or index.ntotal == 0:
+                self._record(hit=False)
+                return None
+            similarities, entry_ids = index.search(self._normalise(query_vector), 1)
+            similarity, entry_id = float(similarities[0][0]), int(entry_ids[0][0])
+            entry = self._entries.get(entry_id)
+            if entry is not None and time.time() - entry["created_at"] > self.ttl:
+                self._remove(entry_id)
+                entry = None
+            if entry is None or similarity < self.threshold:
+                self._record(hit=False)
+                return None
+            self._entries.move_to_end(entry_id)
+            self._record(hit=True)
+            logger.info(f"Semantic cache hit (similarity {similarity:.3f}) for query: '{entry['query']}'")
+            return {**entry, "similarity": similarity}
+
+    def store(self, answer_key: Hashable, query: str, query_vector, answer: str, sources: List[Dict], index_version: Hashable):
+        """Caches an answer, unless the document index changed since the query started."""
+        with self._lock:
+            self._check_index_version()
+            if index_version != self._index_version:
+                return
+            vector = self._normalise(query_vector)
+            index = self._indexes.get(answer_key)
+            if index is None:
+                index = faiss.IndexIDMap2(faiss.IndexFlatIP(vector.shape[1]))
+                self._indexes[answer_key] = index
+            entry_id = self._next_id
+            self._next_id += 1
+            index.add_with_ids(vector, np.array([entry_id], dtype=np.int64))
+            self._entries[entry_id] = {
+                "answer_key": answer_key,
+                "query": query,
+                "answer": answer,
+                "sources": sources,
+                "created_at": time.time(),
+            }
+            now = time.time()
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+            expired = [entry_id for entry_id, entry in self._entries.items() if now - entry["created_at"] > self.ttl]
+            for entry_id in expired:
+                self._remove(entry_id)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "threshold": self.threshold,
+            }
+
+
+# One cache per collection, each invalidated by changes to its own collection only
+_caches: Dict[str, SemanticCache] = {}
+_caches_lock = threading.Lock()
+
+def get_semantic_cache(collection: str = DEFAULT_COLLECTION) -> SemanticCache:
+    """Returns the semantic cache of a collection, creating it on first use."""
+    with _caches_lock:
+        if collection not in _caches:
+            _caches[collection] = SemanticCache(
+                threshold=SEMANTIC_CACHE_THRESHOLD,
+                max_entries=SEMANTIC_CACHE_MAX_ENTRIES,
+                ttl=SEMANTIC_CACHE_TTL_SECONDS,
+                index_version_getter=lambda: get_index_version(collection),
+            )
+        return _caches[collection]
+
+def list_semantic_caches() -> Dict[str, SemanticCache]:
+    with _caches_lock:
+        return dict(_caches)
@@ -1,100 +1,451 @@
+import bisect
+import hashlib
 import logging
+import shutil
+import threading
+from collections import Counter
+from functools import partial
+from itertools import islice
 from pathlib import Path
-from typing import List, Optional
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 
 from langchain_core.documents import Document
-from langchain_community.vectorstores import FAISS
-from langchain_community.embeddings import HuggingFaceEmbeddings
+from langchain_core.embeddings import Embeddings
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 
-from ..core.config import FAISS_INDEX_DIR, EMBEDDING_MODEL_NAME
+from . import embedding_backends
+from .embedding_cache import CachedEmbeddings, EmbeddingCache
+from .ann_index import INDEX_TYPES
+from .index_collections import Collection, CollectionRegistry
+from .index_segments import SegmentedIndex
+from ..core import metrics
+from ..core.config import (
+    DEFAULT_COLLECTION,
+    COLLECTION_SEARCH_WORKERS,
+    MAX_LOADED_COLLECTIONS,
+    EMBEDDING_CACHE_ENABLED,
+    EMBEDDING_CACHE_DIR,
+    EMBEDDING_CACHE_MAX_ENTRIES,
+    INDEX_COMPACTION_THRESHOLD,
+    INDEX_TOMBSTONE_RATIO,
+    INDEX_SHARED,
+    INDEX_REFRESH_INTERVAL_SECONDS,
+    INDEX_TYPE,
+    INDEX_PROMOTION_THRESHOLD,
+    INDEX_RECALL_SAMPLE_SIZE,
+    INGEST_SPLIT_WINDOW_CHARS,
+    INGEST_EMBED_BATCH_SIZE,
+    INGEST_FLUSH_CHUNKS,
+)
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-FAISS_INDEX_FILE = FAISS_INDEX_DIR / "beautirag_index.faiss"
 CHUNK_SIZE = 1000
 CHUNK_OVERLAP = 200
 
 # --- Global Variables (Cached) ---
-_embed_model: Optional[HuggingFaceEmbeddings] = None
-_vector_store: Optional[FAISS] = None
+_embed_model: Optional[Embeddings] = None
+_registry: Optional[CollectionRegistry] = None
+# Serialises the lazy initialisation below, so a background warmup and the first requests load things once
+_init_lock = threading.RLock()
 
-def _get_embedding_model() -> HuggingFaceEmbeddings:
-    """Initializes and returns the embedding model, caching it globally."""
+def _get_embedding_model() -> Embeddings:
+    """Initializes and returns the embedding model, caching it globally.
+
+    The backend (PyTorch or ONNX Runtime, optionally on several processes) is chosen in
+    `embedding_backends`. Unless disabled, the model is wrapped in an on-disk embedding cache so
+    chunk texts that were already embedded (re-uploads, rebuilds) skip model inference.
+    """
     global _embed_model
-    if _embed_model is None:
-        logger.info(f"Initializing embedding model: {EMBEDDING_MODEL_NAME}")
-        _embed_model = HuggingFaceEmbeddings(
-            model_name=EMBEDDING_MODEL_NAME,
-            model_kwargs={'device': 'cpu'}
-        )
-        logger.info("Embedding model initialized.")
+    with _init_lock:
+        if _embed_model is None:
+            logger.info(f"Initializing embedding model: {embedding_backends.model_key()}")
+            embed_model = embedding_backends.create_embeddings()
+            if EMBEDDING_CACHE_ENABLED:
+                cache = EmbeddingCache(EMBEDDING_CACHE_DIR, embedding_backends.model_key(), EMBEDDING_CACHE_MAX_ENTRIES, shared=INDEX_SHARED)
+                embed_model = CachedEmbeddings(embed_model, cache)
+            _embed_model = embed_model
+            logger.info("Embedding model initialized.")
     return _embed_model
 
-def _split_documents(documents: List[Document]) -> List[Document]:
-    """Splits documents into smaller chunks."""
-    text_splitter = RecursiveCharacterTextSplitter(
+def set_embedding_model(model: Embeddings):
+    """Replaces the embedding model, e.g. with a stub for offline benchmarks. Call before indexing."""
+    global _embed_model
+    with _init_lock:
+        _embed_model = model
+
+def embed_query(text: str) -> List[float]:
+    """Embeds a query with the same model as the indexed chunks."""
+    return _get_embedding_model().embed_query(text)
+
+def embed_queries(texts: List[str]) -> List[List[float]]:
+    """Embeds many queries in one batched model call.
+
+    Queries bypass the chunk embedding cache, which only holds indexed texts.
+    """
+    model = _get_embedding_model()
+    if isinstance(model, CachedEmbeddings):
+        model = model.base
+    return model.embed_documents(texts)
+
+def embed_chunks(texts: List[str]) -> List[List[float]]:
+    """Embeds chunk texts with the indexing model, through the embedding cache."""
+    return _get_embedding_model().embed_documents(texts)
+
+def _chunk_id(source: str, text: str, occurrence: int) -> str:
+    """Deterministic chunk id: identical text at the same place of the same source keeps its id."""
+    digest = hashlib.sha256(f"{source}\0{occurrence}\0{text}".encode("utf-8"))
+    return digest.hexdigest()[:32]
+
+def _text_splitter(add_start_index: bool = False) -> RecursiveCharacterTextSplitter:
+    return RecursiveCharacterTextSplitter(
         chunk_size=CHUNK_SIZE,
         chunk_overlap=CHUNK_OVERLAP,
         length_function=len,
         is_separator_regex=False,
+        add_start_index=add_start_index,
     )
-    chunks = text_splitter.split_documents(documents)
+
+def _split_documents(documents: List[Document]) -> List[Document]:
+    """Splits documents into smaller chunks, each tagged with a deterministic `chunk_id` and its
+    `start_index` in the document (used to merge adjacent chunks into one passage at query time)."""
+    chunks = _text_splitter(add_start_index=True).split_documents(documents)
+    occurrences = Counter()
+    for chunk in chunks:
+        key = (chunk.metadata.get("source", ""), chunk.page_content)
+        chunk.metadata["chunk_id"] = _chunk_id(key[0], key[1], occurrences[key])
+        occurrences[key] += 1
     logger.info(f"Split {len(documents)} documents into {len(chunks)} chunks.")
     return chunks
 
-def get_vector_store() -> Optional[FAISS]:
-    """Loads the FAISS vector store from disk if it exists, otherwise returns None."""
-    global _vector_store
-    if _vector_store is None:
-        if FAISS_INDEX_FILE.exists():
-            try:
-                embedding_model = _get_embedding_model()
-                logger.info(f"Loading existing FAISS index from: {FAISS_INDEX_FILE}")
-                _vector_store = FAISS.load_local(
-                    str(FAISS_INDEX_DIR),
-                    embeddings=embedding_model,
-                    index_name="beautirag_index",
-                    allow_dangerous_deserialization=True
+def split_documents(documents: List[Document]) -> List[Document]:
+    """Public wrapper of the chunking step, so callers can diff chunk ids before indexing."""
+    return _split_documents(documents)
+
+def _iter_text_windows(path: Path, window_chars: int) -> Iterator[str]:
+    """Reads a text file in windows of about `window_chars` characters, cut at paragraph breaks
+    (or line breaks, or spaces) so that chunks rarely straddle two windows."""
+    buffer = ""
+    with open(path, encoding="utf-8") as f:
+        while block := f.read(window_chars):
+            buffer += block
+            if len(buffer) < window_chars:
+                continue
+            for separator in ("\n\n", "\n", " "):
+                cut = buffer.rfind(separator)
+                if cut > 0:
+                    break
+            else:
+                cut = len(buffer)
+            yield buffer[:cut]
+            buffer = buffer[cut:]
+    if buffer.strip():
+        yield buffer
+
+def iter_file_chunks(processed_path: Path, source: str, window_chars: int = INGEST_SPLIT_WINDOW_CHARS) -> Iterator[Document]:
+    """Lazily splits an extracted text file into chunks tagged with a deterministic `chunk_id` and
+    their `start_index` in the file.
+
+    Only one window of the file is held in memory at a time.
+    """
+    text_splitter = _text_splitter()
+    metadata = {"source": source, "processed_path": str(processed_path)}
+    # Keyed by text digest rather than text, to keep the per-file state small
+    occurrences = Counter()
+    # Windows are consecutive slices of the file
+    window_start = 0
+    for window in _iter_text_windows(Path(processed_path), window_chars):
+        cursor = 0
+        for text in text_splitter.split_text(window):
+            position = window.find(text, cursor)
+            if position < 0:
+                position = cursor
+            cursor = position + 1
+            key = hashlib.sha256(text.encode("utf-8")).digest()
+            chunk_metadata = {
+                **metadata,
+                "chunk_id": _chunk_id(source, text, occurrences[key]),
+                "start_index": window_start + position,
+            }
+            occurrences[key] += 1
+            yield Document(page_content=text, metadata=chunk_metadata)
+        window_start += len(window)
+
+def split_timed_text(parts: List[dict], source: str, processed_path: Path, occurrences: Counter) -> List[Document]:
+    """Splits timed transcript parts ({"start", "end", "text"}) into chunks carrying the
+    `start_time` and `end_time` of the audio they cover.
+
+    `occurrences` is shared across the calls made for one file so chunk ids stay deterministic.
+    """
+    text = "".join(part["text"] for part in parts)
+    part_ends = []
+    offset = 0
+    for part in parts:
+        offset += len(part["text"])
+        part_ends.append(offset)
+
+    chunks = []
+    cursor = 0
+    for chunk_text in _text_splitter().split_text(text):
+        position = text.find(chunk_text, cursor)
+        if position < 0:
+            position = cursor
+        cursor = position + 1
+        first = min(bisect.bisect_right(part_ends, position), len(parts) - 1)
+        last = min(bisect.bisect_left(part_ends, position + len(chunk_text)), len(parts) - 1)
+        key = hashlib.sha256(chunk_text.encode("utf-8")).digest()
+        chunks.append(Document(page_content=chunk_text, metadata={
+            "source": source,
+            "processed_path": str(processed_path),
+            "chunk_id": _chunk_id(source, chunk_text, occurrences[key]),
+            "start_time": round(parts[first]["start"], 2),
+            "end_time": round(parts[last]["end"], 2),
+        }))
+        occurrences[key] += 1
+    return chunks
+
+def _batched(items: Iterable, size: int) -> Iterator[list]:
+    iterator = iter(items)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+def _create_shard(directory: Path, shared: bool = INDEX_SHARED) -> SegmentedIndex:
+    return SegmentedIndex(
+        directory,
+        _get_embedding_model,
+        INDEX_COMPACTION_THRESHOLD,
+        index_type=INDEX_TYPE,
+        promotion_threshold=INDEX_PROMOTION_THRESHOLD,
+        recall_sample_size=INDEX_RECALL_SAMPLE_SIZE,
+        shared=shared,
+        refresh_interval=INDEX_REFRESH_INTERVAL_SECONDS,
+        tombstone_ratio=INDEX_TOMBSTONE_RATIO,
+    )
+
+def _get_registry() -> CollectionRegistry:
+    global _registry
+    if _registry is not None:
+        return _registry
+    with _init_lock:
+        if _registry is not None:
+            return _registry
+        if INDEX_TYPE not in INDEX_TYPES:
+            raise ValueError(f"Unsupported INDEX_TYPE '{INDEX_TYPE}'. Expected one of {', '.join(INDEX_TYPES)}.")
+        _registry = CollectionRegistry(_create_shard, MAX_LOADED_COLLECTIONS, COLLECTION_SEARCH_WORKERS)
+    return _registry
+
+def _loaded_index_size() -> int:
+    # Read at scrape time, without loading any collection
+    if _registry is None:
+        return 0
+    return _registry.loaded_chunk_count()
+
+metrics.INDEX_CHUNKS.set_function(_loaded_index_size)
+
+def list_collections() -> List[dict]:
+    """Lists the collections on disk and whether they are loaded."""
+    return _get_registry().describe()
+
+def load_collection(collection: str = DEFAULT_COLLECTION):
+    """Loads the shards of a collection from disk, if they are not loaded yet."""
+    with _get_registry().use(collection):
+        pass
+
+def get_index_version(collection: str = DEFAULT_COLLECTION):
+    """Returns a value that changes every time the collection changes."""
+    with _get_registry().use(collection) as target:
+        return target.version
+
+def get_index_stats(collection: str = DEFAULT_COLLECTION) -> dict:
+    """Returns the index type, size, persistence state and last recall report of every shard of a collection."""
+    with _get_registry().use(collection) as target:
+        return target.stats()
+
+def measure_index_recall(k: int = 5, collection: str = DEFAULT_COLLECTION) -> dict:
+    """Measures recall@k of each shard against exact flat search on a sample of stored vectors."""
+    with _get_registry().use(collection) as target:
+        return target.measure_recall(k)
+
+def similarity_search(query_vector, k: int, collection: str = DEFAULT_COLLECTION) -> List[Document]:
+    """Returns the k chunks of a collection closest to a query vector."""
+    with _get_registry().use(collection) as target:
+        return target.search(query_vector, k)
+
+def similarity_search_batch(query_vectors, k: int, collection: str = DEFAULT_COLLECTION) -> List[List[Document]]:
+    """Searches a matrix of query vectors at once and returns the top k chunks of each.
+
+    With several shards, every shard is searched in parallel and the results are merged.
+    """
+    with _get_registry().use(collection) as target:
+        return target.search_batch(query_vectors, k)
+
+def save_vector_store(collection: str = DEFAULT_COLLECTION):
+    """Persists the changes made to a collection since the last save as new index segments."""
+    with metrics.timed("index_save"), _get_registry().use(collection) as target:
+        target.flush()
+
+def compact_index(collection: str = DEFAULT_COLLECTION):
+    """Merges the segments of every shard of a collection into a new base."""
+    with _get_registry().use(collection) as target:
+        target.compact()
+
+def get_chunks(chunk_ids: Iterable[str], collection: str = DEFAULT_COLLECTION) -> Dict[str, Document]:
+    """Returns the stored chunks of a collection with these ids, by id."""
+    with _get_registry().use(collection) as target:
+        return target.get_documents(chunk_ids)
+
+def add_chunks_to_store(
+    chunks: List[Document], save: bool = True, collection: str = DEFAULT_COLLECTION, replace: bool = False
+) -> int:
+    """Embeds already-split chunks and adds them to a collection under their `chunk_id`.
+
+    Chunks whose id is already stored are skipped, or with `replace` embedded again and swapped in
+    for the stored ones once their new vectors are computed. Returns the number of chunks added.
+    """
+    with _get_registry().use(collection) as target:
+        stored_ids = [chunk.metadata["chunk_id"] for chunk in chunks if target.contains(chunk.metadata["chunk_id"])]
+        if not replace:
+            stored = set(stored_ids)
+            chunks = [chunk for chunk in chunks if chunk.metadata["chunk_id"] not in stored]
+            stored_ids = []
+        if not chunks:
+            logger.info("No new chunks to add to the vector store.")
+            return 0
+
+        embedding_model = _get_embedding_model()
+        texts = [chunk.page_content for chunk in chunks]
+
+        try:
+            logger.info(f"Adding {len(chunks)} chunks to collection '{collection}'.")
+            with metrics.timed("embed"):
+                vectors = embedding_model.embed_documents(texts)
+            with metrics.timed("index_add"):
+                if stored_ids:
+                    target.delete(stored_ids)
+                target.add(
+                    texts,
+                    vectors,
+                    [chunk.metadata for chunk in chunks],
+                    [chunk.metadata["chunk_id"] for chunk in chunks],
                 )
-                logger.info("FAISS index loaded successfully.")
-            except Exception as e:
-                logger.error(f"Failed to load FAISS index: {e}", exc_info=True)
-                _vector_store = None
-        else:
-            logger.info(f"FAISS index not found at {FAISS_INDEX_FILE}. A new store will be created when documents are added.")
-            _vector_store = None
-    return _vector_store
-
-def add_documents_to_store(documents: List[Document]):
-    """Splits documents, generates embeddings, and adds them to the FAISS store, saving the result."""
+            metrics.CHUNKS.labels("added").inc(len(chunks))
+            logger.info("Chunks added to the store.")
+
+            if save:
+                save_vector_store(collection)
+
+        except Exception as e:
+            logger.error(f"Failed to add documents or save FAISS index: {e}", exc_info=True)
+            raise
+
+    return len(chunks)
+
+def delete_chunks(chunk_ids: Iterable[str], save: bool = True, collection: str = DEFAULT_COLLECTION) -> int:
+    """Removes chunks from a collection by id, ignoring unknown ids. Returns the number removed."""
+    with _get_registry().use(collection) as target:
+        removed = target.delete(list(chunk_ids))
+        if not removed:
+            return 0
+        metrics.CHUNKS.labels("removed").inc(removed)
+        logger.info(f"Deleted {removed} chunks from collection '{collection}'.")
+        if save:
+            save_vector_store(collection)
+    return removed
+
+def index_source_chunks(
+    chunks: Iterable[Document],
+    previous_chunk_ids: Iterable[str],
+    batch_size: int = INGEST_EMBED_BATCH_SIZE,
+    save: bool = True,
+    collection: str = DEFAULT_COLLECTION,
+    reembed: bool = False,
+    remove_stale: bool = True,
+) -> Tuple[int, int, List[str]]:
+    """Indexes a new version of a source from a (possibly lazy) chunk stream, embedding only
+    chunks that changed since the previous version, `batch_size` chunks at a time.
+
+    With `reembed`, the chunks of the previous version are embedded again and replace the stored
+    ones (the embedding model changed). Without `remove_stale`, the chunks of the previous version
+    that the new one no longer has are left for the caller to remove.
+
+    Returns the number of chunks added and removed, and the ids of all chunks of the new version.
+    If a batch fails, the chunks already added for the new version are removed again before the
+    error is raised, so the collection is left as it was.
+    """
+    previous_chunk_ids = set(previous_chunk_ids)
+    chunk_ids = []
+    added = 0
+    unsaved = 0
+    try:
+        # Reading and splitting happen lazily, while the batches are pulled
+        for batch in metrics.timed_iter("split", _batched(chunks, batch_size)):
+            chunk_ids.extend(chunk.metadata["chunk_id"] for chunk in batch)
+            batch_added = add_chunks_to_store(
+                batch if reembed else [chunk for chunk in batch if chunk.metadata["chunk_id"] not in previous_chunk_ids],
+                save=False,
+                collection=collection,
+                replace=reembed,
+            )
+            added += batch_added
+            unsaved += batch_added
+            # Persist along the way so pending segment data does not grow with the file
+            if unsaved >= INGEST_FLUSH_CHUNKS:
+                save_vector_store(collection)
+                unsaved = 0
+    except Exception:
+        try:
+            delete_chunks(set(chunk_ids) - previous_chunk_ids, save=save, collection=collection)
+        except Exception as e:
+            logger.error(f"Failed to remove the partially indexed chunks from collection '{collection}': {e}", exc_info=True)
+        raise
+    removed = 0
+    if remove_stale:
+        removed = delete_chunks(previous_chunk_ids.difference(chunk_ids), save=False, collection=collection)
+    if save and (added or removed):
+        save_vector_store(collection)
+    return added, removed, chunk_ids
+
+def replace_source_chunks(
+    chunks: List[Document],
+    previous_chunk_ids: Iterable[str],
+    save: bool = True,
+    collection: str = DEFAULT_COLLECTION,
+) -> Tuple[int, int]:
+    """Indexes a new version of a source, embedding only chunks that changed since the previous version.
+
+    Returns the number of chunks added and removed.
+    """
+    added, removed, _ = index_source_chunks(chunks, previous_chunk_ids, save=save, collection=collection)
+    return added, removed
+
+def add_documents_to_store(documents: List[Document], save: bool = True, collection: str = DEFAULT_COLLECTION) -> int:
+    """Splits documents, generates embeddings, and adds them to a collection.
+
+    The index is saved to disk unless `save` is False, which lets callers batch
+    several additions behind a single `save_vector_store` call.
+    Returns the number of chunks added.
+    """
     if not documents:
         logger.warning("No documents provided to add to the vector store.")
-        return
+        return 0
+    return add_chunks_to_store(_split_documents(documents), save=save, collection=collection)
 
-    global _vector_store
-    embedding_model = _get_embedding_model()
-    chunks = _split_documents(documents)
+# --- Rebuild ---
+def create_rebuild_target(collection: str = DEFAULT_COLLECTION) -> Collection:
+    """Returns an empty staging collection with the shard count of `collection`, to rebuild it into."""
+    with _get_registry().use(collection) as target:
+        shard_count = target.shard_count
+    # Only this process writes the staging index, it needs no file locks
+    return _get_registry().create_staging(collection, shard_count, partial(_create_shard, shared=False))
 
-    try:
-        if _vector_store is None:
-            # new store if it doesn't exist
-            logger.info("Creating a new FAISS vector store.")
-            _vector_store = FAISS.from_documents(chunks, embedding_model)
-            logger.info("New FAISS store created.")
-        else:
-            # add documents to the existing store
-            logger.info(f"Adding {len(chunks)} chunks to the existing FAISS store.")
-            _vector_store.add_documents(chunks)
-            logger.info("Chunks added to the existing store.")
-
-        # saving updated index
-        logger.info(f"Saving FAISS index to: {FAISS_INDEX_FILE}")
-        _vector_store.save_local(str(FAISS_INDEX_DIR), index_name="beautirag_index")
-        logger.info("FAISS index saved successfully.")
-
-    except Exception as e:
-        logger.error(f"Failed to add documents or save FAISS index: {e}", exc_info=True)
-
-get_vector_store()
+def install_rebuilt(staged: Collection, collection: str = DEFAULT_COLLECTION):
+    """Swaps the bases written by a staged rebuild (`Collection.write_base`) in as the content of a
+    collection, then removes the staging directory."""
+    with _get_registry().use(collection) as target:
+        target.install(staged)
+    discard_rebuild_target(staged)
+
+def discard_rebuild_target(staged: Collection):
+    staged.close()
+    shutil.rmtree(staged.directory, ignore_errors=True)
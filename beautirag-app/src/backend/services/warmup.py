@@ -0,0 +1,105 @@
+import logging
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from . import ingestion_jobs, vector_store_manager
+from ..core.config import DEFAULT_COLLECTION, STARTUP_MODE, WARMUP_WHISPER
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+STARTUP_MODES = ("lazy", "eager", "background")
+
+STATUS_PENDING = "pending"
+STATUS_LOADING = "loading"
+STATUS_READY = "ready"
+STATUS_FAILED = "failed"
+
+
+def _warm_up_embedding_model():
+    # Embedding one query also initialises the model's inference kernels
+    vector_store_manager.embed_query("warmup")
+
+
+def _warm_up_vector_store():
+    # Other collections are loaded on first use
+    vector_store_manager.load_collection(DEFAULT_COLLECTION)
+
+
+# Components loaded by a warmup, in order. The Whisper model lives in the parse worker processes,
+# so warming it up starts those workers, each loading the model once.
+_COMPONENTS: Dict[str, Callable[[], None]] = {
+    "embedding_model": _warm_up_embedding_model,
+    "vector_store": _warm_up_vector_store,
+}
+if WARMUP_WHISPER:
+    _COMPONENTS["whisper_model"] = ingestion_jobs.warm_up_parse_pool
+
+_status: Dict[str, Dict] = {name: {"status": STATUS_PENDING, "seconds": None, "error": None} for name in _COMPONENTS}
+_timings: Dict[str, float] = {}
+_lock = threading.Lock()
+_warmup_thread: Optional[threading.Thread] = None
+
+
+def record_timing(name: str, seconds: float):
+    """Records a startup timing (e.g. module imports) reported by `status`."""
+    _timings[name] = round(seconds, 3)
+
+
+def warm_up(components: Optional[List[str]] = None) -> Dict:
+    """Loads the given components (all by default) in the calling thread. Already loaded ones are skipped."""
+    names = components or list(_COMPONENTS)
+    unknown = [name for name in names if name not in _COMPONENTS]
+    if unknown:
+        raise ValueError(f"Unknown warmup component(s): {', '.join(unknown)}. Expected {', '.join(_COMPONENTS)}.")
+
+    start = time.perf_counter()
+    for name in names:
+        with _lock:
+            if _status[name]["status"] == STATUS_READY:
+                continue
+            _status[name] = {"status": STATUS_LOADING, "seconds": None, "error": None}
+        component_start = time.perf_counter()
+        try:
+            _COMPONENTS[name]()
+            state = {"status": STATUS_READY, "error": None}
+        except Exception as e:
+            logger.error(f"Warmup of '{name}' failed: {e}", exc_info=True)
+            state = {"status": STATUS_FAILED, "error": str(e)}
+        state["seconds"] = round(time.perf_counter() - component_start, 3)
+        with _lock:
+            _status[name] = state
+        logger.info(f"Warmup of '{name}': {state['status']} in {state['seconds']}s.")
+    record_timing("warmup", time.perf_counter() - start)
+    return status()
+
+
+def start_background_warmup() -> bool:
+    """Runs `warm_up` in a daemon thread. Returns False if a warmup thread is already running."""
+    global _warmup_thread
+    with _lock:
+        if _warmup_thread is not None and _warmup_thread.is_alive():
+            return False
+        _warmup_thread = threading.Thread(target=warm_up, name="warmup", daemon=True)
+        _warmup_thread.start()
+    return True
+
+
+def is_ready() -> bool:
+    """In lazy mode the service is always ready; otherwise once every warmup component is loaded."""
+    if STARTUP_MODE not in ("eager", "background"):
+        return True
+    with _lock:
+        return all(state["status"] == STATUS_READY for state in _status.values())
+
+
+def status() -> Dict:
+    with _lock:
+        components = {name: dict(state) for name, state in _status.items()}
+    return {
+        "ready": is_ready(),
+        "startup_mode": STARTUP_MODE,
+        "components": components,
+        "timings_seconds": dict(_timings),
+    }
@@ -0,0 +1,46 @@
+import os
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+# The configuration is read when `backend` is first imported, so the data directory of the test
+# session is set before any test module imports it
+_DATA_DIR = tempfile.mkdtemp(prefix="beautirag-tests-")
+os.environ["DATA_DIR"] = _DATA_DIR
+os.environ["STARTUP_MODE"] = "lazy"
+os.environ["INGEST_PARSE_WORKERS"] = "1"
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+
+EMBEDDING_DIM = 64
+
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(_DATA_DIR, ignore_errors=True)
+
+
+@pytest.fixture(scope="session", autouse=True)
+def stub_models():
+    """Hashing embeddings and an instant fake LLM instead of the real models."""
+    from backend.benchmarks import stubs
+
+    stubs.install(EMBEDDING_DIM, llm_latency_seconds=0.0, llm_tokens_per_second=10_000)
+
+
+@pytest.fixture
+def embeddings():
+    from backend.benchmarks.stubs import HashingEmbeddings
+
+    return HashingEmbeddings(EMBEDDING_DIM)
+
+
+@pytest.fixture(scope="session")
+def client():
+    from fastapi.testclient import TestClient
+
+    from backend.main import app
+
+    with TestClient(app) as test_client:
+        yield test_client
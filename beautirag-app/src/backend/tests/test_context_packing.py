@@ -0,0 +1,72 @@
+from langchain_core.documents import Document
+
+from backend.services.context_packing import CHARS_PER_TOKEN, estimate_tokens, pack_context
+
+
+def _text(name: str, words: int) -> str:
+    return " ".join(f"{name}{number}" for number in range(words))
+
+
+def _chunk(source: str, text: str, start_index=None, chunk_id=None) -> Document:
+    metadata = {"source": source, "chunk_id": chunk_id or f"{source}-{start_index}"}
+    if start_index is not None:
+        metadata["start_index"] = start_index
+    return Document(page_content=text, metadata=metadata)
+
+
+def _tokens(documents) -> int:
+    return sum(estimate_tokens(document.page_content) for document in documents)
+
+
+def test_packed_context_stays_within_the_budget():
+    # About 90, 90, 90 and 10 tokens, most relevant first
+    documents = [_chunk(f"doc{number}.txt", _text(f"d{number}w", 60)) for number in range(3)]
+    documents.append(_chunk("short.txt", _text("s", 15)))
+
+    packed = pack_context(documents, token_budget=250)
+
+    assert _tokens(packed) <= 250
+    # The third passage does not fit, the shorter one after it does
+    assert [document.metadata["source"] for document in packed] == ["doc0.txt", "doc1.txt", "short.txt"]
+
+
+def test_most_relevant_passage_is_truncated_to_the_budget():
+    documents = [_chunk("long.txt", _text("w", 500)), _chunk("other.txt", _text("o", 10))]
+
+    packed = pack_context(documents, token_budget=50)
+
+    assert len(packed) == 1
+    assert packed[0].metadata["source"] == "long.txt"
+    assert len(packed[0].page_content) == 50 * CHARS_PER_TOKEN
+    assert _tokens(packed) <= 50
+
+
+def test_adjacent_chunks_of_a_source_are_merged():
+    text = _text("w", 200)
+    first, second = text[:600], text[500:1100]
+    documents = [
+        _chunk("doc.txt", second, start_index=500),
+        _chunk("other.txt", _text("o", 10)),
+        _chunk("doc.txt", first, start_index=0),
+    ]
+
+    packed = pack_context(documents, token_budget=1_000)
+
+    assert [document.metadata["source"] for document in packed] == ["doc.txt", "other.txt"]
+    assert packed[0].page_content == text[:1100]
+    assert packed[0].metadata["chunk_ids"] == ["doc.txt-500", "doc.txt-0"]
+    # The overlap is only counted once
+    assert _tokens(packed) < _tokens(documents)
+
+
+def test_near_duplicate_passages_are_dropped():
+    text = _text("w", 100)
+    documents = [
+        _chunk("a.txt", text),
+        _chunk("copy.txt", text + " trailing"),
+        _chunk("b.txt", _text("b", 20)),
+    ]
+
+    packed = pack_context(documents, token_budget=1_000)
+
+    assert [document.metadata["source"] for document in packed] == ["a.txt", "b.txt"]
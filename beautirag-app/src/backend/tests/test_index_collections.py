@@ -0,0 +1,147 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from backend.services import index_collections
+from backend.services.index_collections import Collection, CollectionNotFoundError, CollectionRegistry, _shard_of
+from backend.services.index_segments import SegmentedIndex
+
+SHARDS = 3
+
+
+@pytest.fixture
+def search_executor():
+    with ThreadPoolExecutor(max_workers=SHARDS) as executor:
+        yield executor
+
+
+def _index_factory(embeddings):
+    return lambda directory: SegmentedIndex(directory, lambda: embeddings, compaction_threshold=1_000)
+
+
+def _open(directory, embeddings, search_executor, shard_count=None) -> Collection:
+    collection = Collection("test", directory, _index_factory(embeddings), search_executor, shard_count=shard_count)
+    collection.ensure_loaded()
+    return collection
+
+
+def _fill(collection: Collection, count: int, dim: int):
+    vectors = np.random.default_rng(0).random((count, dim), dtype=np.float32)
+    ids = [f"chunk-{number}" for number in range(count)]
+    collection.add([f"text {number}" for number in range(count)], vectors, [{"number": number} for number in range(count)], ids)
+    return ids, vectors
+
+
+def test_shard_of_is_stable_and_spreads_ids():
+    ids = [f"chunk-{number}" for number in range(3_000)]
+    shards = [_shard_of(chunk_id, SHARDS) for chunk_id in ids]
+    assert shards == [_shard_of(chunk_id, SHARDS) for chunk_id in ids]
+    assert all(shard in range(SHARDS) for shard in shards)
+    assert min(np.bincount(shards)) > 800
+    assert {_shard_of(chunk_id, 1) for chunk_id in ids} == {0}
+
+
+def test_chunks_are_routed_to_the_shard_of_their_id(tmp_path, embeddings, search_executor):
+    collection = _open(tmp_path, embeddings, search_executor, shard_count=SHARDS)
+    ids, _ = _fill(collection, 90, embeddings.dim)
+
+    for shard_number, shard in enumerate(collection.shards):
+        assert shard.directory == tmp_path / f"shard-{shard_number:02d}"
+        stored = set(shard.store.index_to_docstore_id.values())
+        assert stored == {chunk_id for chunk_id in ids if _shard_of(chunk_id, SHARDS) == shard_number}
+    assert collection.chunk_count() == 90
+    assert all(collection.contains(chunk_id) for chunk_id in ids)
+
+    assert collection.delete(ids[:10]) == 10
+    assert collection.chunk_count() == 80
+    assert not any(collection.contains(chunk_id) for chunk_id in ids[:10])
+
+
+def test_shard_count_is_kept_when_reopened(tmp_path, embeddings, search_executor):
+    collection = _open(tmp_path, embeddings, search_executor, shard_count=SHARDS)
+    ids, _ = _fill(collection, 30, embeddings.dim)
+    collection.close()
+
+    reopened = _open(tmp_path, embeddings, search_executor)
+    assert reopened.shard_count == SHARDS
+    assert set(reopened.get_documents(ids)) == set(ids)
+
+
+def test_search_merges_the_shards_by_distance(tmp_path, embeddings, search_executor):
+    collection = _open(tmp_path, embeddings, search_executor, shard_count=SHARDS)
+    ids, vectors = _fill(collection, 200, embeddings.dim)
+    queries = np.random.default_rng(1).random((5, embeddings.dim), dtype=np.float32)
+
+    results = collection.search_batch(queries, k=10)
+
+    for query, documents in zip(queries, results):
+        # Flat shards are exact, so the merged top k is the exact top k over the whole collection
+        distances = ((vectors - query) ** 2).sum(axis=1)
+        expected = [ids[position] for position in np.argsort(distances)[:10]]
+        assert [f"chunk-{document.metadata['number']}" for document in documents] == expected
+
+
+def test_search_of_an_empty_collection_fails(tmp_path, embeddings, search_executor):
+    collection = _open(tmp_path, embeddings, search_executor, shard_count=SHARDS)
+    with pytest.raises(RuntimeError):
+        collection.search(embeddings.embed_query("anything"), k=3)
+
+
+@pytest.fixture
+def registry(tmp_path, monkeypatch, embeddings):
+    monkeypatch.setattr(index_collections, "COLLECTIONS_DIR", tmp_path)
+    registry = CollectionRegistry(_index_factory(embeddings), max_loaded=1, search_workers=2)
+    yield registry
+    registry._search_executor.shutdown()
+
+
+def test_registry_does_not_create_unknown_collections(registry, tmp_path):
+    with pytest.raises(CollectionNotFoundError):
+        with registry.use("unknown"):
+            pass
+    assert not (tmp_path / "unknown").exists()
+
+    index_collections.create_collection("created")
+    with registry.use("created") as collection:
+        assert collection.chunk_count() == 0
+
+
+def test_registry_reloads_a_collection_only_once_it_is_persisted(registry, embeddings):
+    for name in ("first", "second"):
+        index_collections.create_collection(name)
+    with registry.use("first") as collection:
+        _fill(collection, 20, embeddings.dim)
+        close = collection.close
+        closing = threading.Event()
+        release = threading.Event()
+
+        def slow_close():
+            closing.set()
+            release.wait(5)
+            close()
+
+        collection.close = slow_close
+
+    # Using another collection unloads the first one, persisting it outside the registry lock
+    unloader = threading.Thread(target=_reload, args=(registry, "second"))
+    unloader.start()
+    assert closing.wait(5)
+    reloaded = []
+    reloader = threading.Thread(target=lambda: reloaded.append(_reload(registry, "first")))
+    reloader.start()
+    reloader.join(0.2)
+    assert reloader.is_alive()
+    # Other collections stay usable meanwhile
+    assert _reload(registry, "second") == 0
+
+    release.set()
+    reloader.join(5)
+    unloader.join(5)
+    assert reloaded == [20]
+
+
+def _reload(registry: CollectionRegistry, name: str) -> int:
+    with registry.use(name) as collection:
+        return collection.chunk_count()
@@ -0,0 +1,112 @@
+import numpy as np
+
+from backend.services.index_segments import SegmentedIndex
+
+
+def _open(directory, embeddings) -> SegmentedIndex:
+    # No automatic compaction, tests compact explicitly
+    index = SegmentedIndex(directory, lambda: embeddings, compaction_threshold=1_000)
+    index.load()
+    return index
+
+
+def _add(index: SegmentedIndex, embeddings, names):
+    texts = [f"chunk about {name}" for name in names]
+    index.add(texts, np.asarray(embeddings.embed_documents(texts)), [{"source": name} for name in names], list(names))
+
+
+def _stored_ids(index: SegmentedIndex):
+    return {chunk_id for chunk_id in index.store.index_to_docstore_id.values() if chunk_id in index.store.docstore}
+
+
+def test_flushed_chunks_are_replayed_from_the_log_after_a_crash(tmp_path, embeddings):
+    index = _open(tmp_path, embeddings)
+    _add(index, embeddings, ["apples", "pears"])
+    index.flush()
+    _add(index, embeddings, ["plums"])
+    index.flush()
+    # Crash: the index is never closed, so no base was written
+    assert not any(path.name.startswith("base-") for path in tmp_path.iterdir())
+
+    reopened = _open(tmp_path, embeddings)
+    assert reopened.chunk_count() == 3
+    assert _stored_ids(reopened) == {"apples", "pears", "plums"}
+    hits = reopened.store.similarity_search_by_vector(embeddings.embed_query("chunk about pears"), k=1)
+    assert hits[0].metadata["source"] == "pears"
+
+
+def test_unflushed_chunks_are_lost_in_a_crash(tmp_path, embeddings):
+    index = _open(tmp_path, embeddings)
+    _add(index, embeddings, ["apples"])
+    index.flush()
+    _add(index, embeddings, ["pears"])
+
+    reopened = _open(tmp_path, embeddings)
+    assert _stored_ids(reopened) == {"apples"}
+
+
+def test_torn_log_record_is_truncated_on_replay(tmp_path, embeddings):
+    index = _open(tmp_path, embeddings)
+    _add(index, embeddings, ["apples"])
+    index.flush()
+    wal_path = index._wal_path
+    valid_size = wal_path.stat().st_size
+    with open(wal_path, "ab") as f:
+        f.write(b'{"seq": 2, "op": "del')
+
+    reopened = _open(tmp_path, embeddings)
+    assert _stored_ids(reopened) == {"apples"}
+    assert wal_path.stat().st_size == valid_size
+
+    # Later records follow the valid ones
+    _add(reopened, embeddings, ["pears"])
+    reopened.flush()
+    assert _stored_ids(_open(tmp_path, embeddings)) == {"apples", "pears"}
+
+
+def test_deletes_survive_reload(tmp_path, embeddings):
+    index = _open(tmp_path, embeddings)
+    _add(index, embeddings, ["apples", "pears", "plums"])
+    index.flush()
+    assert index.delete(["pears", "unknown"]) == 1
+    index.flush()
+
+    reopened = _open(tmp_path, embeddings)
+    assert reopened.chunk_count() == 2
+    assert _stored_ids(reopened) == {"apples", "plums"}
+    hits = reopened.store.similarity_search_by_vector(embeddings.embed_query("chunk about pears"), k=3)
+    assert "pears" not in {hit.metadata["source"] for hit in hits}
+
+
+def test_deletes_survive_compaction_and_reload(tmp_path, embeddings):
+    index = _open(tmp_path, embeddings)
+    _add(index, embeddings, ["apples", "pears", "plums", "figs"])
+    index.flush()
+    index.compact()
+    index.delete(["pears", "figs"])
+    assert index.tombstone_count() == 2
+
+    # Compaction flushes the pending deletes, then rebuilds the base without their vectors
+    index.compact()
+    assert index.tombstone_count() == 0
+    assert index.store.index.ntotal == 2
+    assert _stored_ids(index) == {"apples", "plums"}
+    index.close()
+
+    reopened = _open(tmp_path, embeddings)
+    assert reopened.chunk_count() == 2
+    assert _stored_ids(reopened) == {"apples", "plums"}
+    # The log records covered by the base are dropped
+    assert reopened._read_wal() == []
+
+
+def test_operations_after_compaction_are_replayed_on_top_of_the_base(tmp_path, embeddings):
+    index = _open(tmp_path, embeddings)
+    _add(index, embeddings, ["apples", "pears"])
+    index.compact()
+    index.delete(["apples"])
+    _add(index, embeddings, ["plums"])
+    index.flush()
+
+    reopened = _open(tmp_path, embeddings)
+    assert _stored_ids(reopened) == {"pears", "plums"}
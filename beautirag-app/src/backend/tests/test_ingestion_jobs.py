@@ -0,0 +1,182 @@
+import time
+import uuid
+
+import pytest
+
+from backend.services import embedding_backends, ingestion_jobs, ingestion_manifest, vector_store_manager
+from backend.services.index_collections import collection_incoming_dir, collection_upload_dir
+
+CSV = ("name,description\n" + "".join(f"row{number},description of row {number}\n" for number in range(40))).encode()
+BROKEN_PDF = b"%PDF-1.4\n1 0 obj\n<< /Type /Catalog"
+# Enough rows for several embedding batches
+LARGE_CSV = ("name,description\n" + "".join(f"row{number},a longer description of row {number}\n" for number in range(20_000))).encode()
+
+
+@pytest.fixture
+def collection():
+    return f"jobs-{uuid.uuid4().hex[:8]}"
+
+
+def _upload(client, collection, files):
+    response = client.post("/upload/", files=[("files", file) for file in files], data={"collection": collection})
+    assert response.status_code == 202
+    return response.json()
+
+
+def _wait(client, job_id, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = client.get(f"/jobs/{job_id}").json()
+        if job["status"] not in (ingestion_jobs.JOB_QUEUED, ingestion_jobs.JOB_RUNNING):
+            return job
+        time.sleep(0.05)
+    raise TimeoutError(f"Job {job_id} did not finish")
+
+
+def _documents(client, collection):
+    return {document["filename"]: document for document in client.get("/documents", params={"collection": collection}).json()["documents"]}
+
+
+def test_job_runs_until_completed(client, collection):
+    queued = _upload(client, collection, [("rows.csv", CSV)])
+    assert queued["queued_files"] == ["rows.csv"]
+    assert client.get(f"/jobs/{queued['job_id']}").json()["status"] in (
+        ingestion_jobs.JOB_QUEUED, ingestion_jobs.JOB_RUNNING, ingestion_jobs.JOB_COMPLETED
+    )
+
+    job = _wait(client, queued["job_id"])
+
+    assert job["status"] == ingestion_jobs.JOB_COMPLETED
+    assert job["files"] == {"rows.csv": ingestion_jobs.FILE_INDEXED}
+    assert job["chunks"] > 0
+    assert job["percent"] == 100.0
+    assert job["finished_at"] >= job["started_at"]
+    assert _documents(client, collection)["rows.csv"]["chunks"] == job["chunks"]
+    # The staged upload is moved to the upload directory once indexed
+    assert (collection_upload_dir(collection) / "rows.csv").read_bytes() == CSV
+    assert not any(collection_incoming_dir(collection).iterdir())
+
+
+def test_job_with_a_failed_file_completes_with_errors(client, collection):
+    job = _wait(client, _upload(client, collection, [("rows.csv", CSV), ("broken.pdf", BROKEN_PDF)])["job_id"])
+
+    assert job["status"] == ingestion_jobs.JOB_COMPLETED_WITH_ERRORS
+    assert job["files"] == {"rows.csv": ingestion_jobs.FILE_INDEXED, "broken.pdf": ingestion_jobs.FILE_FAILED}
+    assert job["failed_files"] == ["broken.pdf"]
+    assert job["errors"]["broken.pdf"]
+    assert set(_documents(client, collection)) == {"rows.csv"}
+    assert not (collection_upload_dir(collection) / "broken.pdf").exists()
+
+
+def test_job_without_indexed_files_fails(client, collection):
+    job = _wait(client, _upload(client, collection, [("broken.pdf", BROKEN_PDF)])["job_id"])
+
+    assert job["status"] == ingestion_jobs.JOB_FAILED
+    assert job["files"] == {"broken.pdf": ingestion_jobs.FILE_FAILED}
+
+
+def test_identical_reupload_is_skipped(client, collection):
+    _wait(client, _upload(client, collection, [("rows.csv", CSV)])["job_id"])
+
+    queued = _upload(client, collection, [("rows.csv", CSV)])
+
+    assert queued["job_id"] is None
+    assert queued["skipped_files"] == ["rows.csv"]
+
+
+def test_upload_of_a_file_being_ingested_is_rejected(client, collection):
+    assert ingestion_manifest.claim("rows.csv", "in-flight", collection) == ingestion_manifest.CLAIMED
+    try:
+        queued = _upload(client, collection, [("rows.csv", CSV), ("other.csv", CSV)])
+        assert queued["busy_files"] == ["rows.csv"]
+        assert queued["queued_files"] == ["other.csv"]
+        response = client.put("/documents/rows.csv", files={"file": ("rows.csv", CSV)}, data={"collection": collection})
+        assert response.status_code == 409
+    finally:
+        ingestion_manifest.release("rows.csv", collection)
+    _wait(client, queued["job_id"])
+
+
+def test_failed_submission_releases_the_claimed_names(client, collection, monkeypatch):
+    def failing_create_collection(name):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(ingestion_jobs, "create_collection", failing_create_collection)
+    response = client.post("/upload/", files=[("files", ("rows.csv", CSV))], data={"collection": collection})
+    monkeypatch.undo()
+
+    assert response.status_code == 500
+    assert not any(collection_incoming_dir(collection).glob("*/rows.csv"))
+    job = _wait(client, _upload(client, collection, [("rows.csv", CSV)])["job_id"])
+    assert job["status"] == ingestion_jobs.JOB_COMPLETED
+
+
+def test_failed_replace_keeps_the_indexed_version(client, collection):
+    _wait(client, _upload(client, collection, [("rows.csv", CSV)])["job_id"])
+    indexed = _documents(client, collection)["rows.csv"]
+
+    response = client.put("/documents/rows.csv", files={"file": ("rows.csv", b"\xff\xfe\x00broken")}, data={"collection": collection})
+    job = _wait(client, response.json()["job_id"])
+
+    assert job["status"] == ingestion_jobs.JOB_FAILED
+    assert _documents(client, collection)["rows.csv"] == indexed
+    assert (collection_upload_dir(collection) / "rows.csv").read_bytes() == CSV
+
+
+def test_failed_indexing_leaves_the_collection_unchanged(client, collection, monkeypatch):
+    _wait(client, _upload(client, collection, [("rows.csv", CSV)])["job_id"])
+    indexed = _documents(client, collection)["rows.csv"]
+    chunks = client.get("/index/stats", params={"collection": collection}).json()["chunks"]
+
+    model = vector_store_manager._get_embedding_model()
+    embed_documents = model.embed_documents
+    calls = []
+
+    def failing_embed_documents(texts):
+        calls.append(len(texts))
+        if len(calls) > 1:
+            raise RuntimeError("embedding backend unavailable")
+        return embed_documents(texts)
+
+    monkeypatch.setattr(model, "embed_documents", failing_embed_documents)
+    response = client.put("/documents/rows.csv", files={"file": ("rows.csv", LARGE_CSV)}, data={"collection": collection})
+    job = _wait(client, response.json()["job_id"])
+    monkeypatch.undo()
+
+    # The first batch was added before the failure, then removed again
+    assert len(calls) == 2
+    assert job["status"] == ingestion_jobs.JOB_FAILED
+    assert _documents(client, collection)["rows.csv"] == indexed
+    assert client.get("/index/stats", params={"collection": collection}).json()["chunks"] == chunks
+    hits = vector_store_manager.similarity_search(vector_store_manager.embed_query("a longer description of row 7"), k=50, collection=collection)
+    assert all("longer description" not in hit.page_content for hit in hits)
+
+
+def test_failed_reembedding_keeps_the_indexed_version(client, collection, monkeypatch):
+    _wait(client, _upload(client, collection, [("rows.csv", CSV)])["job_id"])
+    indexed = _documents(client, collection)["rows.csv"]
+    model = vector_store_manager._get_embedding_model()
+
+    def failing_embed_documents(texts):
+        raise RuntimeError("embedding backend unavailable")
+
+    # Another embedding model makes the same content be embedded again
+    monkeypatch.setattr(embedding_backends, "model_key", lambda *args, **kwargs: "other-model")
+    with monkeypatch.context() as patched:
+        patched.setattr(model, "embed_documents", failing_embed_documents)
+        job = _wait(client, _upload(client, collection, [("rows.csv", CSV)])["job_id"])
+
+    assert job["status"] == ingestion_jobs.JOB_FAILED
+    assert _documents(client, collection)["rows.csv"] == indexed
+    assert client.get("/index/stats", params={"collection": collection}).json()["chunks"] == indexed["chunks"]
+
+    job = _wait(client, _upload(client, collection, [("rows.csv", CSV)])["job_id"])
+    assert job["status"] == ingestion_jobs.JOB_COMPLETED
+    assert (job["chunks"], job["chunks_removed"]) == (indexed["chunks"], 0)
+    assert client.get("/index/stats", params={"collection": collection}).json()["chunks"] == indexed["chunks"]
+
+
+def test_unknown_collection_is_not_found(client, collection):
+    assert client.post("/query/", json={"query": "rows", "collection": collection}).status_code == 404
+    assert client.get("/index/stats", params={"collection": collection}).status_code == 404
+    assert collection not in {entry["collection"] for entry in client.get("/collections").json()["collections"]}
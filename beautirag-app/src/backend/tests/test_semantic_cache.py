@@ -0,0 +1,69 @@
+from langchain_core.documents import Document
+
+from backend.services import semantic_cache, vector_store_manager
+from backend.services.index_collections import create_collection
+from backend.services.semantic_cache import SemanticCache
+
+ANSWER_KEY = ("gpt-4o", 5, 2000)
+
+
+def _cache(index_version) -> SemanticCache:
+    return SemanticCache(threshold=0.95, max_entries=10, ttl=3600, index_version_getter=lambda: index_version[0])
+
+
+def test_similar_query_hits_for_the_same_answer_key(embeddings):
+    index_version = [1]
+    cache = _cache(index_version)
+    cache.store(ANSWER_KEY, "what is a pear", embeddings.embed_query("what is a pear"), "a fruit", [], 1)
+
+    hit = cache.lookup(ANSWER_KEY, embeddings.embed_query("What is a pear?"))
+    assert hit["answer"] == "a fruit"
+    assert cache.lookup(("gpt-4o", 10, 2000), embeddings.embed_query("what is a pear")) is None
+    assert cache.lookup(ANSWER_KEY, embeddings.embed_query("how are plums grown")) is None
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_index_version_change_clears_the_cache(embeddings):
+    index_version = [1]
+    cache = _cache(index_version)
+    vector = embeddings.embed_query("what is a pear")
+    cache.store(ANSWER_KEY, "what is a pear", vector, "a fruit", [], 1)
+
+    index_version[0] = 2
+    assert cache.lookup(ANSWER_KEY, vector) is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_answer_of_a_query_started_before_an_index_change_is_not_stored(embeddings):
+    index_version = [2]
+    cache = _cache(index_version)
+    vector = embeddings.embed_query("what is a pear")
+    cache.store(ANSWER_KEY, "what is a pear", vector, "a stale fruit", [], 1)
+
+    assert cache.lookup(ANSWER_KEY, vector) is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_collection_cache_is_invalidated_by_indexing(embeddings):
+    collection = "semantic-cache"
+    create_collection(collection)
+    vector_store_manager.add_chunks_to_store(
+        [Document(page_content="pears are fruits", metadata={"source": "pears.txt", "chunk_id": "pears"})],
+        collection=collection,
+    )
+    cache = semantic_cache.get_semantic_cache(collection)
+    vector = embeddings.embed_query("what is a pear")
+    cache.store(ANSWER_KEY, "what is a pear", vector, "a fruit", [], vector_store_manager.get_index_version(collection))
+    assert cache.lookup(ANSWER_KEY, vector)["answer"] == "a fruit"
+
+    vector_store_manager.add_chunks_to_store(
+        [Document(page_content="plums are fruits", metadata={"source": "plums.txt", "chunk_id": "plums"})],
+        collection=collection,
+    )
+    assert cache.lookup(ANSWER_KEY, vector) is None
+
+    # Other collections keep their entries
+    other = semantic_cache.get_semantic_cache("default")
+    other.store(ANSWER_KEY, "what is a pear", vector, "a fruit", [], vector_store_manager.get_index_version("default"))
+    vector_store_manager.delete_chunks(["plums"], collection=collection)
+    assert other.lookup(ANSWER_KEY, vector)["answer"] == "a fruit"
@@ -50,9 +50,15 @@ const ChatInterface: React.FC<ChatInterfaceProps> = ({ selectedModel, apiKey })
     };
     setMessages(prevMessages => [...prevMessages, loadingBotMessage]);
 
+    const updateBotMessage = (text: string, isLoading: boolean) => {
+      setMessages(prevMessages =>
+        prevMessages.map(msg => (msg.id === loadingBotMessage.id ? { ...msg, text, isLoading } : msg))
+      );
+    };
+
     try {
       const backendUrl = process.env.NEXT_PUBLIC_BACKEND_URL || 'http://localhost:8000';
-      const response = await fetch(`${backendUrl}/query/`, {
+      const response = await fetch(`${backendUrl}/query/stream`, {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
@@ -64,25 +70,45 @@ const ChatInterface: React.FC<ChatInterfaceProps> = ({ selectedModel, apiKey })
         }),
       });
 
-      const result = await response.json();
-
-      let botResponseText: string;
-      if (!response.ok) {
+      if (!response.ok || !response.body) {
+        const result = await response.json();
         console.error('Query error:', result.detail);
-        botResponseText = `Error: ${result.detail || 'Failed to get response'}`;
-      } else {
-        botResponseText = result.response;
+        updateBotMessage(`Error: ${result.detail || 'Failed to get response'}`, false);
+        return;
       }
 
-      const finalBotMessage: Message = {
-        id: loadingBotMessage.id,
-        text: botResponseText,
-        sender: 'bot',
-      };
+      // Read server-sent events and append tokens as they arrive
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+      let botResponseText = '';
+
+      while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        const events = buffer.split('\n\n');
+        buffer = events.pop() || '';
+        for (const rawEvent of events) {
+          const eventName = rawEvent.match(/^event: (.*)$/m)?.[1];
+          const data = JSON.parse(rawEvent.match(/^data: (.*)$/m)?.[1] || '{}');
+          if (eventName === 'token') {
+            botResponseText += data.token;
+            updateBotMessage(botResponseText, false);
+          } else if (eventName === 'error') {
+            console.error('Query error:', data.detail);
+            botResponseText = `Error: ${data.detail || 'Failed to get response'}`;
+            updateBotMessage(botResponseText, false);
+          } else if (eventName === 'done') {
+            console.log('Query timings:', data);
+          }
+        }
+      }
 
-      setMessages(prevMessages =>
-        prevMessages.map(msg => (msg.id === finalBotMessage.id ? finalBotMessage : msg))
-      );
+      if (!botResponseText) {
+        updateBotMessage('Error: Empty response', false);
+      }
 
     } catch (error) {
       console.error('Failed to fetch query response:', error);
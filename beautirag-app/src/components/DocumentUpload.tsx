@@ -11,6 +11,9 @@ const UploadIcon = () => (
 
 type UploadStatus = 'idle' | 'uploading' | 'success' | 'error';
 
+const JOB_POLL_INTERVAL_MS = 1000;
+const FINISHED_JOB_STATES = ['completed', 'completed_with_errors', 'failed'];
+
 const DocumentUpload: React.FC = () => {
   const [uploadedFiles, setUploadedFiles] = useState<File[]>([]);
   const [status, setStatus] = useState<UploadStatus>('idle');
@@ -41,11 +44,42 @@ const DocumentUpload: React.FC = () => {
         throw new Error(result.detail || 'Upload failed');
       }
 
+      console.log('Upload accepted:', result);
+      setMessage(result.message || 'Processing...');
+
+      if (!result.job_id) {
+        // Every file was already indexed, nothing to process
+        setStatus('success');
+        return;
+      }
+
+      // Poll the ingestion job until parsing and indexing are done
+      let job = result;
+      while (!FINISHED_JOB_STATES.includes(job.status)) {
+        await new Promise(resolve => setTimeout(resolve, JOB_POLL_INTERVAL_MS));
+        const jobResponse = await fetch(`${backendUrl}/jobs/${result.job_id}`);
+        job = await jobResponse.json();
+        if (!jobResponse.ok) {
+          throw new Error(job.detail || 'Failed to get processing status');
+        }
+        setMessage(`Processing... ${job.files_done}/${job.files_total} file(s) done`);
+      }
+
+      if (job.status === 'failed') {
+        throw new Error(`Failed to process: ${Object.keys(job.errors).join(', ')}`);
+      }
+
       setStatus('success');
-      setMessage(result.message || 'Files uploaded successfully!');
+      const failedCount = job.failed_files.length + result.failed_files.length;
+      const skippedCount = result.skipped_files.length;
+      setMessage(
+        `Processed ${job.files_total - job.failed_files.length} file(s) successfully.` +
+        (skippedCount ? ` ${skippedCount} already indexed.` : '') +
+        (failedCount ? ` ${failedCount} failed.` : '')
+      );
       
       // setUploadedFiles([]);
-      console.log('Upload successful:', result);
+      console.log('Processing finished:', job);
 
     } catch (error) {
       console.error('Upload error:', error);
@@ -62,6 +96,7 @@ const DocumentUpload: React.FC = () => {
       'application/vnd.openxmlformats-officedocument.wordprocessingml.document': ['.docx'],
       'image/png': ['.png'],
       'image/jpeg': ['.jpeg', '.jpg'],
+      'image/tiff': ['.tif', '.tiff'],
       'audio/mpeg': ['.mp3'],
       'audio/wav': ['.wav'],
     }